@@ -1,4 +1,6 @@
-users ={
+from shared.storage import open_repository
+
+users = open_repository("auth_users", seed={
     "migo":{
         "name" : "migo",
         "age":32,
@@ -11,4 +13,4 @@ users ={
         "address":"GC",
         "hashed_password":'$2b$12$RP1qtEXm1NYS8aTbWBKj0eSzB1p67hHOmiFqTHULWKUzsdMGz.bxq'
     }
-}
\ No newline at end of file
+})
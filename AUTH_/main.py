@@ -1,27 +1,43 @@
 from fastapi import FastAPI,Request,Depends,status,Form
-from fastapi.encoders import jsonable_encoder
 from fastapi.security import OAuth2PasswordRequestForm
-from fastapi.templating import Jinja2Templates
 from fastapi.responses import HTMLResponse,RedirectResponse,Response
-from fastapi_login import LoginManager
 import os
+import sys
 from dotenv import load_dotenv
-from db import users
-from utils import get_hashed_password,verify_password
 from datetime import timedelta
+
+BASEDIR = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(os.path.dirname(BASEDIR)) #repository root, for the shared package
+
+from shared.auth import CachedLoginManager
+from shared.directory import Taken,UserDirectory
+from shared.hashing import HasherBusy,hasher_busy_handler
+from shared.metrics import install as install_metrics
+from shared.records import record_type
+from shared.rendering import CachedTemplates
+from db import users
+from utils import authenticate,get_hashed_password
 from schema import UserIn, UserDB
 
+user_records = record_type(UserDB) #stored users are validated read-only dicts
+
 #Basic config
-BASEDIR = os.path.abspath(os.path.dirname(__file__))
 load_dotenv()
-templates = Jinja2Templates(directory=BASEDIR+"/templates")
+templates = CachedTemplates(directory=BASEDIR+"/templates")
+
+
+#Unique username index for registration
+directory = UserDirectory(users,email_field=None)
 
 
 #initialization of application
 app = FastAPI()
+app.add_exception_handler(HasherBusy,hasher_busy_handler) #503 + Retry-After when too many hashes are queued
+install_metrics(app) #per-route latency and in-flight requests, served at /metrics
 
 
-manager = LoginManager(secret="SECRET",token_url='/login',use_cookie=True)
+manager = CachedLoginManager(secret="SECRET",token_url='/login',use_cookie=True) #Remembers the user per token until it expires
+manager.follow(users) #or until the user's record changes, in any worker
 manager.cookie_name="AUTH"  #This is given in Request.cookies : dict
 @manager.user_loader() #How are you going to load a user object?
 def user_loader(username):
@@ -29,18 +45,26 @@ def user_loader(username):
         return UserDB(**users[username])
 
 
+def store_rehashed_password(username:str,old_hash:str,new_hash:str)->bool:
+    user = users.get(username)
+    if user is None or user.get("hashed_password") != old_hash: #changed while we were hashing: keep the newer one
+        return False
+    users[username] = user_records.merge(user,{"hashed_password":new_hash})
+    return True
+
+
 @app.get(path="/login",response_class=HTMLResponse)
 def login_page(request:Request):
-    return templates.TemplateResponse('login.html',{"request":request,"title":"AUTH - Login"},status_code=200)
+    return templates.StaticResponse('login.html',{"request":request,"title":"AUTH - Login"},status_code=200)
 
 @app.post(path='/login',response_class=Response)
-def login(request: Request,user_info:OAuth2PasswordRequestForm = Depends()):
+async def login(request: Request,user_info:OAuth2PasswordRequestForm = Depends()):
     username = user_info.username
     password = user_info.password
     
     #User validation
-    if username not in users or not verify_password(password,users[username].get("hashed_password")): 
-        return templates.TemplateResponse("login.html",{"request":request,"title":"AUTH - Login","invalid":False})
+    if username not in users or not await authenticate(username,password,users[username].get("hashed_password"),on_rehash=store_rehashed_password): 
+        return templates.StaticResponse("login.html",{"request":request,"title":"AUTH - Login","invalid":False})
     
     #Token generation
     token = manager.create_access_token(data={"sub":username},expires=timedelta(minutes=30))
@@ -63,18 +87,15 @@ def logout(user =Depends(manager)):
 
 
 @app.post('/register')
-def registration(request:Request,password:str=Form(...),user:UserIn=Depends(UserIn.as_form)):
-    hashed_password = get_hashed_password(password)
-    
-    invalid=False
-    #Check if username is already taken
-    for db_name in users.keys():
-        if user.name == db_name :
-            invalid = True
-    if invalid:
+async def registration(request:Request,password:str=Form(...),user:UserIn=Depends(UserIn.as_form)):
+    try:
+        #Check (and hold) the username before hashing
+        with directory.reserve(user.name) as reservation:
+            hashed_password = await get_hashed_password(password)
+            reservation.commit(user_records.merge(user.dict(),{"hashed_password":hashed_password})) #UserIn already validated the rest
+    except Taken:
         return Response(status_code=status.HTTP_400_BAD_REQUEST)
     
-    users[user.name] = jsonable_encoder(UserDB(**user.dict(),hashed_password=hashed_password))
     resp = RedirectResponse('/login',status_code=status.HTTP_302_FOUND)
     return resp
 
@@ -23,4 +23,7 @@ class UserIn(BaseModel):
     
 class UserDB(User):
     hashed_password :str
+
+    class Config:
+        frozen = True #Loaded users are cached and shared between requests
     
\ No newline at end of file
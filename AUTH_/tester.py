@@ -1,3 +1,4 @@
+import asyncio
 import unittest
 from fastapi.testclient import TestClient
 from main import app
@@ -36,6 +37,42 @@ class TestAuth(unittest.TestCase):
         self.assertEqual(200,response.status_code)
         self.assertEqual({"a":"b"},response.json())
     
+    def test_principal_cache(self):
+        from main import manager
+        self.test_login_post()
+        token = self.app.cookies.get_dict().get("AUTH")
+        self.assertEqual(200,self.app.get('/protected').status_code)
+        signature = token.rpartition(".")[2]
+        self.assertIn(signature,manager._principals) #Next requests skip the JWT decode and the user_loader
+        self.assertEqual(200,self.app.get('/protected').status_code)
+        
+        manager.forget("migo")
+        self.assertNotIn(signature,manager._principals)
+
+    def test_principal_cache_follows_writes(self):
+        from main import manager, users
+        self.test_login_post()
+        token = self.app.cookies.get_dict().get("AUTH")
+        signature = token.rpartition(".")[2]
+        self.assertEqual(200,self.app.get('/protected').status_code)
+        users["migo"] = users["migo"] #like a write from another worker
+        self.assertNotIn(signature,manager._principals)
+
+    def test_user_loaded_while_forgotten_is_not_cached(self):
+        from main import manager
+        token = manager.create_access_token(data={"sub":"migo"})
+        load_user = manager._load_user
+        async def slow_load(subject): #the user changes while it is being loaded
+            user = await load_user(subject)
+            manager.forget(subject)
+            return user
+        manager._load_user = slow_load
+        try:
+            asyncio.run(manager.get_current_user(token))
+        finally:
+            manager._load_user = load_user
+        self.assertNotIn(token.rpartition(".")[2],manager._principals)
+        
     def test_logout(self):
         response = self.app.get('/logout') #Logout without login.
         self.assertEqual(401,response.status_code) #unauthorized
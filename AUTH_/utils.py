@@ -1,12 +1,14 @@
-from passlib.context import CryptContext
+from shared.hashing import PasswordHasher
 
-pass_ctx = CryptContext(schemes=["bcrypt"])
+hasher = PasswordHasher() #bcrypt runs in a bounded process pool, not in the request handler
 
 
-def get_hashed_password(plain_text:str)->str:
-    return pass_ctx.hash(plain_text)
-
-def verify_password(plain_text:str,hashed_password)->bool:
-    return pass_ctx.verify(plain_text,hashed_password)
+async def get_hashed_password(plain_text:str)->str:
+    return await hasher.hash(plain_text)
 
+async def verify_password(plain_text:str,hashed_password)->bool:
+    return await hasher.verify(plain_text,hashed_password)
 
+async def authenticate(username:str,plain_text:str,hashed_password:str,on_rehash=None)->bool:
+    #Repeated logins are answered from a short-lived cache; outdated hashes are upgraded in the background
+    return await hasher.authenticate(username,plain_text,hashed_password,on_rehash=on_rehash)
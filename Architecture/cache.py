@@ -0,0 +1,227 @@
+"""
+Response cache for GET routes.
+
+Mark an endpoint when you define it, under the router decorator:
+
+    @router.get('/{item_id}')
+    @response_cache.cached(ttl=60, tags=["item:{item_id}"])
+    async def read_item(item_id:str): ...
+
+    @router.put('/{item_id}')
+    @response_cache.invalidates("items", "item:{item_id}")
+    async def update_item(item_id:str): ...
+
+CacheMiddleware (installed on the app) matches each request to its route the way the router
+would. For a cached route it answers from the stored status, headers and body bytes, without
+running the dependencies, the endpoint or the serialization. On a miss the response is recorded
+on its way out. A route that `invalidates` clears its tags after any 2xx response. Tags may name
+path params ("item:{item_id}").
+
+Entries are keyed by route, path params, query string and the `vary` headers. They expire after
+`ttl` seconds and are evicted least recently used first, past `max_entries` or `max_bytes`.
+
+Only mark routes whose response depends on nothing else. A hit skips the route's dependencies,
+so auth checks included.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+from urllib.parse import parse_qsl
+
+from starlette.routing import Match
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+Headers = List[Tuple[bytes, bytes]]
+
+
+class Policy:
+    __slots__ = ("ttl", "vary", "tags")
+
+    def __init__(self, ttl: float, vary: Iterable[str], tags: Iterable[str]):
+        self.ttl = ttl
+        self.vary = tuple(header.lower().encode("latin-1") for header in vary)
+        self.tags = tuple(tags)
+
+
+class Entry:
+    __slots__ = ("expires", "tags", "status", "headers", "body")
+
+    def __init__(self, expires: float, tags: Tuple[str, ...], status: int, headers: Headers, body: bytes):
+        self.expires = expires
+        self.tags = tags
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+
+class ResponseCache:
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 16 * 1024 * 1024, max_entry_bytes: int = 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes  # larger responses are passed through, not stored
+        self._entries: "OrderedDict[tuple, Entry]" = OrderedDict()
+        self._tags: Dict[str, Set[tuple]] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()  # sync endpoints run on the threadpool and may invalidate
+        self.policies: Dict[Callable, Policy] = {}
+        self.invalidations: Dict[Callable, Tuple[str, ...]] = {}
+        self.hits = self.misses = 0
+        self.generation = 0  # bumped by every invalidation
+
+    # marking endpoints
+    def cached(self, ttl: float = 60, vary: Iterable[str] = (), tags: Iterable[str] = ()):
+        """Caches the GET responses of this endpoint for `ttl` seconds, per value of the `vary` headers."""
+        def mark(endpoint: Callable) -> Callable:
+            self.policies[endpoint] = Policy(ttl, vary, tags)
+            return endpoint
+        return mark
+
+    def invalidates(self, *tags: str):
+        """Clears these tags when the endpoint answers with a 2xx, before the answer is sent."""
+        def mark(endpoint: Callable) -> Callable:
+            self.invalidations[endpoint] = tags
+            return endpoint
+        return mark
+
+    # entries
+    def get(self, key: tuple) -> Optional[Entry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry.expires <= time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: tuple, entry: Entry, generation: Optional[int] = None) -> None:
+        """Stores an entry, unless something was invalidated since `generation` (it may be stale)."""
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self._bytes += len(entry.body)
+            for tag in entry.tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: tuple) -> None:
+        entry = self._entries.pop(key)
+        self._bytes -= len(entry.body)
+        for tag in entry.tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def invalidate(self, *tags: str) -> int:
+        """Drops every entry with one of these tags. Returns how many were dropped."""
+        with self._lock:
+            self.generation += 1
+            keys = set()
+            for tag in tags:
+                keys |= self._tags.get(tag, set())
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._tags.clear()
+            self._bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def _format(tags: Iterable[str], path_params: dict) -> Tuple[str, ...]:
+    return tuple(tag.format(**path_params) if "{" in tag else tag for tag in tags)
+
+
+def _route(scope: Scope):
+    """The route the router would pick for this request, and its path params."""
+    for route in scope["app"].router.routes:
+        match, child_scope = route.matches(scope)
+        if match == Match.FULL:
+            return route, child_scope.get("path_params", {})
+    return None, None
+
+
+class CacheMiddleware:
+    def __init__(self, app: ASGIApp, cache: ResponseCache):
+        self.app = app
+        self.cache = cache
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        cache = self.cache
+        if scope["type"] != "http" or not (cache.policies or cache.invalidations):
+            return await self.app(scope, receive, send)
+        route, path_params = _route(scope)
+        endpoint = getattr(route, "endpoint", None)
+
+        if scope["method"] == "GET" and endpoint in cache.policies:
+            policy = cache.policies[endpoint]
+            headers = dict(scope["headers"])
+            key = (
+                endpoint,
+                tuple(sorted(path_params.items())),
+                tuple(sorted(parse_qsl(scope["query_string"].decode("latin-1"), keep_blank_values=True))),
+                tuple(headers.get(name) for name in policy.vary),
+            )
+            entry = cache.get(key)
+            if entry is not None:
+                await send({"type": "http.response.start", "status": entry.status, "headers": entry.headers + [(b"x-cache", b"HIT")]})
+                await send({"type": "http.response.body", "body": entry.body})
+                return
+            return await self._record(scope, receive, send, key, policy, path_params)
+
+        if endpoint in cache.invalidations:
+            async def watch(message: Message) -> None:
+                # before the client hears of the change, or its next GET could still be a HIT
+                if message["type"] == "http.response.start" and 200 <= message["status"] < 300:
+                    cache.invalidate(*_format(cache.invalidations[endpoint], path_params))
+                await send(message)
+
+            return await self.app(scope, receive, watch)
+
+        await self.app(scope, receive, send)
+
+    async def _record(self, scope: Scope, receive: Receive, send: Send, key: tuple, policy: Policy, path_params: dict) -> None:
+        start: Optional[Message] = None
+        chunks: List[bytes] = []
+        size = 0
+        generation = self.cache.generation
+
+        async def record(message: Message) -> None:
+            nonlocal start, size
+            if message["type"] == "http.response.start":
+                start = message
+                message = {**message, "headers": list(message.get("headers", [])) + [(b"x-cache", b"MISS")]}
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+                size += len(chunks[-1])
+            await send(message)
+
+        await self.app(scope, receive, record)
+        if start is None or start["status"] != 200 or size > self.cache.max_entry_bytes:
+            return
+        headers = list(start.get("headers", []))
+        if any(name == b"set-cookie" for name, _ in headers):
+            return  # per-user responses aren't shared
+        self.cache.put(key, Entry(time.monotonic() + policy.ttl, _format(policy.tags, path_params),
+                                  start["status"], headers, b"".join(chunks)), generation)
+
+
+response_cache = ResponseCache()  # the one the routers mark their endpoints on
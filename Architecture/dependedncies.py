@@ -3,6 +3,11 @@ Here, I'm using an invented header to simplify the example.
 """
 
 from fastapi import Header,HTTPException
+from token_auth import HeaderToken,TokenAuth
+
+#The admin router is checked by TokenAuthMiddleware with this, before routing. get_token_header below
+#does the same check as a dependency, for routes that want it.
+admin_tokens = TokenAuth({"/admin":HeaderToken("x-token",["fake-user-secret-token"])})
 
 async def get_token_header(x_token:str = Header(...)):
     if x_token != "fake-user-secret-token":
@@ -1,7 +1,48 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+from starlette.concurrency import run_in_threadpool
+from dependedncies import admin_tokens
+from internal.profiling import MAX_SECONDS, allocations, sampler
 
 router = APIRouter()
 
 @router.post('/')
 async def update_admin():
-    return {"message":"Admin getting schwifty"}
\ No newline at end of file
+    return {"message":"Admin getting schwifty"}
+
+@router.get('/auth')
+async def auth_timings():
+    return admin_tokens.stats() #per prefix: allowed, rejected and what the token check cost
+
+@router.post('/profile',status_code=202)
+async def start_profile(seconds:float = Query(10,gt=0,le=MAX_SECONDS), interval_ms:float = Query(5,ge=1,le=1000)):
+    if not sampler.start(seconds,interval_ms/1000):
+        raise HTTPException(status_code=409,detail="Already profiling")
+    return sampler.status()
+
+@router.delete('/profile')
+async def stop_profile():
+    await run_in_threadpool(sampler.stop) #joins the sampling thread
+    return sampler.status()
+
+@router.get('/profile',response_class=PlainTextResponse)
+async def read_profile():
+    #collapsed stacks so far: `flamegraph.pl`, `inferno-flamegraph` or speedscope.app draw them
+    status = sampler.status()
+    headers = {"X-Profile-Running":str(status["running"]).lower(),"X-Profile-Samples":str(status["samples"])}
+    return PlainTextResponse(sampler.collapsed(),headers=headers)
+
+@router.post('/allocations',status_code=202)
+async def start_allocations(seconds:float = Query(30,gt=0,le=MAX_SECONDS), snapshots:int = Query(3,ge=0,le=100)):
+    if not allocations.start(seconds,snapshots):
+        raise HTTPException(status_code=409,detail="Already tracing allocations")
+    return allocations.report()
+
+@router.delete('/allocations')
+async def stop_allocations():
+    await run_in_threadpool(allocations.stop) #tracemalloc.stop() frees every trace
+    return allocations.report()
+
+@router.get('/allocations')
+async def read_allocations(top:int = Query(10,ge=1,le=100)):
+    return allocations.report(top) #per endpoint: memory left allocated per request, and where
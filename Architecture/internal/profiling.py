@@ -0,0 +1,258 @@
+"""
+Profiling a running worker, switched on and off from the admin router.
+
+- StackSampler: a daemon thread that wakes every `interval` seconds, reads every other thread's
+  current frame with sys._current_frames() and counts the stacks it sees, for a fixed number of
+  seconds. That includes the event loop and the threadpool that runs sync endpoints. Nothing is
+  hooked into the code being profiled, so it costs nothing while off and one stack walk per
+  thread per tick while on. `collapsed()` returns one "thread;outer;...;inner count" line per
+  stack: the input flamegraph.pl, inferno and speedscope take.
+  Threads waiting for work (idle pool workers, the loop in select) are counted apart, not drawn.
+- AllocationProfiler: for a fixed number of seconds, traces allocations with tracemalloc and, in
+  ProfilingMiddleware, attributes them to endpoints: how much memory each request left
+  allocated and, for the first few requests per endpoint, the lines that allocated it (the
+  difference between snapshots taken before and after). tracemalloc slows every allocation in
+  the process, so it is only started for the window and stopped after. Snapshots include what
+  concurrent requests allocated meanwhile: read them under light traffic. Snapshots and their
+  diffs are slow, so the middleware takes them on the threadpool.
+"""
+
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+MAX_SECONDS = 300
+IDLE = {  # leaf frames of threads waiting for something to do
+    "threading:Condition.wait",
+    "selectors:EpollSelector.select",
+    "selectors:KqueueSelector.select",
+    "selectors:PollSelector.select",
+    "selectors:SelectSelector.select",
+}
+
+
+# stacks
+class StackSampler:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._labels: Dict[object, str] = {}  # code object -> "module:qualname"
+        self.stacks: "Counter[Tuple[str, ...]]" = Counter()
+        self.samples = self.idle = 0
+        self.interval = 0.0
+        self.started = self.stopped = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds: float, interval: float = 0.005) -> bool:
+        """Samples for `seconds` (at most MAX_SECONDS), in the background. False if already running."""
+        with self._lock:
+            if self.running:
+                return False
+            self.stacks = Counter()
+            self.samples = self.idle = 0
+            self.interval = interval
+            self.started, self.stopped = time.time(), 0.0
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, args=(min(seconds, MAX_SECONDS), interval),
+                                            name="stack-sampler", daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self) -> None:
+        self._stop.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def _label(self, frame) -> str:
+        code = frame.f_code
+        label = self._labels.get(code)
+        if label is None:
+            name = getattr(code, "co_qualname", code.co_name)
+            label = self._labels[code] = f"{frame.f_globals.get('__name__', '?')}:{name}".replace(";", ":")
+        return label
+
+    def _run(self, seconds: float, interval: float) -> None:
+        own = threading.get_ident()
+        names: Dict[int, str] = {}
+        deadline = time.monotonic() + seconds
+        while not self._stop.is_set() and time.monotonic() < deadline:
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack: List[str] = []
+                while frame is not None:
+                    stack.append(self._label(frame))
+                    frame = frame.f_back
+                if stack[0] in IDLE:
+                    self.idle += 1
+                    continue
+                name = names.get(ident)
+                if name is None:
+                    names = {thread.ident: thread.name.replace(";", ":") for thread in threading.enumerate()}
+                    name = names.get(ident, str(ident))
+                stack.append(name)
+                stack.reverse()  # outermost first
+                self.stacks[tuple(stack)] += 1
+            self.samples += 1
+            self._stop.wait(interval)
+        self.stopped = time.time()
+
+    def collapsed(self) -> str:
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in self.stacks.most_common())
+
+    def status(self) -> dict:
+        return {"running": self.running, "started": self.started or None, "stopped": self.stopped or None,
+                "interval": self.interval, "samples": self.samples, "idle_stacks": self.idle,
+                "busy_stacks": sum(self.stacks.values())}
+
+
+# allocations
+class EndpointAllocations:
+    __slots__ = ("requests", "retained", "snapshots", "sites")
+
+    def __init__(self):
+        self.requests = self.retained = self.snapshots = 0
+        self.sites: "Counter[str]" = Counter()  # "file:line" -> bytes still allocated after the request
+
+    def as_dict(self, top: int) -> dict:
+        return {"requests": self.requests,
+                "retained_bytes_per_request": self.retained // self.requests if self.requests else 0,
+                "snapshots": self.snapshots,
+                "top": [{"site": site, "bytes": size} for site, size in self.sites.most_common(top) if size > 0]}
+
+
+class AllocationProfiler:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._timer: Optional[threading.Timer] = None
+        self._started_tracing = False
+        self.until = 0.0  # monotonic; the middleware only checks this while off
+        self.snapshots = 0
+        self.endpoints: Dict[str, EndpointAllocations] = {}
+
+    @property
+    def active(self) -> bool:
+        return time.monotonic() < self.until
+
+    def start(self, seconds: float, snapshots: int = 3, frames: int = 1) -> bool:
+        """
+        Attributes allocations to endpoints for `seconds` (at most MAX_SECONDS), with a snapshot
+        diff for the first `snapshots` requests of each. False if already running.
+        """
+        with self._lock:
+            if self.active:
+                return False
+            seconds = min(seconds, MAX_SECONDS)
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(frames)
+                self._started_tracing = True
+            self.snapshots = snapshots
+            self.endpoints = {}
+            self.until = time.monotonic() + seconds
+            self._timer = threading.Timer(seconds, self.stop)
+            self._timer.daemon = True
+            self._timer.start()
+            return True
+
+    def stop(self) -> None:
+        with self._lock:
+            self.until = 0.0
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if self._started_tracing:  # leave it on if someone else started it
+                tracemalloc.stop()
+                self._started_tracing = False
+
+    def endpoint(self, key: str) -> Tuple[EndpointAllocations, bool]:
+        """The endpoint's totals, and whether this request should be snapshotted."""
+        with self._lock:
+            allocations = self.endpoints.get(key)
+            if allocations is None:
+                allocations = self.endpoints[key] = EndpointAllocations()
+            snapshot = allocations.snapshots < self.snapshots
+            if snapshot:
+                allocations.snapshots += 1
+            return allocations, snapshot
+
+    def record(self, allocations: EndpointAllocations, retained: int,
+               before: Optional[tracemalloc.Snapshot], after: Optional[tracemalloc.Snapshot]) -> None:
+        sites = Counter()
+        if before is not None and after is not None:
+            for stat in _filter(after).compare_to(_filter(before), "lineno"):
+                frame = stat.traceback[0]
+                sites[f"{frame.filename}:{frame.lineno}"] += stat.size_diff
+        with self._lock:
+            allocations.requests += 1
+            allocations.retained += retained
+            allocations.sites.update(sites)
+
+    def report(self, top: int = 10) -> dict:
+        with self._lock:
+            endpoints = dict(self.endpoints)
+        return {"active": self.active, "seconds_left": round(max(0.0, self.until - time.monotonic()), 1),
+                "endpoints": {key: allocations.as_dict(top) for key, allocations in sorted(endpoints.items())}}
+
+
+def _filter(snapshot: tracemalloc.Snapshot) -> tracemalloc.Snapshot:
+    return snapshot.filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+    ])
+
+
+def _snapshot() -> Optional[tracemalloc.Snapshot]:
+    """None if the window closed: the timer may stop tracing at any point."""
+    if not tracemalloc.is_tracing():
+        return None
+    try:
+        return tracemalloc.take_snapshot()
+    except RuntimeError:  # stopped since the check
+        return None
+
+
+def _route_path(scope: Scope) -> str:
+    path = scope["path"]
+    for route in scope["app"].router.routes:  # in order, like the router
+        if route.path_regex.match(path):
+            return getattr(route, "path", "") or "/"
+    return "unmatched"
+
+
+class ProfilingMiddleware:
+    """Attributes allocations to endpoints while `allocations` is active; passes requests through otherwise."""
+
+    def __init__(self, app: ASGIApp, allocations: AllocationProfiler):
+        self.app = app
+        self.allocations = allocations
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        allocations = self.allocations
+        if scope["type"] != "http" or time.monotonic() >= allocations.until:
+            return await self.app(scope, receive, send)
+        endpoint, snapshot = allocations.endpoint(f"{scope['method']} {_route_path(scope)}")
+        before = await run_in_threadpool(_snapshot) if snapshot else None
+        start = tracemalloc.get_traced_memory()[0]
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            if tracemalloc.is_tracing():  # not if the window closed meanwhile
+                retained = tracemalloc.get_traced_memory()[0] - start
+                after = await run_in_threadpool(_snapshot) if snapshot else None
+                await run_in_threadpool(allocations.record, endpoint, retained, before, after)  # the diff
+
+
+sampler = StackSampler()
+allocations = AllocationProfiler()
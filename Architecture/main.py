@@ -5,27 +5,42 @@ You don't have to worry about performance when including routers. This will take
 microseconds and will only happen at startup, thereby not affecting performance.
 """
 
-from fastapi import FastAPI,Depends
-from dependedncies import get_query_token,get_token_header
+from fastapi import FastAPI
+import os
+import sys
+
+BASEDIR = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(os.path.dirname(BASEDIR)) #repository root, for the shared package
+
+from shared.hashing import HasherBusy,hasher_busy_handler
+from shared.metrics import install as install_metrics
+from cache import CacheMiddleware,response_cache
+from dependedncies import admin_tokens
+from token_auth import TokenAuthMiddleware
 from routers import items, users,auth
 from internal import admin
+from internal.profiling import ProfilingMiddleware,allocations
 from routers.auth import not_authenticated_exception_handler,NotAuthenticatedException,manager
 
 
 
 app=FastAPI() #Global dependencies
+app.add_middleware(CacheMiddleware,cache=response_cache) #answers cached GETs before routing
+app.add_middleware(TokenAuthMiddleware,auth=admin_tokens) #runs before the cache
+app.add_middleware(ProfilingMiddleware,allocations=allocations) #only does something while POST /admin/allocations is on
+install_metrics(app) #outermost: also times cache hits and rejected tokens. Served at /metrics
 
 app.include_router(users.router)
 app.include_router(items.router)
 app.include_router(
     admin.router,
     prefix="/admin",
-    tags=["admin"],
-    dependencies=[Depends(get_token_header)],
+    tags=["admin"], #X-Token is checked by TokenAuthMiddleware before routing
     responses={418:{"description":"I am a teapot"}}
     )
 app.include_router(auth.router)
 
 manager.not_authenticated_exception = NotAuthenticatedException
 app.add_exception_handler(NotAuthenticatedException, not_authenticated_exception_handler)
+app.add_exception_handler(HasherBusy,hasher_busy_handler) #503 + Retry-After when too many hashes are queued
 
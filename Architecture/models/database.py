@@ -1,4 +1,6 @@
-users = {
+from shared.storage import open_repository
+
+users = open_repository("architecture_users", seed={
     "migo":{
         "username":"migo",
         "hashed_password" : '$2b$12$zJ54POzdprwQdbrps2ir7ezFcxZCO60VgkfyeFHzpRm3WYzpynRDS'
@@ -11,4 +13,4 @@ users = {
         "username":"migo",
         "hashed_password" : '$2b$12$SiXUHrSyH7jdmtJHJm5CX.fcyiqOEFqmNfJsFq6WwTiUMbncgCVNO'
     }
-}
\ No newline at end of file
+})
@@ -1,31 +1,45 @@
 from datetime import timedelta
 from models.database import users
-from passlib.context import CryptContext
+from shared.hashing import PasswordHasher
 from fastapi import APIRouter,Depends,HTTPException ,Request
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.responses import RedirectResponse
 from schemas import UserDB
-from fastapi_login import LoginManager
+from shared.auth import CachedLoginManager
 import os 
 
 
 
-pwd_ctx = CryptContext(schemes=["bcrypt"])
+hasher = PasswordHasher() #bcrypt runs in a bounded process pool, not in the request handler
 
-def get_hashed_password(plain_password:str):
-    return pwd_ctx.hash(plain_password)
+async def get_hashed_password(plain_password:str):
+    return await hasher.hash(plain_password)
 
-def verify_password(plain_password,hashed_password):
-    return pwd_ctx.verify(plain_password,hashed_password)
+async def verify_password(plain_password,hashed_password):
+    return await hasher.verify(plain_password,hashed_password)
 
-def authenticate_user(username:str,password:str):
+def store_rehashed_password(username:str,old_hash:str,new_hash:str)->bool:
+    user = users.get(username)
+    if user is None or user.get("hashed_password") != old_hash: #changed while we were hashing: keep the newer one
+        return False
+    users[username] = {**user,"hashed_password":new_hash}
+    return True
+
+async def authenticate(username:str,password:str):
+    if username not in users:
+        return False
+    #Repeated logins are answered from a short-lived cache; outdated hashes are upgraded in the background
+    return await hasher.authenticate(username,password,users[username].get("hashed_password"),on_rehash=store_rehashed_password)
+
+def authenticate_user(username:str,password:str): #Blocking version, for code that isn't async
     if username not in users:
         return False
-    return verify_password(password,users[username].get("hashed_password"))
+    return hasher.verify_sync(password,users[username].get("hashed_password"))
 
 
 #
-manager = LoginManager(os.urandom(24).hex(),token_url="/login",use_cookie=True)
+manager = CachedLoginManager(os.urandom(24).hex(),token_url="/login",use_cookie=True) #Remembers the user per token until it expires
+manager.follow(users) #or until the user's record changes, in any worker
 manager.cookie_name ="Auth"
 @manager.user_loader()
 def user_loader(username):
@@ -50,10 +64,8 @@ def login_page():
     return {"Okay!":"Login page!"}
 
 @router.post('/')
-def login(user_info: OAuth2PasswordRequestForm = Depends()):
-    print("dssd")
-
-    if not authenticate_user(user_info.username, user_info.password):
+async def login(user_info: OAuth2PasswordRequestForm = Depends()):
+    if not await authenticate(user_info.username, user_info.password):
         raise HTTPException(status_code=404,detail="User Not Found")
     token = manager.create_access_token(data={"sub":user_info.username},expires=timedelta(minutes=30))
     response = RedirectResponse("/login",status_code=302)
@@ -6,34 +6,46 @@ You can think of APIRoter as a mini FastAPI class.
 """
 
 from fastapi import APIRouter, HTTPException
+from starlette.concurrency import run_in_threadpool
+from cache import response_cache
+from shared.responses import EncodedCache,FastJSONResponse
+from shared.storage import open_repository
 
 
 router = APIRouter(
     prefix='/items',
     tags =["items"],
-    responses={404: {"description":"Not found"}}
+    responses={404: {"description":"Not found"}},
+    default_response_class=FastJSONResponse #orjson, for this router only
 )
 
-fake_items_db ={"plumbus":{"name":"Plumbus"},"gun":{"name":"Portal Gun"}}
+fake_items_db = open_repository("architecture_items", seed={"plumbus":{"name":"Plumbus"},"gun":{"name":"Portal Gun"}})
+items_json = EncodedCache(fake_items_db) #encoded once, dropped when an item is replaced
+item_json = EncodedCache(fake_items_db, view=lambda item_id,item: {"name":item["name"], "item_id":item_id})
+fake_items_db.subscribe(lambda item_id,_: response_cache.invalidate("items",f"item:{item_id}")) #with DATA_DIR, other workers' writes must clear our cached responses too
 
 @router.get('/')
+@response_cache.cached(ttl=60,tags=["items"]) #served from memory until it expires or an item changes
 async def read_items():
-    return fake_items_db
+    return FastJSONResponse(items_json.all())
 
 @router.get('/{item_id}')
+@response_cache.cached(ttl=60,tags=["item:{item_id}"])
 async def read_item(item_id:str):
     if item_id not in fake_items_db:
         raise HTTPException(status_code=404, detail="Item Not found")
-    return {"name":fake_items_db[item_id]["name"], "item_id":item_id}
+    return FastJSONResponse(item_json[item_id])
 
 @router.put(
     '/{item_id}',
     tags=["custom"],
     responses={403: {"description":"Operation Forbidden"}}
     )
+@response_cache.invalidates("items","item:{item_id}") #cleared once the update succeeds
 async def update_item(item_id:str):
     if item_id != "plumbus":
         raise HTTPException(
             status_code=403, detail="You can only update the item: plumbus"
         )
+    await run_in_threadpool(fake_items_db.__setitem__,item_id,{"name":"The great Plumbus"}) #with DATA_DIR a write waits for its fsync
     return {"item_id":"item_id","name":"The great Plumbus"}
\ No newline at end of file
@@ -6,10 +6,13 @@ You can think of APIRoter as a mini FastAPI class.
 """
 
 from fastapi import APIRouter
+from cache import response_cache
+from shared.responses import FastJSONResponse
 
-router = APIRouter()
+router = APIRouter(default_response_class=FastJSONResponse)
 
 @router.get('/users', tags=["users"])  
+@response_cache.cached(ttl=300,tags=["users"])
 async def read_users():
     return [{"username":"Migo"},{"username":"Morty"}]
 
@@ -12,4 +12,7 @@ class UserIn(UserBase):
     pass
 
 class UserDB(UserBase):
-    hashed_password : str
\ No newline at end of file
+    hashed_password : str
+
+    class Config:
+        frozen = True #Loaded users are cached and shared between requests
\ No newline at end of file
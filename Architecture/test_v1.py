@@ -1,7 +1,14 @@
 import unittest
+from unittest import mock
 from fastapi.testclient import TestClient
 from main import app
 from routers.auth import authenticate_user
+from cache import Entry, ResponseCache, response_cache
+from token_auth import HeaderToken, TokenAuth
+from internal.profiling import StackSampler, allocations, sampler
+import threading
+import time
+import tracemalloc
 
 
 class TestAPI(unittest.TestCase):
@@ -36,5 +43,159 @@ class TestAPI(unittest.TestCase):
         
             
 
+class TestResponseCache(unittest.TestCase):
+    def setUp(self) -> None:
+        self.client = TestClient(app)
+        response_cache.clear()
+
+    def test_served_from_cache_until_updated(self):
+        first = self.client.get('/items/plumbus')
+        self.assertEqual("MISS", first.headers["x-cache"])
+        second = self.client.get('/items/plumbus')
+        self.assertEqual("HIT", second.headers["x-cache"])
+        self.assertEqual(first.content, second.content)
+        self.assertEqual("MISS", self.client.get('/items/plumbus', params={"a": 1}).headers["x-cache"]) #the query is part of the key
+        self.assertEqual("MISS", self.client.get('/items/gun').headers["x-cache"])
+
+        self.assertEqual(403, self.client.put('/items/gun').status_code) #failed updates don't invalidate
+        self.assertEqual("HIT", self.client.get('/items/gun').headers["x-cache"])
+        self.assertEqual(200, self.client.put('/items/plumbus').status_code)
+        response = self.client.get('/items/plumbus')
+        self.assertEqual("MISS", response.headers["x-cache"])
+        self.assertEqual("The great Plumbus", response.json()["name"])
+        self.assertEqual("HIT", self.client.get('/items/gun').headers["x-cache"])
+
+    def test_invalidated_before_the_answer_is_sent(self):
+        cached = []
+
+        async def client_side(scope, receive, send):
+            async def check(message):
+                if message["type"] == "http.response.start":
+                    cached.append(len(response_cache))
+                await send(message)
+            await app(scope, receive, check)
+
+        client = TestClient(client_side)
+        client.get('/items/plumbus')
+        self.assertEqual(200, client.put('/items/plumbus').status_code)
+        self.assertEqual([0, 0], cached) #nothing cached yet, then nothing left
+
+    def test_repository_writes_invalidate(self):
+        from routers.items import fake_items_db
+        self.client.get('/items/gun')
+        original = fake_items_db["gun"]
+        fake_items_db["gun"] = {"name": "Portal Gun 2"} #not through a handler, like a write from another worker
+        try:
+            response = self.client.get('/items/gun')
+            self.assertEqual("MISS", response.headers["x-cache"])
+            self.assertEqual("Portal Gun 2", response.json()["name"])
+        finally:
+            fake_items_db["gun"] = original
+
+    def test_errors_are_not_cached(self):
+        self.client.get('/items/nope')
+        self.assertEqual("MISS", self.client.get('/items/nope').headers["x-cache"])
+
+    def test_lru_ttl_and_tags(self):
+        cache = ResponseCache(max_entries=2)
+        entry = lambda ttl=60, tags=(): Entry(time.monotonic() + ttl, tags, 200, [], b"x")
+        cache.put("a", entry(tags=("t",)))
+        cache.put("b", entry())
+        cache.get("a")
+        cache.put("c", entry())
+        self.assertIsNone(cache.get("b")) #least recently used
+        self.assertEqual(1, cache.invalidate("t"))
+        self.assertIsNone(cache.get("a"))
+        cache.put("d", entry(ttl=-1))
+        self.assertIsNone(cache.get("d"))
+        generation = cache.generation
+        cache.invalidate("t")
+        cache.put("e", entry(), generation) #rendered before an invalidation: may be stale
+        self.assertIsNone(cache.get("e"))
+
+
+class TestTokenAuth(unittest.TestCase):
+    def setUp(self) -> None:
+        self.client = TestClient(app)
+
+    def test_admin_requires_token(self):
+        self.assertEqual(422, self.client.post('/admin/').status_code)
+        self.assertEqual(400, self.client.post('/admin/', headers={"X-Token": "wrong"}).status_code)
+        response = self.client.post('/admin/', headers={"X-Token": "fake-user-secret-token"})
+        self.assertEqual(200, response.status_code)
+        stats = self.client.get('/admin/auth', headers={"X-Token": "fake-user-secret-token"}).json()
+        self.assertGreaterEqual(stats["/admin"]["rejected"], 2)
+
+    def test_prefixes_match_whole_segments(self):
+        auth = TokenAuth({"/admin/": HeaderToken("x-token", ["a"]), "/admin/keys": HeaderToken("x-key", ["b"])})
+        self.assertEqual("/admin", auth.match("/admin")[0])
+        self.assertEqual("/admin/keys", auth.match("/admin/keys/1")[0]) #the longest prefix wins
+        self.assertEqual("/admin", auth.match("/admin/keysets")[0])
+        self.assertIsNone(auth.match("/administrator"))
+
+
+def spin(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+class TestProfiling(unittest.TestCase):
+    token = {"X-Token": "fake-user-secret-token"}
+
+    def setUp(self) -> None:
+        self.client = TestClient(app)
+
+    def test_sampler_sees_other_threads(self):
+        stop = threading.Event()
+        busy = threading.Thread(target=spin, args=(stop,), name="busy")
+        busy.start()
+        profiler = StackSampler()
+        self.assertTrue(profiler.start(0.2, 0.001))
+        self.assertFalse(profiler.start(1))
+        time.sleep(0.1)
+        profiler.stop()
+        stop.set()
+        busy.join()
+        self.assertFalse(profiler.running)
+        self.assertGreater(profiler.samples, 0)
+        lines = [line for line in profiler.collapsed().splitlines() if line.startswith("busy;")]
+        self.assertTrue(lines)
+        self.assertTrue(any(line.rsplit(" ", 1)[0].endswith("test_v1:spin") for line in lines))
+
+    def test_profile_endpoints(self):
+        self.assertEqual(422, self.client.post('/admin/profile').status_code)
+        response = self.client.post('/admin/profile?seconds=5&interval_ms=1', headers=self.token)
+        self.assertEqual(202, response.status_code)
+        self.assertTrue(response.json()["running"])
+        self.assertEqual(409, self.client.post('/admin/profile', headers=self.token).status_code)
+        self.assertFalse(self.client.delete('/admin/profile', headers=self.token).json()["running"])
+        response = self.client.get('/admin/profile', headers=self.token)
+        self.assertEqual("false", response.headers["x-profile-running"])
+        for line in response.text.splitlines():
+            self.assertRegex(line, r"^\S.* \d+$")
+
+    def test_allocations_by_endpoint(self):
+        response = self.client.post('/admin/allocations?seconds=5&snapshots=1', headers=self.token)
+        self.assertEqual(202, response.status_code)
+        self.assertTrue(tracemalloc.is_tracing())
+        self.client.get('/users/migo')
+        self.client.get('/users/morty')
+        report = self.client.delete('/admin/allocations', headers=self.token).json()
+        self.assertFalse(tracemalloc.is_tracing())
+        self.assertFalse(report["active"])
+        self.assertEqual(2, report["endpoints"]["GET /users/{username}"]["requests"])
+        self.assertEqual(1, report["endpoints"]["GET /users/{username}"]["snapshots"])
+        self.client.get('/users/migo') #not traced once stopped
+        self.assertEqual(2, allocations.report()["endpoints"]["GET /users/{username}"]["requests"])
+
+    def test_window_closing_mid_request(self):
+        self.assertEqual(202, self.client.post('/admin/allocations?seconds=5&snapshots=5', headers=self.token).status_code)
+        try:
+            with mock.patch("tracemalloc.take_snapshot", side_effect=RuntimeError("the tracemalloc module must be tracing")):
+                self.assertEqual(200, self.client.get('/users/migo').status_code) #the timer stopped tracing after the check
+        finally:
+            self.client.delete('/admin/allocations', headers=self.token)
+
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,146 @@
+"""
+Bulk import / export of cars as NDJSON (one JSON object per line) or CSV.
+
+Imports are read from the request body as it arrives and validated in chunks of
+`CHUNK_ROWS` rows, so a large upload is never held as one string. Rows that fail
+validation are reported by line number; the others are returned to be inserted, a chunk at a time.
+
+Exports walk the catalog in id order, one keyset page at a time, and yield one body chunk
+per page.
+"""
+
+import codecs
+import csv
+import io
+import json
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+from shared.records import Record, RecordType
+
+CHUNK_ROWS = 1000
+CSV_FIELDS = ["make", "model", "year", "price", "engine", "autonomous", "sold"]
+SOLD_SEPARATOR = "|"  # CSV cells can't hold lists: "NA|EU"
+MAX_ERRORS = 1000  # per import; further errors are only counted
+
+FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def detect_format(content_type: Optional[str], format: Optional[str] = None) -> Optional[str]:
+    if format:
+        return format if format in FORMATS else None
+    content_type = (content_type or "").split(";")[0].strip().lower()
+    for name, media_type in FORMATS.items():
+        if content_type == media_type:
+            return name
+    if content_type in ("application/json", "application/jsonl", "application/x-jsonlines"):
+        return "ndjson"
+    return None
+
+
+async def lines(body: AsyncIterator[bytes], quoted: bool = False) -> AsyncIterator[Tuple[int, str]]:
+    """
+    (line number, text) for each non-empty line of a streamed body. With `quoted` (CSV), a line
+    break inside a double-quoted field doesn't end the line: the whole record is yielded, with
+    the number of its first line.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    pending, number = "", 0
+    record: List[str] = []  # the lines of a CSV record whose quotes are still open
+    start = 0
+
+    def take(line: str) -> Optional[Tuple[int, str]]:
+        nonlocal start
+        if not record:
+            start = number
+        record.append(line)
+        if quoted and sum(part.count('"') for part in record) % 2:  # "" escapes count twice
+            return None
+        text = "\n".join(record)
+        record.clear()
+        return (start, text.rstrip("\r")) if text.strip() else None
+
+    async for chunk in body:
+        pending += decoder.decode(chunk)
+        *complete, pending = pending.split("\n")
+        for line in complete:
+            number += 1
+            item = take(line)
+            if item is not None:
+                yield item
+    pending += decoder.decode(b"", final=True)
+    if pending or record:
+        number += 1
+        item = take(pending)
+        if item is None and record:  # quotes never closed: let the CSV reader report it
+            item = (start, "\n".join(record))
+        if item is not None:
+            yield item
+
+
+async def chunks(numbered: AsyncIterator[Tuple[int, str]], size: int = CHUNK_ROWS) -> AsyncIterator[List[Tuple[int, str]]]:
+    chunk: List[Tuple[int, str]] = []
+    async for item in numbered:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def parse_ndjson(chunk: List[Tuple[int, str]]) -> Iterator[Tuple[int, object]]:
+    for number, line in chunk:
+        try:
+            yield number, json.loads(line)
+        except ValueError:
+            yield number, None
+
+
+def parse_csv(chunk: List[Tuple[int, str]], header: List[str]) -> Iterator[Tuple[int, object]]:
+    rows = csv.reader(line for _, line in chunk)
+    for (number, _), cells in zip(chunk, rows):
+        row: Dict[str, object] = {}
+        for field, cell in zip(header, cells):
+            if cell == "":
+                continue  # empty cell = not given
+            row[field] = cell.split(SOLD_SEPARATOR) if field == "sold" else cell
+        yield number, row
+
+
+def validate(rows: Iterator[Tuple[int, object]], records: RecordType) -> Tuple[List[Record], List[dict]]:
+    """Returns (valid cars, errors). CPU-bound: run it off the event loop."""
+    valid, errors = [], []
+    for number, row in rows:
+        if not isinstance(row, dict):
+            errors.append({"line": number, "errors": [{"loc": [], "msg": "not a JSON object"}]})
+            continue
+        record, error = records.parse(row)
+        if error is None:
+            valid.append(record)
+        else:
+            errors.append({"line": number, "errors": [{"loc": list(e["loc"]), "msg": e["msg"]} for e in error.errors()]})
+    return valid, errors
+
+
+def export_ndjson(page: List[Tuple[int, dict]]) -> bytes:
+    return "".join(json.dumps({"id": id, **car}) + "\n" for id, car in page).encode()
+
+
+def export_csv(page: List[Tuple[int, dict]], header: bool = False) -> bytes:
+    out = io.StringIO()
+    writer = csv.writer(out, lineterminator="\n")
+    if header:
+        writer.writerow(["id"] + CSV_FIELDS)
+    for id, car in page:
+        writer.writerow([id] + [_cell(car.get(field), field) for field in CSV_FIELDS])
+    return out.getvalue().encode()
+
+
+def _cell(value, field: str) -> str:
+    if value is None:
+        return ""
+    if field == "sold":
+        return SOLD_SEPARATOR.join(value)
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
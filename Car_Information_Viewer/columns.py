@@ -0,0 +1,178 @@
+"""
+Columnar mirror of the car catalog, for aggregates.
+
+Averaging prices over a dict of dicts is a Python loop over every car. CarColumns keeps the
+same data as NumPy arrays indexed by car id:
+- year (int32, 0 = unknown), price (float64, NaN = unknown), autonomous (int8, -1 = unknown)
+- make and engine dictionary-encoded: an int32 code per car, plus the list of distinct values
+- sold as a bitmask (uint64), one bit per region code
+
+It subscribes to the CarStore, so every write updates one slot of each array. Group-bys are
+then a handful of vectorized NumPy calls (bincount, ufunc.at) instead of a loop.
+"""
+
+import threading
+from typing import Dict, List, Mapping, Optional, Tuple
+
+import numpy as np
+
+from shared.storage import MISSING
+
+GROUPS = ("make", "engine", "year", "autonomous")
+
+
+class Dictionary:
+    """Dictionary encoding: value <-> small int code. Codes are never reused."""
+
+    def __init__(self):
+        self.values: List[object] = []
+        self.codes: Dict[object, int] = {}
+
+    def encode(self, value) -> int:
+        if value is None:
+            return -1
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+class CarColumns:
+    def __init__(self, store=None, capacity: int = 1024):
+        self._lock = threading.Lock()
+        self.makes = Dictionary()
+        self.engines = Dictionary()
+        self.regions = Dictionary()
+        self._allocate(capacity)
+        if store is not None:
+            store.subscribe(self._on_change)
+
+    @classmethod
+    def from_rows(cls, rows: Mapping[int, dict]) -> "CarColumns":
+        """A one-off snapshot of a plain {id: car} mapping, not kept up to date."""
+        columns = cls(capacity=max(rows, default=0) + 1)
+        for id, car in rows.items():
+            columns._on_change(id, car)
+        return columns
+
+    def _allocate(self, capacity: int) -> None:
+        self.present = np.zeros(capacity, dtype=bool)
+        self.year = np.zeros(capacity, dtype=np.int32)
+        self.price = np.full(capacity, np.nan)
+        self.autonomous = np.full(capacity, -1, dtype=np.int8)
+        self.make = np.full(capacity, -1, dtype=np.int32)
+        self.engine = np.full(capacity, -1, dtype=np.int32)
+        self.sold = np.zeros(capacity, dtype=np.uint64)
+
+    def _grow(self, id: int) -> None:
+        capacity = len(self.present)
+        while capacity <= id:
+            capacity *= 2
+        old = {name: getattr(self, name) for name in ("present", "year", "price", "autonomous", "make", "engine", "sold")}
+        self._allocate(capacity)
+        for name, column in old.items():
+            getattr(self, name)[:len(column)] = column
+
+    def _on_change(self, id: int, car) -> None:
+        with self._lock:
+            if id >= len(self.present):
+                self._grow(id)
+            if car is MISSING:
+                self.present[id] = False
+                return
+            self.present[id] = True
+            self.year[id] = car.get("year") or 0
+            self.price[id] = np.nan if car.get("price") is None else car["price"]
+            autonomous = car.get("autonomous")
+            self.autonomous[id] = -1 if autonomous is None else int(autonomous)
+            self.make[id] = self.makes.encode(car.get("make"))
+            self.engine[id] = self.engines.encode(car.get("engine"))
+            mask = 0
+            for region in car.get("sold") or ():
+                code = self.regions.encode(region)
+                if code < 64:  # there are 7 continents; anything past 64 codes isn't tracked
+                    mask |= 1 << code
+            self.sold[id] = mask
+
+    # aggregates
+    def _selection(self, sold: Optional[List[str]], year: Tuple[Optional[int], Optional[int]]) -> np.ndarray:
+        selected = self.present.copy()
+        if sold:
+            mask = 0
+            for region in sold:
+                code = self.regions.codes.get(region)
+                if code is not None and code < 64:
+                    mask |= 1 << code
+            selected &= (self.sold & np.uint64(mask)) != 0
+        low, high = year
+        if low is not None:
+            selected &= self.year >= low
+        if high is not None:
+            selected &= self.year <= high
+        return selected
+
+    def _keys(self, by: str, selected: np.ndarray) -> Tuple[np.ndarray, List[object]]:
+        """Group codes (0..n-1) for the selected cars, and the group labels."""
+        if by in ("make", "engine"):
+            dictionary = self.makes if by == "make" else self.engines
+            codes = (self.make if by == "make" else self.engine)[selected]
+            return codes + 1, [None] + dictionary.values  # -1 (unknown) becomes group 0
+        if by == "year":
+            years = self.year[selected].astype(np.int64)
+            low = int(years.min()) if len(years) else 0
+            span = int(years.max()) - low + 1 if len(years) else 0
+            return years - low, [(low + offset) or None for offset in range(span)]  # empty years are dropped later
+        if by == "autonomous":
+            return self.autonomous[selected].astype(np.int64) + 1, [None, False, True]
+        raise ValueError(f"Cannot group by {by}")
+
+    def group_stats(self, by: str, sold: Optional[List[str]] = None,
+                    year: Tuple[Optional[int], Optional[int]] = (None, None)) -> List[dict]:
+        """count, and avg/min/max price per group (prices that are unknown are left out)."""
+        with self._lock:
+            selected = self._selection(sold, year)
+            keys, labels = self._keys(by, selected)
+            prices = self.price[selected]
+        groups = len(labels)
+        counts = np.bincount(keys, minlength=groups)
+        priced = ~np.isnan(prices)
+        priced_counts = np.bincount(keys[priced], minlength=groups)
+        sums = np.bincount(keys[priced], weights=prices[priced], minlength=groups)
+
+        keys, prices = keys[priced], prices[priced]
+        minimum = np.full(groups, np.inf)
+        maximum = np.full(groups, -np.inf)
+        np.minimum.at(minimum, keys, prices)  # unbuffered scatter-reduce per group
+        np.maximum.at(maximum, keys, prices)
+
+        stats = []
+        for code in np.flatnonzero(counts).tolist():
+            with_price = int(priced_counts[code])
+            stats.append({
+                by: labels[code],
+                "count": int(counts[code]),
+                "avg_price": float(sums[code] / with_price) if with_price else None,
+                "min_price": float(minimum[code]) if with_price else None,
+                "max_price": float(maximum[code]) if with_price else None,
+            })
+        return stats
+
+    def price_histogram(self, by: str = "year", bins: int = 10, sold: Optional[List[str]] = None,
+                        year: Tuple[Optional[int], Optional[int]] = (None, None)) -> dict:
+        """Price histogram per group, with the same bin edges for every group."""
+        with self._lock:
+            selected = self._selection(sold, year)
+            keys, labels = self._keys(by, selected)
+            prices = self.price[selected]
+        priced = ~np.isnan(prices)
+        keys, prices = keys[priced], prices[priced]
+        if not len(prices):
+            return {"edges": [], "groups": []}
+        edges = np.histogram_bin_edges(prices, bins=bins)
+        bin_of = np.clip(np.searchsorted(edges, prices, side="right") - 1, 0, bins - 1)
+        counts = np.bincount(keys * bins + bin_of, minlength=len(labels) * bins).reshape(len(labels), bins)
+        return {
+            "edges": edges.tolist(),
+            "groups": [{by: labels[code], "counts": counts[code].tolist()} for code in np.flatnonzero(counts.sum(axis=1)).tolist()],
+        }
@@ -1,4 +1,7 @@
-cars = {
+from shared.storage import open_repository
+from store import CarStore
+
+cars = CarStore(repository=open_repository("cars", key_type=int, seed={
     1: {
         "make": "CarBrand",
         "model": "Fast",
@@ -48,4 +51,4 @@ cars = {
         "autonomous": False,
         "sold": ["NA","AF","OC","SA"]
     }
-}
\ No newline at end of file
+}))
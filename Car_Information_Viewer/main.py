@@ -1,12 +1,24 @@
 from fastapi import FastAPI,Query,Path ,HTTPException,status, Body,Request,Form
-from fastapi.encoders import jsonable_encoder
-from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import RedirectResponse
-from pydantic import BaseModel,Field
+from fastapi.responses import JSONResponse,RedirectResponse,StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel,Field,ValidationError
 from typing import Optional, List,Dict
 from starlette.responses import HTMLResponse
+from urllib.parse import urlencode
+import csv
+import os
+import sys
+
+BASEDIR = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(os.path.dirname(BASEDIR)) #repository root, for the shared package
+from shared.metrics import install as install_metrics
+from shared.records import record_type
+from shared.rendering import CachedTemplates
 from database import cars
+from columns import GROUPS,CarColumns
+from search import SearchIndex
+import bulk
 
 class Car(BaseModel):
     make: Optional[str]
@@ -18,109 +30,235 @@ class Car(BaseModel):
     autonomous: Optional[bool]
     sold: Optional[List[str]]
     
-templates = Jinja2Templates(directory="templates") #For serverside rendering1
+car_records = record_type(Car) #validates straight into the read-only dicts the store keeps
+
+STREAM_CHUNK_SIZE = 16*1024 #bytes per body message when streaming a page
+
+columns = CarColumns(cars) #NumPy mirror of the catalog for /cars/stats, kept up to date on every write
+search_index = SearchIndex(cars) #inverted index + prefix trie over make and model, same
+
+templates = CachedTemplates(directory=BASEDIR+"/templates",enable_async=True) #For serverside rendering1. Car cards are cached per car id. Rendered on the event loop
+cars.subscribe(lambda id,_: templates.fragments.invalidate(id)) #cached car cards and /cars/{id} ETags follow every write, other workers' too
 
 app = FastAPI()
-app.mount("/static",StaticFiles(directory="static"),name="static") #For serverside rendering2
+app.mount("/static",StaticFiles(directory=BASEDIR+"/static"),name="static") #For serverside rendering2
+install_metrics(app) #per-route latency and in-flight requests, served at /metrics
+
+
 
+async def coalesce(chunks,size:int):
+    """Groups the many small strings Jinja yields into body messages of about `size` bytes."""
+    buffer,buffered = [],0
+    async for chunk in chunks:
+        chunk = chunk.encode()
+        buffer.append(chunk)
+        buffered += len(chunk)
+        if buffered >= size:
+            yield b"".join(buffer)
+            buffer,buffered = [],0
+    if buffer:
+        yield b"".join(buffer)
 
 
 @app.get('/',response_class=RedirectResponse)
-def root(request:Request):
+async def root(request:Request):
     
     return RedirectResponse(url="/cars") #url_for?
 
 
 @app.get('/cars',response_class=HTMLResponse)
-def get_cars(request:Request, number:Optional[str] = Query("10",max_length=3)):
-    response = []
-    for id, car in list(cars.items())[:int(number)]: 
-        response.append((id,car))
-    return templates.TemplateResponse("index.html",
-        {"request":request,
+async def get_cars(request:Request,
+    number:int = Query(10,ge=1,le=1000), #page size
+    after:Optional[int] = None, #keyset cursors: show the cars right after/before this id
+    before:Optional[int] = None,
+    stream:bool = False):
+
+    as_of = templates.fragments.generation #before reading the cars: a card rendered from a car edited meanwhile isn't cached
+    if before is not None:
+        response = cars.page_before(before,limit=number)
+    else:
+        response = cars.page(after=after,limit=number) #ordered slice, no copy of the whole catalog
+    context = {"request":request,
         "cars":response, #We will pass response to variable(cars)
-        "title":"Home"})
+        "number":number,
+        "prev_cursor":response[0][0] if response and cars.has_before(response[0][0]) else None,
+        "next_cursor":response[-1][0] if response and cars.has_after(response[-1][0]) else None,
+        "title":"Home","fragments_as_of":as_of}
+    if stream: #Send the page as it renders instead of buffering the whole thing first
+        chunks = templates.get_template("index.html").generate_async(context)
+        return StreamingResponse(coalesce(chunks,STREAM_CHUNK_SIZE),media_type="text/html")
+    return await templates.render("index.html",context)
+
+
+@app.get('/cars/query') #Declared before /cars/{id} so that "query" isn't parsed as an id
+async def query_cars(
+    make:Optional[List[str]] = Query(None), #Repeat the parameter to match any of several values
+    engine:Optional[List[str]] = Query(None),
+    autonomous:Optional[bool] = None,
+    year_min:Optional[int] = None,
+    year_max:Optional[int] = None,
+    price_min:Optional[float] = None,
+    price_max:Optional[float] = None,
+    sold:Optional[List[str]] = Query(None), #Sold in any of these regions
+    sold_all:Optional[List[str]] = Query(None), #Sold in every one of these regions
+    limit:int = Query(100,ge=1,le=1000)):
+
+    hits = cars.query(make=make,engine=engine,autonomous=autonomous,
+        year=(year_min,year_max),price=(price_min,price_max),
+        sold_any=sold,sold_all=sold_all,limit=limit)
+    return [{"id":id,**car} for id,car in hits]
+
+
+@app.get('/cars/stats') #vectorized group-by over the columnar mirror
+async def car_stats(
+    by:str = Query("make",regex="^("+"|".join(GROUPS)+")$"),
+    histogram:bool = False, #price histogram per group instead of count/avg/min/max
+    bins:int = Query(10,ge=1,le=100),
+    sold:Optional[List[str]] = Query(None),
+    year_min:Optional[int] = None,
+    year_max:Optional[int] = None):
+
+    #a pass over every car: off the event loop (NumPy releases the GIL for most of it)
+    if histogram:
+        return await run_in_threadpool(columns.price_histogram,by,bins,sold=sold,year=(year_min,year_max))
+    return await run_in_threadpool(columns.group_stats,by,sold=sold,year=(year_min,year_max))
+
+
+@app.post('/cars/bulk') #NDJSON or CSV upload, validated chunk by chunk as it is received
+async def import_cars(request:Request, format:Optional[str] = Query(None,regex="^(ndjson|csv)$")):
+    kind = bulk.detect_format(request.headers.get("content-type"),format)
+    if kind is None:
+        raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,detail="Send NDJSON (application/x-ndjson) or CSV (text/csv)")
+
+    ids,errors,error_count,header = [],[],0,None
+    async for chunk in bulk.chunks(bulk.lines(request.stream(),quoted=kind == "csv")): #a quoted CSV field may span lines
+        if kind == "csv":
+            if header is None: #the first line names the columns
+                header = [field.strip() for field in next(csv.reader([chunk[0][1]]))]
+                chunk = chunk[1:]
+            rows = bulk.parse_csv(chunk,header)
+        else:
+            rows = bulk.parse_ndjson(chunk)
+        ok,bad = await run_in_threadpool(bulk.validate,rows,car_records) #validation is CPU work, keep it off the event loop
+        if ok: #stored chunk by chunk too, so neither the buffered rows nor a store write grow with the upload
+            ids.extend(await run_in_threadpool(cars.add_many,ok))
+        error_count += len(bad)
+        errors.extend(bad[:bulk.MAX_ERRORS-len(errors)])
+
+    return JSONResponse({"inserted":len(ids),"ids":ids,"error_count":error_count,"errors":errors},
+        status_code=status.HTTP_201_CREATED if ids or not error_count else status.HTTP_400_BAD_REQUEST)
+
+
+@app.get('/cars/export')
+async def export_cars(format:str = Query("ndjson",regex="^(ndjson|csv)$"), batch:int = Query(1000,ge=1,le=10000)):
+    def pages(): #one keyset page per body chunk, the catalog is never copied as a whole. A plain generator: Starlette iterates it in the threadpool
+        after = None
+        if format == "csv":
+            yield bulk.export_csv([],header=True)
+        while True:
+            page = cars.page(after=after,limit=batch)
+            if not page:
+                return
+            yield bulk.export_csv(page) if format == "csv" else bulk.export_ndjson(page)
+            after = page[-1][0]
+    return StreamingResponse(pages(),media_type=bulk.FORMATS[format],headers={"Content-Disposition":f'attachment; filename="cars.{format}"'})
 
 
 @app.get("/cars/{id}",response_class=HTMLResponse)
-def get_car_by_id(request:Request, id:int = Path(...,ge=0,lt=1000)):
+async def get_car_by_id(request:Request, id:int = Path(...,ge=0)):
+    version = templates.fragments.version(id) #before the car: an edit landing in between then changes the version we tag with
     car = cars.get(id)
-    response= templates.TemplateResponse("search.html",{"request":request, "car":car, "id":id,"title":"Search Car"})
     if not car:
-        response.status_code = status.HTTP_404_NOT_FOUND #1
+        return await templates.render("search.html",{"request":request, "car":car, "id":id,"title":"Search Car"},status_code=status.HTTP_404_NOT_FOUND) #1
+    etag = templates.etag(request.base_url,"car",id,version) #changes whenever the car is edited
+    response= await templates.render("search.html",{"request":request, "car":car, "id":id,"title":"Search Car","fragments_as_of":version},etag=etag)
     return response
 
 @app.get('/create',response_class=HTMLResponse)
-def create_car(request: Request):
-    return templates.TemplateResponse("create.html",{"request":request,"title":"Create Car"})
+async def create_car(request: Request):
+    return await templates.render_static("create.html",{"request":request,"title":"Create Car"})
 
 
 @app.post("/cars",status_code=status.HTTP_201_CREATED) 
-def add_cars(
+async def add_cars(
     make:Optional[str] = Form(...),  #1
     model:Optional[str] = Form(...),
     year:Optional[int] = Form(...),
     price:Optional[float] = Form(...),
     engine:Optional[str] = Form(...),
     autonomous:Optional[bool] = Form(...), 
-    sold: Optional[List[str]] = Form(None),  #Default value None. Note that value is obtained from value part of checkbox. 
-    min_id:Optional[int] = Body(0)):
+    sold: Optional[List[str]] = Form(None)):  #Default value None. Note that value is obtained from value part of checkbox. 
 
     #2
-    body_cars = [Car(make=make,model=model,year=year,price=price,engine=engine,autonomous=autonomous,sold=sold)] #Pydantic model
+    body_cars = [car_records.validate(dict(make=make,model=model,year=year,price=price,engine=engine,autonomous=autonomous,sold=sold))] #validated by the Car model
 
     if len(body_cars) < 1 : 
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,detail="No cars to add")
-    min_id = len(cars.values()) + min_id
-    for car in body_cars:
-        while cars.get(min_id):
-            min_id+=1
-        cars[min_id] = car
-        min_id+=1
+    await run_in_threadpool(cars.add_many,body_cars) #ids are handed out by the store. With DATA_DIR a write waits for its fsync, so off the event loop
     return RedirectResponse(url="/cars",status_code=302) #3
      
         
 @app.get('/edit', response_class = HTMLResponse) #While the actual class is TemplateResponse, HTMLResponse is the top-level class to use.
-def edit_car(request:Request, id:int = Query(...)):
+async def edit_car(request:Request, id:int = Query(...)):
     car = cars.get(id)
     if not car:
-        return templates.TemplateResponse("search.html",{"request":request,"id":id,"title":"Edit car"},status_code=status.HTTP_404_NOT_FOUND )
-    return templates.TemplateResponse("edit.html",{"request":request,"car":car,"id":id,"title":"Edit car"})
+        return await templates.render("search.html",{"request":request,"id":id,"title":"Edit car"},status_code=status.HTTP_404_NOT_FOUND )
+    return await templates.render("edit.html",{"request":request,"car":car,"id":id,"title":"Edit car"})
     
         
 
 @app.post('/cars/{id}',response_class=HTMLResponse)
-def update_car(request:Request, id:int,
+async def update_car(request:Request, id:int,
     make:Optional[str] = Form(None),  #1
     model:Optional[str] = Form(None),
     year:Optional[str] = Form(None),
     price:Optional[float] = Form(None),
     engine:Optional[str] = Form(None),
     autonomous:Optional[bool] = Form(None), 
-    sold: Optional[List[str]] = Form(None)):
+    sold: Optional[List[str]] = Form(None),
+    sold_listed:bool = Form(False)): #sent by the edit form, whose unchecked boxes aren't
 
     stored= cars.get(id)
     if not stored: 
-        return templates.TemplateResponse('search.html',{"request":request, "id":id,"title":"Edit car"}, status_code=status.HTTP_404_NOT_FOUND)
-    stored = Car(**dict(stored)) #2
-    car = Car(make=make,model=model,year=year,price=price,engine=engine,autonomous=autonomous,sold=sold)
-    new = car.dict(exclude_unset=True)
-    new = stored.copy(update=new)
-    cars[id] = jsonable_encoder(new)
-    response ={}
-    response[id] = cars[id]
+        return await templates.render('search.html',{"request":request, "id":id,"title":"Edit car"}, status_code=status.HTTP_404_NOT_FOUND)
+    sent = dict(make=make,model=model,year=year,price=price,engine=engine,autonomous=autonomous,sold=sold)
+    changes = {field:value for field,value in sent.items() if value is not None} #fields left out of the form keep their stored value
+    if sold_listed and sold is None:
+        changes["sold"] = [] #every box unchecked
+    try:
+        car = car_records.merge(stored,changes) #only the changed fields are validated
+    except ValidationError as exc:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,detail=exc.errors())
+    await run_in_threadpool(cars.__setitem__,id,car)
     return RedirectResponse(url="/cars",status_code=302) #3
 
 @app.get("/delete/{id}",response_class=RedirectResponse) #1
-def delete_car(request:Request, id:int = Path(...)): #2
+async def delete_car(request:Request, id:int = Path(...)): #2
     if not cars.get(id):
-        return templates.TemplateResponse('search.html',{"request":request, "id":id,"title":"Delete car"}, status_code=status.HTTP_404_NOT_FOUND)
-    del cars[id]
+        return await templates.render('search.html',{"request":request, "id":id,"title":"Delete car"}, status_code=status.HTTP_404_NOT_FOUND)
+    await run_in_threadpool(cars.__delitem__,id)
     return RedirectResponse(url="/cars")
     
 
 @app.post('/search', response_class=RedirectResponse)
-def search_cars(id:str=Form(...)):
-    return RedirectResponse("/cars/" + id, status_code=302) 
+async def search_cars(q:str=Form(...)):
+    q = q.strip()
+    if q.isdigit(): #an id still goes straight to the car
+        return RedirectResponse("/cars/" + q, status_code=302)
+    return RedirectResponse("/search?" + urlencode({"q":q}), status_code=302)
+
+
+@app.get('/search',response_class=HTMLResponse)
+async def search_results(request:Request, q:str = "", number:int = Query(20,ge=1,le=100)):
+    as_of = templates.fragments.generation
+    hits = [(id,cars.get(id)) for id,_ in search_index.search(q,limit=number)]
+    return await templates.render("index.html",{"request":request,
+        "cars":[(id,car) for id,car in hits if car], #ranked, best match first
+        "number":number,"query":q,"title":"Search","fragments_as_of":as_of})
+
+
+@app.get('/search/suggest') #type-ahead for the search box
+async def suggest(q:str = "", limit:int = Query(10,ge=1,le=32)):
+    return search_index.suggest(q,limit=limit) 
 
 
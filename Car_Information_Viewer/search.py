@@ -0,0 +1,235 @@
+"""
+Full-text and prefix search over car make and model.
+
+Each name is split into lowercase tokens: words ("FourWheeler SUV" -> "fourwheeler", "suv") and
+the camelCase parts of a word ("four", "wheeler"). SearchIndex keeps
+- an inverted index: token -> {car id: weight}, the weight being 2 for the make and 1 for the model
+- a prefix trie over the tokens, for type-ahead and for matching a query word as a prefix
+
+Both follow the CarStore through its change listener, so a create, edit or delete only touches
+the tokens of that one car.
+
+Every word of a query must match a token exactly or, from two letters on, as a prefix ("carb"
+finds "CarBrand").
+Results are ranked by the sum of the best match per query word: weight x (1 for an exact
+token, 0.5 for a prefix) x how rare the token is (idf), then by id.
+"""
+
+import heapq
+import math
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from shared.storage import MISSING
+
+FIELD_WEIGHTS = {"make": 2.0, "model": 1.0}
+PREFIX_FACTOR = 0.5
+MAX_WEIGHT = max(FIELD_WEIGHTS.values())
+MIN_PREFIX = 2  # a single letter only matches the exact token ("x" for "X5"), not every word starting with it
+TOP_TOKENS = 32  # completions kept per trie node, for suggest; search expands a prefix to all of them
+
+WORD = re.compile(r"[^\W_]+")
+CAMEL_PART = re.compile(r"[A-Z]?[a-z]+|[A-Z]+(?![a-z])|\d+")
+
+
+def words(text: str) -> List[str]:
+    """The query words: lowercase, split on anything that isn't a letter or a digit."""
+    return [word.lower() for word in WORD.findall(text or "")]
+
+
+def tokenize(text: str) -> Dict[str, str]:
+    """Indexed tokens of a name -> how they were written ("CarBrand" -> carbrand, car, brand)."""
+    tokens: Dict[str, str] = {}
+    for word in WORD.findall(text or ""):
+        tokens.setdefault(word.lower(), word)
+        parts = CAMEL_PART.findall(word)
+        if len(parts) > 1:
+            for part in parts:
+                tokens.setdefault(part.lower(), part)
+    return tokens
+
+
+class _Node:
+    __slots__ = ("children", "top")
+
+    def __init__(self):
+        self.children: Dict[str, "_Node"] = {}
+        self.top: Optional[List[Tuple[int, str]]] = None  # cached (-cars, token) of the subtree, best first
+
+
+class SearchIndex:
+    def __init__(self, store=None):
+        self._lock = threading.Lock()
+        self._postings: Dict[str, Dict[int, float]] = {}
+        self._spelling: Dict[str, str] = {}  # token -> how it was first written, for suggestions
+        self._tokens_of: Dict[int, Dict[str, float]] = {}  # car id -> its tokens, to unindex it
+        self._root = _Node()
+        if store is not None:
+            store.subscribe(self._on_change)
+
+    @classmethod
+    def from_rows(cls, rows) -> "SearchIndex":
+        """A one-off index of a plain {id: car} mapping, not kept up to date."""
+        index = cls()
+        for id, car in rows.items():
+            index._on_change(id, car)
+        return index
+
+    def __len__(self) -> int:
+        return len(self._tokens_of)
+
+    # maintenance
+    def _on_change(self, id: int, car) -> None:
+        tokens: Dict[str, float] = {}
+        spellings: Dict[str, str] = {}
+        if car is not MISSING:
+            for field, weight in FIELD_WEIGHTS.items():
+                for token, spelling in tokenize(car.get(field)).items():
+                    if weight > tokens.get(token, 0.0):
+                        tokens[token] = weight
+                    spellings.setdefault(token, spelling)
+        with self._lock:
+            old = self._tokens_of.pop(id, {})
+            for token in old.keys() - tokens.keys():
+                postings = self._postings[token]
+                del postings[id]
+                if not postings:
+                    del self._postings[token]
+                    del self._spelling[token]
+                self._counted(token, len(postings), grew=False)
+            for token, weight in tokens.items():
+                postings = self._postings.setdefault(token, {})
+                postings[id] = weight
+                self._spelling.setdefault(token, spellings[token])
+                if token not in old:
+                    self._counted(token, len(postings), grew=True)
+            if tokens:
+                self._tokens_of[id] = tokens
+
+    def _counted(self, token: str, count: int, grew: bool) -> None:
+        """Updates the cached completions on the trie path of a token whose car count changed."""
+        node = self._root
+        path = [node]
+        for char in token:
+            child = node.children.get(char)
+            if child is None:
+                if not grew:
+                    return
+                child = node.children[char] = _Node()
+            node = child
+            path.append(node)
+        for node in path:
+            top = node.top
+            if top is None:
+                continue
+            entries = [entry for entry in top if entry[1] != token]
+            if grew:
+                entries.append((-count, token))
+                node.top = sorted(entries)[:TOP_TOKENS]
+            elif len(entries) < len(top):  # it was cached and ranks lower now
+                if len(top) < TOP_TOKENS:  # the cache holds the whole subtree
+                    node.top = sorted(entries + [(-count, token)]) if count else entries
+                else:  # a token outside the cache may rank higher now
+                    node.top = None
+        if not count:
+            self._prune(path, token)
+
+    def _prune(self, path: List[_Node], token: str) -> None:
+        for depth in range(len(token), 0, -1):
+            node = path[depth]
+            if node.children or token[:depth] in self._postings:
+                return
+            del path[depth - 1].children[token[depth - 1]]
+
+    # lookups
+    def _node(self, prefix: str) -> Optional[_Node]:
+        node = self._root
+        for char in prefix:
+            node = node.children.get(char)
+            if node is None:
+                return None
+        return node
+
+    def _completions(self, prefix: str) -> List[Tuple[int, str]]:
+        node = self._node(prefix)
+        if node is None:
+            return []
+        if node.top is None:
+            node.top = heapq.nsmallest(TOP_TOKENS, self._subtree(node, prefix))
+        return node.top
+
+    def _subtree(self, node: _Node, prefix: str):
+        stack = [(node, prefix)]
+        while stack:
+            node, text = stack.pop()
+            postings = self._postings.get(text)
+            if postings:
+                yield -len(postings), text
+            for char, child in node.children.items():
+                stack.append((child, text + char))
+
+    def suggest(self, prefix: str, limit: int = 10) -> List[dict]:
+        """The tokens starting with the last word of `prefix`, the most common first."""
+        query = words(prefix)
+        if not query:
+            return []
+        with self._lock:
+            return [{"text": self._spelling[token], "cars": -count}
+                    for count, token in self._completions(query[-1])[:limit]]
+
+    def search(self, text: str, limit: int = 20) -> List[Tuple[int, float]]:
+        """(car id, score) of the cars matching every word of `text`, best first."""
+        query = words(text)
+        if not query:
+            return []
+        with self._lock:
+            total = len(self._tokens_of)
+            terms: List[Dict[str, float]] = []  # per query word: matching token -> score of a match
+            for word in query:
+                node = self._node(word) if len(word) >= MIN_PREFIX else None
+                matches = {token for _, token in self._subtree(node, word)} if node is not None else set()
+                if word in self._postings:
+                    matches.add(word)  # the exact token, even when longer ones are more common
+                if not matches:
+                    return []
+                terms.append({token: (1.0 if token == word else PREFIX_FACTOR) * math.log(1 + total / len(self._postings[token]))
+                              for token in matches})
+
+            # walk the postings of the word matching the fewest cars, best tokens first; every car
+            # found is scored on its own tokens. Stop once no car left can enter the top `limit`.
+            terms.sort(key=lambda term: sum(len(self._postings[token]) for token in term))
+            walked = terms[0]
+            others = sum(MAX_WEIGHT * max(term.values()) for term in terms[1:])
+            best: List[Tuple[float, int]] = []  # min-heap of (score, -id)
+            seen = set()
+            for token in sorted(walked, key=walked.get, reverse=True):
+                if len(best) >= limit and best[0][0] > MAX_WEIGHT * walked[token] + others:
+                    break
+                for id in self._postings[token]:
+                    if id in seen:
+                        continue
+                    seen.add(id)
+                    score = _score(self._tokens_of[id], terms)
+                    if score is None:
+                        continue
+                    if len(best) < limit:
+                        heapq.heappush(best, (score, -id))
+                    elif (score, -id) > best[0]:
+                        heapq.heapreplace(best, (score, -id))
+        return [(-id, score) for score, id in sorted(best, reverse=True)]
+
+
+def _score(tokens: Dict[str, float], terms: List[Dict[str, float]]) -> Optional[float]:
+    """A car's score: the sum, over the query words, of its best matching token. None if a word doesn't match."""
+    total = 0.0
+    for term in terms:
+        best = 0.0
+        for token, weight in tokens.items():
+            score = term.get(token)
+            if score is not None and weight * score > best:
+                best = weight * score
+        if not best:
+            return None
+        total += best
+    return total
@@ -0,0 +1,309 @@
+"""
+In-memory car catalog.
+
+CarStore behaves like the plain `cars` dict the app used to have (get, [], in, del, items...)
+but also hands out ids and keeps them in order so that pages can be sliced without copying
+the whole catalog. Writes run on the threadpool (or the repository's threads) and go through
+a single lock, one car at a time. Reads run on the event loop and take no lock: rows are dict
+lookups, and the ordered lists are read from read-only copies, taken again on the first read
+after a change. A read racing a write sees the car as it was before or after it.
+
+The rows themselves live in a shared.storage Repository (a plain dict unless DATA_DIR is set).
+Writes go to the repository first; the store follows through its change listener, which also
+receives the cars other worker processes write when the repository is shared. In that case
+new ids come from the repository so that two workers never hand out the same id.
+Every car the store keeps is a read-only Record (shared.records), seeded and replayed ones
+included: the indexes below point into them, so they must not change behind the store's back.
+
+Secondary indexes are maintained on every write:
+- hash indexes on make, engine and autonomous  (value -> ids)
+- sorted indexes on year and price             ([(value, id), ...])
+- an inverted index on the sold region codes   (region -> ids)
+"""
+
+from bisect import bisect_left, bisect_right, insort
+from heapq import heappop, heappush
+from itertools import repeat
+from threading import RLock
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from shared.records import freeze
+from shared.storage import MISSING, MemoryRepository, Repository
+
+HASH_FIELDS = ("make", "engine", "autonomous")
+SORTED_FIELDS = ("year", "price")
+MAX_FREE_GAP = 1024  # skipped ids past this many, before an explicitly chosen one, are not reused
+
+
+class CarStore:
+    def __init__(self, rows: Optional[Dict[int, dict]] = None, first_id: int = 1,
+                 repository: Optional[Repository] = None):
+        self._lock = RLock()
+        self._rows: Dict[int, dict] = {}
+        self._ids: List[int] = []  # always sorted, used for ordered/cursor slicing
+        self._free: Set[int] = set()  # ids released by deletes or skipped, reused before growing the counter
+        self._free_heap: List[int] = []  # the same ids, lowest first; claimed ones are skipped lazily
+        self._next_id = first_id
+        self._hash: Dict[str, Dict[object, Set[int]]] = {field: {} for field in HASH_FIELDS}
+        self._sorted: Dict[str, List[Tuple[object, int]]] = {field: [] for field in SORTED_FIELDS}
+        self._sold: Dict[str, Set[int]] = {}
+        self._listeners: List[Callable[[int, object], None]] = []
+        self._version = 0  # bumped after every change
+        self._copies: Dict[str, Tuple[int, tuple]] = {}  # name -> (version, copy) for the lock-free reads
+        self._repo = repository if repository is not None else MemoryRepository(rows)
+        for id in sorted(self._repo):
+            self._apply(id, self._repo[id])
+        self._repo.subscribe(self._apply)
+
+    # dict-like interface
+    def __len__(self) -> int:
+        self._repo.refresh()
+        return len(self._rows)
+
+    def __contains__(self, id) -> bool:
+        self._repo.refresh()
+        return id in self._rows
+
+    def __getitem__(self, id: int) -> dict:
+        self._repo.refresh()
+        return self._rows[id]
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.ids())
+
+    def get(self, id: int, default=None):
+        self._repo.refresh()
+        return self._rows.get(id, default)
+
+    def ids(self) -> List[int]:
+        self._repo.refresh()
+        return list(self._copy("ids", self._ids))
+
+    def items(self) -> Iterator[Tuple[int, dict]]:
+        for id in self.ids():
+            car = self._rows.get(id)
+            if car is not None:
+                yield id, car
+
+    def values(self) -> Iterator[dict]:
+        return (car for _, car in self.items())
+
+    def __setitem__(self, id: int, car: dict) -> None:
+        self._repo[id] = car
+
+    def __delitem__(self, id: int) -> None:
+        del self._repo[id]
+
+    def _apply(self, id: int, car) -> None:
+        """Repository listener: mirrors one change into the ordered ids and the indexes."""
+        with self._lock:
+            old = self._rows.get(id)
+            if car is MISSING:
+                if old is not None:
+                    # out of the ids first: a lock-free reader skips ids it can't find a row for
+                    self._ids.pop(bisect_left(self._ids, id))
+                    self._reindex(id, old, None)
+                    del self._rows[id]
+                    self._release(id)
+            else:
+                car = freeze(car)  # plain dicts from a seed or a log replay
+                self._rows[id] = car
+                self._reindex(id, old, car)
+                if old is None:
+                    self._claim(id)
+            self._version += 1
+            for listener in self._listeners:
+                listener(id, car)
+
+    def _copy(self, name: str, live: list) -> tuple:
+        """A read-only copy of one of the ordered lists, without the lock."""
+        version = self._version
+        copy = self._copies.get(name)
+        if copy is not None and copy[0] == version:
+            return copy[1]
+        items = tuple(live)  # a single C call: no write lands halfway through it
+        if self._version == version:  # else a write may have been missed, don't keep it
+            self._copies[name] = (version, items)
+        return items
+
+    def subscribe(self, listener: Callable[[int, object], None]) -> None:
+        """
+        `listener(id, car)` is called under the store lock after every change (car is MISSING on
+        delete). It is first called once for every car already stored.
+        """
+        with self._lock:
+            for id in self._ids:
+                listener(id, self._rows[id])
+            self._listeners.append(listener)
+
+    # secondary indexes
+    def _reindex(self, id: int, old: Optional[dict], new: Optional[dict]) -> None:
+        """
+        Moves `id` from the index entries of `old` to those of `new` (either may be None). The new
+        entries are added before the stale ones are removed and unchanged ones are left alone, so
+        a reader that takes no lock finds the car under its old values or its new ones.
+        """
+        sets = {**self._hash, "sold": self._sold}
+        changes = [(field, _keys(old, field), _keys(new, field)) for field in (*sets, *SORTED_FIELDS)]
+        for field, before, after in changes:
+            for key in after - before:
+                if field in sets:
+                    sets[field].setdefault(key, set()).add(id)
+                else:
+                    insort(self._sorted[field], (key, id))
+        for field, before, after in changes:
+            for key in before - after:
+                if field in sets:
+                    _discard(sets[field], key, id)
+                else:
+                    entries = self._sorted[field]
+                    entries.pop(bisect_left(entries, (key, id)))
+
+    def _range(self, field: str, low=None, high=None) -> Set[int]:
+        entries = self._copy(field, self._sorted[field])
+        start = 0 if low is None else bisect_left(entries, (low,))
+        stop = len(entries) if high is None else bisect_right(entries, (high, float("inf")))
+        return {id for _, id in entries[start:stop]}
+
+    def query(
+        self,
+        make: Optional[Iterable[str]] = None,
+        engine: Optional[Iterable[str]] = None,
+        autonomous: Optional[bool] = None,
+        year: Tuple[Optional[int], Optional[int]] = (None, None),
+        price: Tuple[Optional[float], Optional[float]] = (None, None),
+        sold_any: Optional[Iterable[str]] = None,
+        sold_all: Optional[Iterable[str]] = None,
+        limit: Optional[int] = None,
+    ) -> List[Tuple[int, dict]]:
+        """
+        Returns the cars matching every given predicate, in id order.
+        make/engine/sold_any match any of the given values, year/price are inclusive (low, high)
+        ranges where either bound may be None, and sold_all requires every given region.
+        """
+        self._repo.refresh()
+        candidates: List[Set[int]] = []  # the index sets are live: only copy and combine them, whole
+        for field, values in (("make", make), ("engine", engine)):
+            if values is not None:
+                candidates.append(_union(self._hash[field], values))
+        if autonomous is not None:
+            candidates.append(self._hash["autonomous"].get(autonomous, set()))
+        for field, (low, high) in (("year", year), ("price", price)):
+            if low is not None or high is not None:
+                candidates.append(self._range(field, low, high))
+        if sold_any is not None:
+            candidates.append(_union(self._sold, sold_any))
+        for region in sold_all or ():
+            candidates.append(self._sold.get(region, set()))
+
+        if not candidates:
+            ids = self._copy("ids", self._ids)[:limit]
+        else:
+            candidates.sort(key=len) #intersect starting from the most selective predicate
+            matched = set(candidates[0])
+            for other in candidates[1:]:
+                if not matched:
+                    break
+                matched &= other
+            ids = sorted(matched)[:limit]
+        return self._found(ids)
+
+    # id allocation
+    def _claim(self, id: int) -> None:
+        """Registers an explicitly chosen id, keeping the counter and free ids consistent."""
+        insort(self._ids, id)
+        if id >= self._next_id:
+            if id - self._next_id <= MAX_FREE_GAP:
+                for skipped in range(self._next_id, id):
+                    self._release(skipped)
+            self._next_id = id + 1
+        else:
+            self._free.discard(id)
+
+    def _release(self, id: int) -> None:
+        if self._repo.shared:
+            return  # the repository picks the ids then, not _allocate
+        self._free.add(id)
+        heappush(self._free_heap, id)
+        if len(self._free_heap) > 2 * len(self._free) + 64:
+            self._free_heap = sorted(self._free)  # drop the claimed ones; a sorted list is a heap
+
+    def _allocate(self) -> int:
+        while self._free_heap:
+            id = heappop(self._free_heap)
+            if id in self._free:
+                self._free.remove(id)
+                return id
+        id = self._next_id
+        self._next_id += 1
+        return id
+
+    def add(self, car: dict) -> int:
+        return self.add_many([car])[0]
+
+    def add_many(self, cars: Iterable[dict]) -> List[int]:
+        if self._repo.shared:
+            # the repository picks the ids under its cross-process lock; don't hold ours meanwhile,
+            # its listener needs it
+            return self._repo.add_many(cars)
+        new_ids = []
+        for car in cars:
+            with self._lock:  # one car at a time, so other writers (and the listeners) get their turn
+                id = self._allocate()
+                self._repo[id] = car
+            new_ids.append(id)
+        return new_ids
+
+    # ordered slicing
+    def page(self, after: Optional[int] = None, limit: int = 10) -> List[Tuple[int, dict]]:
+        """Returns up to `limit` cars with an id greater than `after`, in id order."""
+        self._repo.refresh()
+        ids = self._copy("ids", self._ids)
+        start = 0 if after is None else bisect_right(ids, after)
+        return self._found(ids[start:start + limit])
+
+    def page_before(self, before: int, limit: int = 10) -> List[Tuple[int, dict]]:
+        """Returns up to `limit` cars with an id lower than `before`, in id order."""
+        self._repo.refresh()
+        ids = self._copy("ids", self._ids)
+        stop = bisect_left(ids, before)
+        return self._found(ids[max(0, stop - limit):stop])
+
+    def has_after(self, id: int) -> bool:
+        ids = self._copy("ids", self._ids)
+        return bisect_right(ids, id) < len(ids)
+
+    def has_before(self, id: int) -> bool:
+        return bisect_left(self._copy("ids", self._ids), id) > 0
+
+    def _found(self, ids: Iterable[int]) -> List[Tuple[int, dict]]:
+        found = []
+        for id in ids:
+            car = self._rows.get(id)
+            if car is not None:  # deleted since the ids were read
+                found.append((id, car))
+        return found
+
+
+def _keys(car: Optional[dict], field: str) -> Set:
+    """What `car` is indexed under for `field`."""
+    if car is None:
+        return set()
+    if field == "sold":
+        return set(car.get("sold") or ())
+    if field in SORTED_FIELDS:
+        return set() if car.get(field) is None else {car[field]}
+    return {car.get(field)}
+
+
+def _union(index: Dict[object, Set[int]], keys: Iterable) -> Set[int]:
+    # a single C call over the live sets, so a car moving from one key to another isn't missed
+    return set().union(*map(index.get, list(keys), repeat(frozenset())))
+
+
+def _discard(index: Dict[object, Set[int]], key, id: int) -> None:
+    ids = index.get(key)
+    if ids is not None:
+        ids.discard(id)
+        if not ids:
+            del index[key]
@@ -0,0 +1,369 @@
+from fastapi.testclient import TestClient
+import unittest
+from unittest import mock
+from main import app
+from store import CarStore
+from shared.storage import LogRepository
+import asyncio
+import tempfile
+import threading
+import time
+import bulk
+from columns import CarColumns
+import search
+from search import SearchIndex, tokenize
+
+
+class TestCarStore(unittest.TestCase):
+    def setUp(self) -> None:
+        self.store = CarStore({1: {"make": "A"}, 2: {"make": "B"}, 5: {"make": "C"}})
+
+    def test_gaps_are_reused_before_growing(self):
+        new_ids = self.store.add_many([{"make": "D"}, {"make": "E"}, {"make": "F"}, {"make": "G"}])
+        self.assertEqual([3, 4, 6, 7], sorted(new_ids))
+
+    def test_deleted_id_is_reused(self):
+        del self.store[2]
+        self.assertNotIn(2, self.store)
+        self.assertEqual(2, self.store.add({"make": "X"}))
+
+    def test_reads_take_no_lock(self):
+        held, done = threading.Event(), threading.Event()
+
+        def writer():
+            with self.store._lock: #like a write in progress
+                held.set()
+                done.wait(5)
+
+        thread = threading.Thread(target=writer)
+        thread.start()
+        held.wait()
+        start = time.monotonic()
+        try:
+            self.assertEqual([1, 2], [id for id, _ in self.store.page(limit=2)])
+            self.assertEqual([1], [id for id, _ in self.store.page_before(2)])
+            self.assertTrue(self.store.has_after(2) and self.store.has_before(2))
+            self.assertEqual([5], [id for id, _ in self.store.query(make=["C"])])
+            self.assertLess(time.monotonic() - start, 1)
+        finally:
+            done.set()
+            thread.join()
+
+    def test_far_ids_are_not_filled_in(self):
+        self.store[10**9] = {"make": "Far"} #a skipped range this wide would not fit in memory
+        self.assertEqual([3, 4, 10**9 + 1], self.store.add_many([{"make": "D"}, {"make": "E"}, {"make": "F"}]))
+        for _ in range(100): #deleting and claiming the same id again doesn't pile up
+            del self.store[3]
+            self.store[3] = {"make": "D"}
+        self.assertLess(len(self.store._free_heap), 100)
+
+    def test_stored_cars_are_read_only(self):
+        car = self.store[1] #seeded as a plain dict
+        with self.assertRaises(TypeError):
+            car["make"] = "Z"
+        self.store[3] = {"make": "D", "sold": ["EU"]}
+        self.assertEqual(("EU",), self.store[3]["sold"])
+
+    def test_page_after_cursor(self):
+        self.assertEqual([1, 2], [id for id, _ in self.store.page(limit=2)])
+        self.assertEqual([5], [id for id, _ in self.store.page(after=2, limit=2)])
+        self.assertEqual([], self.store.page(after=5))
+
+    def test_query_uses_maintained_indexes(self):
+        store = CarStore({
+            1: {"make": "A", "engine": "V8", "price": 40000.0, "year": 2000, "sold": ["EU"]},
+            2: {"make": "B", "engine": "V8", "price": 60000.0, "year": 2010, "sold": ["EU", "NA"]},
+            3: {"make": "A", "engine": "V4", "price": 10000.0, "year": 2020, "sold": ["NA"]},
+        })
+        self.assertEqual([1], [id for id, _ in store.query(engine=["V8"], price=(None, 50000), sold_any=["EU"])])
+        self.assertEqual([2, 3], [id for id, _ in store.query(year=(2010, 2020))])
+        self.assertEqual([2], [id for id, _ in store.query(sold_all=["EU", "NA"])])
+
+        store[1] = {"make": "A", "engine": "V6", "price": 40000.0, "year": 2000, "sold": []}
+        self.assertEqual([], store.query(engine=["V8"], sold_any=["EU"], price=(None, 50000)))
+        del store[2]
+        self.assertEqual([], store.query(make=["B"]))
+        self.assertEqual([1, 3], [id for id, _ in store.query(make=["A"])])
+
+    def test_workers_sharing_a_repository(self):
+        with tempfile.TemporaryDirectory() as directory:
+            repos = [LogRepository(directory, "cars", key_type=int, refresh_interval=0) for _ in range(2)]
+            try:
+                first, second = CarStore(repository=repos[0]), CarStore(repository=repos[1])
+                self.assertEqual([1, 2], first.add_many([{"make": "A"}, {"make": "B"}]))
+                self.assertEqual([3], second.add_many([{"make": "A"}])) #ids are picked under the shared lock
+                self.assertEqual([1, 3], [id for id, _ in first.query(make=["A"])])
+                del second[1]
+                self.assertEqual([2, 3], first.ids())
+            finally:
+                for repo in repos:
+                    repo.close()
+
+
+class TestCarColumns(unittest.TestCase):
+    def test_follows_store_writes(self):
+        store = CarStore({
+            1: {"make": "A", "engine": "V8", "price": 10.0, "year": 2000, "sold": ["EU"]},
+            2: {"make": "A", "engine": "V4", "price": 30.0, "year": 2000, "sold": ["NA"]},
+            3: {"make": "B", "engine": "V8", "price": None, "year": 2010, "sold": ["EU", "NA"]},
+        })
+        columns = CarColumns(store, capacity=2) #grows as ids come in
+        stats = {row["make"]: row for row in columns.group_stats("make")}
+        self.assertEqual((2, 20.0, 10.0, 30.0), tuple(stats["A"][k] for k in ("count", "avg_price", "min_price", "max_price")))
+        self.assertEqual((1, None), (stats["B"]["count"], stats["B"]["avg_price"]))
+
+        store[3] = {"make": "A", "engine": "V8", "price": 50.0, "year": 2010, "sold": ["EU"]}
+        del store[2]
+        self.assertEqual([{"make": "A", "count": 2, "avg_price": 30.0, "min_price": 10.0, "max_price": 50.0}], columns.group_stats("make"))
+        self.assertEqual([("V8", 2)], [(row["engine"], row["count"]) for row in columns.group_stats("engine", sold=["EU"])])
+
+        histogram = columns.price_histogram("year", bins=2)
+        self.assertEqual([10.0, 30.0, 50.0], histogram["edges"])
+        self.assertEqual([{"year": 2000, "counts": [1, 0]}, {"year": 2010, "counts": [0, 1]}], histogram["groups"])
+
+
+class TestSearchIndex(unittest.TestCase):
+    def setUp(self):
+        self.store = CarStore({
+            1: {"make": "CarBrand", "model": "Fast"},
+            2: {"make": "Speedy", "model": "FourWheeler SUV"},
+            3: {"make": "CarPro", "model": "Supersonic"},
+        })
+        self.index = SearchIndex(self.store)
+
+    def test_tokenize_splits_camel_case(self):
+        self.assertEqual(["fourwheeler", "four", "wheeler", "suv"], list(tokenize("FourWheeler SUV")))
+
+    def test_search_ranks_and_follows_writes(self):
+        self.assertEqual([3], [id for id, _ in self.index.search("supersonic")])
+        self.assertEqual([1], [id for id, _ in self.index.search("CarB")])
+        self.assertEqual([1, 3], [id for id, _ in self.index.search("car")]) #exact token first, then by id
+        self.assertEqual([2], [id for id, _ in self.index.search("four suv")])
+        self.assertEqual([], self.index.search("four fast"))
+
+        self.store[1] = {"make": "Other", "model": "Supersonic"}
+        del self.store[3]
+        self.assertEqual([1], [id for id, _ in self.index.search("super")])
+        self.assertEqual([], self.index.search("carbrand"))
+
+    def test_prefix_matches_rare_tokens(self):
+        for n in range(search.TOP_TOKENS + 8): #more common ca* tokens than the trie keeps per node
+            self.store.add_many([{"make": f"Ca{n:02}x"}] * 3)
+        self.store.add({"make": "Cadillac"})
+        self.assertEqual(["Cadillac"], [s["text"] for s in self.index.suggest("cad")])
+        self.assertNotIn("Cadillac", [s["text"] for s in self.index.suggest("ca", limit=search.TOP_TOKENS)])
+        hits = self.index.search("ca", limit=200)
+        self.assertEqual(3 + 3 * (search.TOP_TOKENS + 8), len(hits))
+        self.assertIn("Cadillac", [self.store[id]["make"] for id, score in hits if score == hits[0][1]]) #rarest tokens rank first
+
+    def test_suggest(self):
+        self.assertEqual([{"text": "Car", "cars": 2}, {"text": "CarBrand", "cars": 1}, {"text": "CarPro", "cars": 1}],
+                         self.index.suggest("ca"))
+        del self.store[3]
+        self.assertEqual(["Car", "CarBrand"], [s["text"] for s in self.index.suggest("ca")])
+        self.store.add({"make": "Carrot"})
+        self.assertEqual(["Car", "CarBrand", "Carrot"], [s["text"] for s in self.index.suggest("speedy ca")])
+
+
+class TestBulk(unittest.TestCase):
+    def test_quoted_line_breaks_stay_in_their_record(self):
+        async def body():
+            for chunk in (b'id,model\n1,"Two\n', b'\nLines"\n2,"a ""b""\n', b'c"\n3,x'):
+                yield chunk
+
+        async def collect():
+            return [item async for item in bulk.lines(body(), quoted=True)]
+
+        records = asyncio.run(collect())
+        self.assertEqual([(1, "id,model"), (2, '1,"Two\n\nLines"'), (5, '2,"a ""b""\nc"'), (7, "3,x")], records)
+        self.assertEqual(["a \"b\"\nc"], [row["model"] for _, row in bulk.parse_csv(records[2:3], ["id", "model"])])
+
+    def test_lines_split_across_chunks(self):
+        async def body():
+            for chunk in (b'{"a":', b' 1}\n\n{"b"', b':"\xc3', b'\xa9"}'): #a multi-byte character split in two
+                yield chunk
+
+        async def collect():
+            return [line async for line in bulk.lines(body())]
+
+        self.assertEqual([(1, '{"a": 1}'), (3, '{"b":"\u00e9"}')], asyncio.run(collect()))
+
+
+class TestCars(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.app = TestClient(app)
+
+    def test_cars(self):
+        response = self.app.get('/cars', params={"number": 2})
+        self.assertEqual(200, response.status_code)
+        self.assertIn("ID: 1", response.text)
+        self.assertNotIn("ID: 3", response.text)
+
+    def test_cars_keyset_pagination(self):
+        response = self.app.get('/cars', params={"number": 2, "after": 2})
+        self.assertIn("ID: 3", response.text)
+        self.assertIn("ID: 4", response.text)
+        self.assertIn('href="/cars?after=4&number=2"', response.text)
+        self.assertIn('href="/cars?before=3&number=2"', response.text)
+
+        response = self.app.get('/cars', params={"number": 2, "before": 3})
+        self.assertIn("ID: 1", response.text)
+        self.assertNotIn("before=", response.text)
+
+    def test_cars_streamed_matches_buffered(self):
+        buffered = self.app.get('/cars', params={"number": 5})
+        streamed = self.app.get('/cars', params={"number": 5, "stream": True})
+        self.assertEqual(200, streamed.status_code)
+        self.assertEqual(buffered.text, streamed.text)
+
+    def test_car_by_id(self):
+        self.assertEqual(200, self.app.get('/cars/1').status_code)
+        self.assertEqual(404, self.app.get('/cars/999').status_code)
+
+    def test_car_page_etag(self):
+        response = self.app.get('/cars/1')
+        etag = response.headers["etag"]
+        self.assertEqual(304, self.app.get('/cars/1', headers={"If-None-Match": etag}).status_code)
+
+        from database import cars
+        original = dict(cars[1])
+        response = self.app.post('/cars/1', data={**original, "price": 26000.0}, allow_redirects=False)
+        self.assertEqual(302, response.status_code)
+        response = self.app.get('/cars/1', headers={"If-None-Match": etag})
+        self.assertEqual(200, response.status_code)
+        self.assertIn("Price: 26000.0$", response.text) #the cached car card was invalidated
+        self.assertNotEqual(etag, response.headers["etag"])
+        self.app.post('/cars/1', data=original, allow_redirects=False)
+
+    def test_car_card_follows_store_writes(self):
+        from database import cars
+        etag = self.app.get('/cars/1').headers["etag"]
+        original = cars[1]
+        cars[1] = {**original, "price": 27000.0} #not through a handler, like a write from another worker
+        try:
+            response = self.app.get('/cars/1', headers={"If-None-Match": etag})
+            self.assertEqual(200, response.status_code)
+            self.assertIn("Price: 27000.0$", response.text)
+        finally:
+            cars[1] = original
+
+    def test_update_keeps_fields_left_out(self):
+        from database import cars
+        original = cars[2]
+        response = self.app.post('/cars/2', data={"price": "12000"}, allow_redirects=False)
+        self.assertEqual(302, response.status_code)
+        self.assertEqual({**original, "price": 12000.0}, cars[2]) #only price changed
+        self.assertEqual(422, self.app.post('/cars/2', data={"year": "1900"}).status_code)
+        self.assertEqual(12000.0, cars[2]["price"])
+        cars[2] = original
+
+    def test_edit_form_clears_sold(self):
+        from database import cars
+        original = cars[1]
+        self.assertIn('name="sold_listed"', self.app.get('/edit', params={"id": 1}).text)
+        response = self.app.post('/cars/1', data={**original, "sold": [], "sold_listed": "true"}, allow_redirects=False)
+        self.assertEqual(302, response.status_code)
+        try:
+            self.assertEqual((), cars[1]["sold"]) #no box checked: no region
+            self.assertNotIn(1, [id for id, _ in cars.query(sold_any=["EU"])]) #and out of the sold index
+        finally:
+            cars[1] = original
+
+    def test_search(self):
+        response = self.app.post('/search', data={"q": "5"}, allow_redirects=False)
+        self.assertEqual("/cars/5", response.headers["location"]) #an id still goes to the car
+        response = self.app.post('/search', data={"q": "super sonic"}, allow_redirects=False)
+        self.assertEqual("/search?q=super+sonic", response.headers["location"])
+        response = self.app.get('/search', params={"q": "supersonic"})
+        self.assertEqual(200, response.status_code)
+        self.assertIn('1 result for "supersonic"', response.text)
+        self.assertIn("Supersonic", response.text)
+        self.assertEqual("CarBrand", self.app.get('/search/suggest', params={"q": "carb"}).json()[0]["text"])
+
+    def test_query(self):
+        response = self.app.get('/cars/query', params={"engine": "V8", "price_max": 50000, "sold": "EU"})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([1], [car["id"] for car in response.json()])
+
+    def test_stats(self):
+        response = self.app.get('/cars/stats', params={"by": "engine", "sold": "EU"})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual({"V8": 1, "V4": 1}, {row["engine"]: row["count"] for row in response.json()})
+        response = self.app.get('/cars/stats', params={"by": "year", "histogram": True, "bins": 3})
+        self.assertEqual(4, len(response.json()["edges"]))
+        self.assertEqual(422, self.app.get('/cars/stats', params={"by": "model"}).status_code)
+
+    def test_bulk_import_and_export(self):
+        from database import cars
+        ndjson = "\n".join([
+            '{"make": "Bulk", "model": "A", "year": 2001, "price": 1.5, "autonomous": false, "sold": ["EU"]}',
+            '{"make": "Bulk", "year": 1900}',
+            'oops',
+            '{"make": "Bulk", "model": "B", "year": 2002}',
+        ])
+        response = self.app.post('/cars/bulk', data=ndjson, headers={"content-type": "application/x-ndjson"})
+        self.assertEqual(201, response.status_code)
+        result = response.json()
+        try:
+            self.assertEqual(2, result["inserted"])
+            self.assertEqual([2, 3], [error["line"] for error in result["errors"]])
+            self.assertEqual(["year"], result["errors"][0]["errors"][0]["loc"])
+
+            exported = self.app.get('/cars/export', params={"format": "csv", "batch": 2})
+            self.assertEqual("text/csv; charset=utf-8", exported.headers["content-type"])
+            rows = exported.text.splitlines()
+            self.assertEqual("id,make,model,year,price,engine,autonomous,sold", rows[0])
+            self.assertIn(f"{result['ids'][0]},Bulk,A,2001,1.5,V4,false,EU", rows)
+            self.assertEqual(len(cars) + 1, len(rows))
+
+            reimport = self.app.post('/cars/bulk', params={"format": "csv"}, data="\n".join([rows[0]] + [r for r in rows if ",Bulk," in r]))
+            self.assertEqual(2, reimport.json()["inserted"]) #the export reads back in
+            result["ids"] += reimport.json()["ids"]
+        finally:
+            for id in result["ids"]:
+                del cars[id]
+
+        self.assertEqual(415, self.app.post('/cars/bulk', data="x", headers={"content-type": "text/plain"}).status_code)
+
+    def test_bulk_import_stores_each_chunk(self):
+        from database import cars
+        ndjson = "\n".join('{"make": "Bulk", "model": "C", "year": 2001}' for _ in range(2 * bulk.CHUNK_ROWS + 1))
+        with mock.patch.object(cars, "add_many", wraps=cars.add_many) as add_many:
+            response = self.app.post('/cars/bulk', data=ndjson, headers={"content-type": "application/x-ndjson"})
+        try:
+            self.assertEqual(2 * bulk.CHUNK_ROWS + 1, response.json()["inserted"])
+            self.assertEqual([bulk.CHUNK_ROWS, bulk.CHUNK_ROWS, 1], [len(call.args[0]) for call in add_many.call_args_list])
+        finally:
+            for id in response.json()["ids"]:
+                del cars[id]
+
+    def test_csv_round_trip_with_line_breaks(self):
+        from database import cars
+        response = self.app.post('/cars/bulk', data='{"make": "Bulk", "model": "Two\\nLines, \\"quoted\\"", "year": 2001}',
+                                 headers={"content-type": "application/x-ndjson"})
+        ids = response.json()["ids"]
+        try:
+            exported = self.app.get('/cars/export', params={"format": "csv"}).text
+            self.assertIn('"Two\nLines, ""quoted"""', exported)
+            reimport = self.app.post('/cars/bulk', params={"format": "csv"}, data=exported)
+            self.assertEqual(0, reimport.json()["error_count"])
+            ids += reimport.json()["ids"]
+            self.assertEqual(["Two\nLines, \"quoted\""] * 2, [cars[id]["model"] for id in ids if cars[id]["make"] == "Bulk"])
+        finally:
+            for id in ids:
+                del cars[id]
+
+    def test_add_and_delete(self):
+        car = {"make": "Testy", "model": "T", "year": 2001, "price": 1.0, "engine": "V4", "autonomous": "false", "sold": ["EU"]}
+        response = self.app.post('/cars', data=car, allow_redirects=False)
+        self.assertEqual(302, response.status_code)
+        from database import cars
+        id = max(cars.ids())
+        self.assertEqual("Testy", cars[id]["make"])
+        self.app.get(f'/delete/{id}', allow_redirects=False)
+        self.assertNotIn(id, cars)
+
+
+if __name__ == "__main__":
+    unittest.main()
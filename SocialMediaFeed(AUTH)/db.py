@@ -1,10 +1,12 @@
-users = {
+from shared.storage import open_repository
+
+users = open_repository("social_users", seed={
     "jadkhalili": {
         "name": "Jad Khalili",
         "username": "jadkhalili",
         "email": "jad@email.com",
         "birthday": "1st January 1970",
-        "friends": ["johndoe", "janedoe1", "doe.jim95"],
+        "friends": ["johndoe"],
         "notifications": [
             {
                 "author": "janedoe1",
@@ -26,7 +28,7 @@ users = {
         "username": "johndoe",
         "email": "johndoe@email.com",
         "birthday": "31st December 1999",
-        "friends": ["jadkhalili", "lip.sum"],
+        "friends": ["jadkhalili"],
         "notifications": [
             {
                 "author": "jadkhalili",
@@ -43,4 +45,4 @@ users = {
         ],
         "hashed_password": "$2b$12$4SqrDVzv6w2wRAbcdVxCdu.zrDJjk/TVWYeStP2V8odpKNDtHqgA."
     }
-}
\ No newline at end of file
+})
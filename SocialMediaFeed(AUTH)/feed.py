@@ -0,0 +1,79 @@
+"""
+Notification feed.
+
+Every user has an inbox holding their latest `capacity` notifications. When an event is
+posted it is written once into the inbox of each recipient (fan-out on write), so reading a
+feed never has to look at anybody else's data, and the oldest items simply fall off.
+
+Each notification gets a sequence number from one counter that only goes up. A client keeps
+the last number it has seen and asks for what came `since`. That costs at most `capacity`
+items, however much history the user has.
+"""
+
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, Iterable, List, NamedTuple, Optional
+
+
+class Page(NamedTuple):
+    items: List[dict]
+    next: int  # pass back as `since` to get what comes after this page
+    missed: bool  # the inbox no longer holds everything since the given cursor
+
+
+class Feed:
+    def __init__(self, capacity: int = 100):
+        self.capacity = capacity
+        self._inboxes: Dict[str, Deque[dict]] = {}
+        self._evicted: Dict[str, int] = {}  # seq of the newest item pushed out of each full inbox
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._listeners: List[Callable[[List[str], dict], None]] = []
+
+    def subscribe(self, listener: Callable[[List[str], dict], None]) -> None:
+        """`listener(recipients, item)` is called after every publish (e.g. to push it to live connections)."""
+        self._listeners.append(listener)
+
+    def publish(self, recipients: Iterable[str], author: str, description: str) -> dict:
+        """Delivers one notification to every recipient and returns it."""
+        recipients = list(set(recipients))
+        with self._lock:
+            self._seq += 1
+            item = {"seq": self._seq, "author": author, "description": description, "created": time.time()}
+            for username in recipients:
+                inbox = self._inboxes.get(username)
+                if inbox is None:
+                    inbox = self._inboxes[username] = deque(maxlen=self.capacity)
+                elif len(inbox) == self.capacity:
+                    self._evicted[username] = inbox[0]["seq"]
+                inbox.append(item)  # the same dict in every inbox; it is never modified
+        for listener in self._listeners:
+            listener(recipients, item)
+        return item
+
+    def latest(self, username: str, limit: int = 20) -> List[dict]:
+        """The newest notifications first, as shown on the home page."""
+        with self._lock:
+            inbox = self._inboxes.get(username, ())
+            return [inbox[-i] for i in range(1, min(limit, len(inbox)) + 1)]
+
+    def since(self, username: str, since: int = 0, limit: int = 20) -> Page:
+        """The oldest `limit` notifications newer than `since`, oldest first."""
+        with self._lock:
+            inbox = self._inboxes.get(username, ())
+            newer: List[dict] = []
+            for item in reversed(inbox):  # newest first, stop at the cursor
+                if item["seq"] <= since:
+                    break
+                newer.append(item)
+            missed = self._evicted.get(username, 0) > since
+            items = newer[::-1][:limit]
+            return Page(items, items[-1]["seq"] if items else max(since, 0), missed)
+
+    def last_seq(self, username: Optional[str] = None) -> int:
+        with self._lock:
+            if username is None:
+                return self._seq
+            inbox = self._inboxes.get(username)
+            return inbox[-1]["seq"] if inbox else 0
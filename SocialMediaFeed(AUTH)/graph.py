@@ -0,0 +1,113 @@
+"""
+Friend graph.
+
+Friendships are undirected edges kept as one set of neighbours per user, so "are A and B
+friends" is a set lookup and mutual friends are a set intersection. Adding or removing an
+edge always updates both ends. Friends that aren't registered users are ignored.
+
+"People you may know" are the friends of friends, ranked by how many mutual friends they
+share with the user. They're computed on first use and cached per user. An edge between A
+and B can only change the suggestions of A, B and their friends, so only those caches are
+dropped.
+"""
+
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, Mapping, Set, Tuple
+
+
+class FriendGraph:
+    def __init__(self):
+        self._adjacency: Dict[str, Set[str]] = {}
+        self._suggestions: Dict[str, List[Tuple[str, int]]] = {}
+        self._lock = threading.RLock()
+
+    @classmethod
+    def from_users(cls, users: Mapping[str, dict]) -> "FriendGraph":
+        graph = cls()
+        for username in users:
+            graph.add_user(username)
+        for username, record in users.items():
+            for friend in record.get("friends") or ():
+                graph.add_friendship(username, friend)
+        return graph
+
+    def __contains__(self, username: str) -> bool:
+        return username in self._adjacency
+
+    def add_user(self, username: str) -> None:
+        with self._lock:
+            self._adjacency.setdefault(username, set())
+
+    def remove_user(self, username: str) -> None:
+        with self._lock:
+            for friend in list(self._adjacency.get(username, ())):
+                self.remove_friendship(username, friend)
+            self._adjacency.pop(username, None)
+            self._suggestions.pop(username, None)
+
+    def add_friendship(self, a: str, b: str) -> bool:
+        """Returns False when nothing changed (unknown user, same user, already friends)."""
+        with self._lock:
+            if a == b or a not in self._adjacency or b not in self._adjacency or b in self._adjacency[a]:
+                return False
+            self._adjacency[a].add(b)
+            self._adjacency[b].add(a)
+            self._invalidate(a, b)
+            return True
+
+    def remove_friendship(self, a: str, b: str) -> bool:
+        with self._lock:
+            if b not in self._adjacency.get(a, ()):
+                return False
+            self._adjacency[a].discard(b)
+            self._adjacency[b].discard(a)
+            self._invalidate(a, b)
+            return True
+
+    def set_friends(self, username: str, friends: Iterable[str]) -> None:
+        """Makes `username`'s friends exactly `friends` (e.g. after the stored record changed)."""
+        with self._lock:
+            self.add_user(username)
+            wanted = {friend for friend in friends if friend in self._adjacency and friend != username}
+            current = self._adjacency[username]
+            for friend in current - wanted:
+                self.remove_friendship(username, friend)
+            for friend in wanted - current:
+                self.add_friendship(username, friend)
+
+    def _invalidate(self, a: str, b: str) -> None:
+        for username in (a, b):
+            self._suggestions.pop(username, None)
+            for friend in self._adjacency.get(username, ()):
+                self._suggestions.pop(friend, None)
+
+    # queries
+    def are_friends(self, a: str, b: str) -> bool:
+        return b in self._adjacency.get(a, ())
+
+    def friends(self, username: str) -> List[str]:
+        with self._lock:
+            return sorted(self._adjacency.get(username, ()))
+
+    def mutual_friends(self, a: str, b: str) -> List[str]:
+        with self._lock:
+            return sorted(self._adjacency.get(a, set()) & self._adjacency.get(b, set()))
+
+    def mutual_count(self, a: str, b: str) -> int:
+        with self._lock:
+            return len(self._adjacency.get(a, set()) & self._adjacency.get(b, set()))
+
+    def suggestions(self, username: str, limit: int = 10) -> List[Tuple[str, int]]:
+        """(username, mutual friend count) pairs, most mutual friends first."""
+        with self._lock:
+            ranked = self._suggestions.get(username)
+            if ranked is None:
+                friends = self._adjacency.get(username, set())
+                counts: Counter = Counter()
+                for friend in friends:
+                    counts.update(self._adjacency[friend])
+                for known in friends | {username}:
+                    counts.pop(known, None)
+                ranked = self._suggestions[username] = sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+            return ranked[:limit]
@@ -1,18 +1,31 @@
-from fastapi import FastAPI, Request,Response,Depends,status,Form
-from fastapi.encoders import jsonable_encoder
+from fastapi import FastAPI, Request,Response,Depends,status,Form,Query,Header,WebSocket,WebSocketDisconnect,HTTPException
 from fastapi.security import OAuth2PasswordRequestForm 
-from fastapi.responses import HTMLResponse,RedirectResponse
-from fastapi.templating import Jinja2Templates
+from fastapi.responses import HTMLResponse,RedirectResponse,StreamingResponse
 from fastapi.staticfiles import StaticFiles
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from typing import List,Optional
-from passlib.context import CryptContext
-from fastapi_login import LoginManager
+import asyncio
 import os
+import sys
 from dotenv import load_dotenv
-from db import users
 from datetime import timedelta
 
+BASEDIR = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(os.path.dirname(BASEDIR)) #repository root, for the shared package
+
+from shared.auth import CachedLoginManager
+from shared.directory import Taken,UserDirectory
+from shared.metrics import install as install_metrics
+from shared.records import record_type
+from shared.hashing import HasherBusy,PasswordHasher,hasher_busy_handler
+from shared.rendering import CachedTemplates
+from shared.storage import MISSING
+from db import users
+from feed import Feed
+from graph import FriendGraph
+from push import LocalHub,sse_events
+
 
 #Model
 class Notification(BaseModel):
@@ -25,11 +38,19 @@ class User(BaseModel):
     email: str
     birthday: Optional[str]
     friends: Optional[List[str]]
-    notifications: Optional[List[Notification]]
+    #notifications are served from the feed, not from the user record
+
+class Event(BaseModel):
+    description: str
 
 #Now we're going to create Database Model inheriting not from BaseModel but from our pydantic model
 class UserDB(User):
     hashed_password:str #1
+
+    class Config:
+        frozen = True #Loaded users are cached and shared between requests
+
+user_records = record_type(UserDB) #stored users are validated read-only dicts
     
 #env variables
 load_dotenv()
@@ -37,17 +58,18 @@ SECRET = os.getenv("SECRET_KEY")
 
 ACCESS_TOKEN_EXPIRES_MINUTES=60 
 
-#passwordhashing 
-pwd_ctx = CryptContext(schemes=["bcrypt"])
-def get_hashed_password(plain_password):
-    return pwd_ctx.hash(plain_password)
+#passwordhashing - bcrypt runs in a bounded process pool, not in the request handler
+hasher = PasswordHasher()
+async def get_hashed_password(plain_password):
+    return await hasher.hash(plain_password)
 
-def verify_password(plain_password, hashed_password):
-    return pwd_ctx.verify(plain_password,hashed_password)
+async def verify_password(plain_password, hashed_password):
+    return await hasher.verify(plain_password,hashed_password)
 
 
 #login - global variable
-manager = LoginManager(secret=SECRET,token_url="/login",use_cookie=True)
+manager = CachedLoginManager(secret=SECRET,token_url="/login",use_cookie=True) #Remembers the user per token until it expires
+manager.follow(users) #or until the user's record changes, in any worker
 manager.cookie_name="auth"
 
 
@@ -56,11 +78,19 @@ def get_user_from_db(username:str):
     if username in users.keys():
         return UserDB(**users[username])
 
-def authenticate_user(username:str,password:str):
+def store_rehashed_password(username:str,old_hash:str,new_hash:str)->bool:
+    user = users.get(username)
+    if user is None or user.get("hashed_password") != old_hash: #changed while we were hashing: keep the newer one
+        return False
+    users[username] = user_records.merge(user,{"hashed_password":new_hash})
+    return True
+
+async def authenticate_user(username:str,password:str):
     user=get_user_from_db(username=username)
     if not user:
         return None
-    if not verify_password(plain_password=password,hashed_password=user.hashed_password):
+    #Repeated logins are answered from a short-lived cache; outdated hashes are upgraded in the background
+    if not await hasher.authenticate(username,password,user.hashed_password,on_rehash=store_rehashed_password):
         return None
     return user
 
@@ -69,12 +99,49 @@ def authenticate_user(username:str,password:str):
 
 #Initialization of application
 app = FastAPI()
+app.add_exception_handler(HasherBusy,hasher_busy_handler) #503 + Retry-After when too many hashes are queued
+install_metrics(app) #per-route latency and in-flight requests, served at /metrics
+
+
 
+#Feed - capped per-user inboxes, filled on write
+HOME_FEED_SIZE = 20
+feed = Feed(capacity=100)
+for username, record in users.items():
+    for notification in reversed(record.get("notifications") or []): #listed newest first
+        feed.publish([username], notification["author"], notification["description"])
+
+hub = LocalHub(queue_size=32, policy="drop_oldest") #live connections of this worker
+feed.subscribe(hub.publish)
+
+
+#Unique username / email indexes for sign-up
+directory = UserDirectory(users)
+
+
+#Friend graph - symmetric adjacency sets, kept in step with the stored users
+graph = FriendGraph.from_users(users)
+
+def sync_friends(username:str, record):
+    if record is MISSING:
+        graph.remove_user(username)
+    else:
+        graph.set_friends(username, record.get("friends") or [])
+
+users.subscribe(sync_friends) #also sees the changes other workers make when DATA_DIR is set
+
+def save_friends(*usernames:str): #with DATA_DIR each write waits for its fsync: call it in the threadpool
+    for username in usernames:
+        users[username] = user_records.merge(users[username],{"friends":graph.friends(username)})
+
+for username, record in list(users.items()): #stored lists naming users that don't exist would become edges once those names are registered
+    if sorted(record.get("friends") or []) != graph.friends(username):
+        save_friends(username)
 
 
 #Templates
-templates= Jinja2Templates(directory="templates")
-app.mount("/static",StaticFiles(directory="static"),name="static")
+templates= CachedTemplates(directory=BASEDIR+"/templates",enable_async=True) #Static pages are rendered once and served from memory. Rendered on the event loop
+app.mount("/static",StaticFiles(directory=BASEDIR+"/static"),name="static")
 
 
 
@@ -82,21 +149,21 @@ app.mount("/static",StaticFiles(directory="static"),name="static")
 
 
 @app.get('/', response_class=HTMLResponse)
-def root(request:Request):
-    return templates.TemplateResponse("index.html",{"request":request,"title":"FriendConnect - Home"})
+async def root(request:Request):
+    return await templates.render_static("index.html",{"request":request,"title":"FriendConnect - Home"})
 
 
 @app.get("/login",response_class=HTMLResponse)
-def get_login(request:Request):
-    return templates.TemplateResponse("login.html",{"request":request,"title":"FriendConnect - Login"})
+async def get_login(request:Request):
+    return await templates.render_static("login.html",{"request":request,"title":"FriendConnect - Login"})
 
 
 
 @app.post("/login") 
-def login(request:Request,response:Response,form_data:OAuth2PasswordRequestForm = Depends(OAuth2PasswordRequestForm)) :
-    user = authenticate_user(username=form_data.username,password=form_data.password)
+async def login(request:Request,response:Response,form_data:OAuth2PasswordRequestForm = Depends(OAuth2PasswordRequestForm)) :
+    user = await authenticate_user(username=form_data.username,password=form_data.password)
     if not user: 
-        return templates.TemplateResponse("login.html",{"request":request,"title":"FriendConnect - Login","invalid":True},status_code=status.HTTP_401_UNAUTHORIZED)
+        return await templates.render_static("login.html",{"request":request,"title":"FriendConnect - Login","invalid":True},status_code=status.HTTP_401_UNAUTHORIZED)
     
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRES_MINUTES) 
     access_token = manager.create_access_token(data={"sub":user.username},expires=access_token_expires) #2 user.username
@@ -117,37 +184,132 @@ manager.not_authenticated_exception = NotAuthenticatedException
 app.add_exception_handler(NotAuthenticatedException, not_authenticated_exception_handler)
 
 @app.get('/home')
-def home(request: Request, user:User = Depends(manager)):  #user in this case will be whatever the with LoginManager.user_loader decorated function returns.
-    user = User(**dict(user))
-    return templates.TemplateResponse("home.html",{"request":request,"title":"FriendConnect - Home","user":user})
+async def home(request: Request, user:User = Depends(manager)):  #user in this case will be whatever the with LoginManager.user_loader decorated function returns.
+    notifications = feed.latest(user.username, HOME_FEED_SIZE)
+    return await templates.render("home.html",{"request":request,"title":"FriendConnect - Home","user":user,"notifications":notifications,"since":feed.last_seq(user.username),
+                                                   "friends":graph.friends(user.username),"suggestions":graph.suggestions(user.username,5)})
+
+
+@app.post('/events',status_code=status.HTTP_201_CREATED)
+async def post_event(event:Event, user:User = Depends(manager)):
+    recipients = graph.friends(user.username)
+    item = feed.publish(recipients,user.username,event.description) #one write per friend, reads stay cheap
+    return {"seq":item["seq"],"recipients":len(recipients)}
+
+
+@app.get('/notifications')
+async def get_notifications(since:int = Query(0,ge=0), limit:int = Query(20,ge=1,le=100), user:User = Depends(manager)):
+    return feed.since(user.username,since,limit)._asdict()
+
+
+@app.get('/friends')
+async def get_friends(user:User = Depends(manager)):
+    return {"friends":graph.friends(user.username)}
+
+
+@app.get('/friends/suggestions')
+async def get_friend_suggestions(limit:int = Query(10,ge=1,le=100), user:User = Depends(manager)):
+    return [{"username":username,"mutual":mutual} for username,mutual in graph.suggestions(user.username,limit)]
+
+
+@app.get('/friends/{username}')
+async def get_friendship(username:str, user:User = Depends(manager)):
+    if username not in graph:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,detail="User not found")
+    return {"username":username,"friends":graph.are_friends(user.username,username),"mutual":graph.mutual_friends(user.username,username)}
+
+
+@app.put('/friends/{username}')
+async def add_friend(username:str, user:User = Depends(manager)):
+    if username not in graph or username == user.username:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,detail="User not found")
+    if graph.add_friendship(user.username,username):
+        await run_in_threadpool(save_friends,user.username,username)
+    return {"friends":graph.friends(user.username)}
+
+
+@app.delete('/friends/{username}')
+async def remove_friend(username:str, user:User = Depends(manager)):
+    if graph.remove_friendship(user.username,username):
+        await run_in_threadpool(save_friends,user.username,username)
+    return {"friends":graph.friends(user.username)}
+
+
+@app.get('/notifications/stream')
+async def notification_stream(since:int = Query(0,ge=0), last_event_id:Optional[int] = Header(None), user:User = Depends(manager)):
+    subscription = hub.subscribe(user.username) #subscribe before reading the backlog so nothing falls in between
+    backlog = feed.since(user.username, last_event_id if last_event_id is not None else since, feed.capacity).items
+    return StreamingResponse(sse_events(subscription,backlog),media_type="text/event-stream",headers={"Cache-Control":"no-cache"})
+
+
+async def user_from_cookie(websocket:WebSocket):
+    token = websocket.cookies.get(manager.cookie_name)
+    if not token:
+        return None
+    try:
+        return await manager.get_current_user(token)
+    except NotAuthenticatedException:
+        return None
+
+
+@app.websocket('/ws/notifications')
+async def notification_socket(websocket:WebSocket, since:int = 0):
+    user = await user_from_cookie(websocket)
+    if user is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    await websocket.accept()
+    subscription = hub.subscribe(user.username)
+
+    async def watch_disconnect(): #we only push, but have to notice when the client goes away
+        try:
+            while (await websocket.receive())["type"] != "websocket.disconnect":
+                pass
+        finally:
+            subscription.close()
+
+    watcher = asyncio.create_task(watch_disconnect())
+    try:
+        last = since
+        for item in feed.since(user.username, since, feed.capacity).items:
+            await websocket.send_json(item)
+            last = item["seq"]
+        while True:
+            item = await subscription.get()
+            if item is None:
+                if not watcher.done(): #dropped as a slow consumer, the client reconnects with ?since=
+                    await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+                break
+            if item["seq"] > last:
+                await websocket.send_json(item)
+                last = item["seq"]
+    except WebSocketDisconnect:
+        pass
+    finally:
+        subscription.close()
+        watcher.cancel()
 
 @app.get('/logout',response_class=RedirectResponse)
-def logout(): #1
+async def logout(): #1
     response = RedirectResponse('/')
     manager.set_cookie(response, None) 
     return response
 
 
 @app.get('/register',response_class=HTMLResponse)
-def register(request:Request):
-    return templates.TemplateResponse('register.html',{"request":request,"title":"FriendConnect - Register","invalid":False})
+async def get_register(request:Request):
+    return await templates.render_static('register.html',{"request":request,"title":"FriendConnect - Register","invalid":False})
 
 
 @app.post('/register')
-def register(request:Request,username:str=Form(...),name:str=Form(...),password:str =Form(...),email:str=Form(...)) :
-    #get the hash password we need 
-    hashed_password= get_hashed_password(password)
-    invalid = False
-
-    for db_username in users.keys():
-        if username == db_username:
-            invalid = True
-        elif users[db_username]["email"] == email : 
-            invalid = True
-    if invalid:
-        return templates.TemplateResponse("register.html",{"request":request,"title":"FriendConnect - Register","invalid":invalid},status_code=status.HTTP_400_BAD_REQUEST)
-    
-    users[username] = jsonable_encoder(UserDB(username=username,email=email,name=name,hashed_password=hashed_password)) #3
+async def register(request:Request,username:str=Form(...),name:str=Form(...),password:str =Form(...),email:str=Form(...)) :
+    try:
+        #username and email are checked (and held) before paying for the hash
+        with directory.reserve(username,email) as reservation:
+            hashed_password= await get_hashed_password(password)
+            await run_in_threadpool(reservation.commit,user_records.validate(dict(username=username,email=email,name=name,hashed_password=hashed_password))) #3
+    except Taken:
+        return await templates.render_static("register.html",{"request":request,"title":"FriendConnect - Register","invalid":True},status_code=status.HTTP_400_BAD_REQUEST)
 
     response = RedirectResponse('/login', status_code=status.HTTP_302_FOUND) #4
     manager.set_cookie(response,None)
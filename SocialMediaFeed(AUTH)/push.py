@@ -0,0 +1,156 @@
+"""
+Live notification delivery.
+
+A Hub delivers each published notification to the open connections (SSE or WebSocket) of
+its recipients. LocalHub does it in-process on the event loop, so it only reaches clients
+connected to the same worker. A hub backed by a broker (Redis pub/sub...) would implement the
+same two methods.
+
+Every connection has a small bounded buffer. A client that doesn't keep up doesn't slow
+anybody else down: with the "drop_oldest" policy its oldest pending notifications are
+dropped, with "disconnect" its subscription is closed. Either way the client can get what
+it missed from the feed by reconnecting with the last seq it saw (SSE's Last-Event-ID).
+"""
+
+import asyncio
+import json
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import AsyncIterator, Deque, Dict, Iterable, List, Optional, Set
+
+
+class Subscription:
+    """One live connection. Kept small, since mostly idle connections can number in the thousands."""
+
+    __slots__ = ("username", "dropped", "closed", "_hub", "_size", "_items", "_waiter")
+
+    def __init__(self, hub: "LocalHub", username: str, size: int):
+        self.username = username
+        self.dropped = 0
+        self.closed = False
+        self._hub = hub
+        self._size = size
+        self._items: Optional[Deque[dict]] = None  # allocated on the first message
+        self._waiter: Optional[asyncio.Future] = None
+
+    def offer(self, message: dict) -> None:
+        """Called on the event loop by the hub."""
+        if self.closed:
+            return
+        if self._items is None:
+            self._items = deque(maxlen=self._size)
+        elif len(self._items) == self._size:
+            self.dropped += 1
+            if self._hub.policy == "disconnect":
+                self.close()
+                return
+        self._items.append(message)  # a full deque drops its oldest item
+        self._wake()
+
+    async def get(self, timeout: Optional[float] = None) -> Optional[dict]:
+        """The next message, or None once closed or when `timeout` passes without one."""
+        if not self._items and not self.closed:
+            loop = asyncio.get_running_loop()
+            self._waiter = loop.create_future()
+            timer = loop.call_later(timeout, self._wake) if timeout is not None else None
+            try:
+                await self._waiter
+            finally:
+                self._waiter = None
+                if timer is not None:
+                    timer.cancel()
+        if self._items:
+            return self._items.popleft()
+        return None
+
+    def _wake(self) -> None:
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    def close(self) -> None:
+        if not self.closed:
+            self.closed = True
+            self._hub._remove(self)
+            self._wake()
+
+
+class Hub(ABC):
+    @abstractmethod
+    def subscribe(self, username: str) -> Subscription:
+        """Opens a subscription for `username`; must be called on the event loop."""
+
+    @abstractmethod
+    def publish(self, usernames: Iterable[str], message: dict) -> None:
+        """Delivers `message` to every open subscription of `usernames`; may be called from any thread."""
+
+
+class LocalHub(Hub):
+    def __init__(self, queue_size: int = 32, policy: str = "drop_oldest"):
+        if policy not in ("drop_oldest", "disconnect"):
+            raise ValueError(f"Unknown slow-consumer policy: {policy}")
+        self.queue_size = queue_size
+        self.policy = policy
+        self._subscriptions: Dict[str, Set[Subscription]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def subscribe(self, username: str) -> Subscription:
+        self._loop = asyncio.get_running_loop()
+        subscription = Subscription(self, username, self.queue_size)
+        self._subscriptions.setdefault(username, set()).add(subscription)
+        return subscription
+
+    def _remove(self, subscription: Subscription) -> None:
+        subscriptions = self._subscriptions.get(subscription.username)
+        if subscriptions is not None:
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self._subscriptions[subscription.username]
+
+    def publish(self, usernames: Iterable[str], message: dict) -> None:
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return  # nobody has ever connected
+        usernames = list(usernames)
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            self._deliver(usernames, message)
+        else:  # sync handlers run on the threadpool
+            loop.call_soon_threadsafe(self._deliver, usernames, message)
+
+    def _deliver(self, usernames: List[str], message: dict) -> None:
+        for username in usernames:
+            for subscription in list(self._subscriptions.get(username, ())):
+                subscription.offer(message)
+
+    def connections(self) -> int:
+        return sum(len(subscriptions) for subscriptions in self._subscriptions.values())
+
+
+async def sse_events(subscription: Subscription, backlog: List[dict], keepalive: float = 15) -> AsyncIterator[str]:
+    """
+    Server-sent events: first `backlog` (what the client missed), then live messages.
+    Live messages already sent as part of the backlog are skipped, using their `seq`.
+    """
+    last = 0
+    try:
+        for message in backlog:
+            yield _sse(message)
+            last = message["seq"]
+        while True:
+            message = await subscription.get(timeout=keepalive)
+            if message is None:
+                if subscription.closed:
+                    return
+                yield ": keepalive\n\n"  # also lets the server notice clients that went away
+            elif message["seq"] > last:
+                yield _sse(message)
+                last = message["seq"]
+    finally:
+        subscription.close()
+
+
+def _sse(message: dict) -> str:
+    return f"id: {message['seq']}\nevent: notification\ndata: {json.dumps(message)}\n\n"
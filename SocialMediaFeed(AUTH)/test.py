@@ -0,0 +1,257 @@
+from fastapi.testclient import TestClient
+import asyncio
+from concurrent.futures.process import BrokenProcessPool
+import threading
+import unittest
+from main import app, feed, hasher, users
+from feed import Feed
+from graph import FriendGraph
+from push import LocalHub, sse_events
+from shared.hashing import HasherBusy, PasswordHasher
+
+
+class TestPasswordHasher(unittest.TestCase):
+    def test_hash_and_verify(self):
+        hashed = hasher.hash_sync("admin1234")
+        self.assertTrue(hasher.verify_sync("admin1234", hashed))
+        self.assertFalse(asyncio.run(hasher.verify("wrong", hashed)))
+
+    def test_backpressure(self):
+        saturated = PasswordHasher(max_workers=1, max_queue=0)
+        with saturated._lock:
+            saturated._pending = 1 #one hash already running, no room left in the queue
+        with self.assertRaises(HasherBusy):
+            saturated.hash_sync("admin1234")
+        self.assertEqual(1, saturated.stats()["rejected"])
+
+    def test_recovers_from_a_dead_worker(self):
+        pool = PasswordHasher(max_workers=1)
+        try:
+            pool.hash_sync("admin1234")
+            for process in list(pool._executor._processes.values()):
+                process.kill() #like the OOM killer
+                process.join()
+            with self.assertRaises(BrokenProcessPool):
+                pool.hash_sync("admin1234")
+            self.assertTrue(pool.verify_sync("admin1234", pool.hash_sync("admin1234"))) #on a new pool
+            self.assertEqual(0, pool.stats()["in_flight"])
+        finally:
+            pool.shutdown()
+
+    def test_verified_cache_and_rehash(self):
+        weak = PasswordHasher(max_workers=1, rounds=4).hash_sync("admin1234")
+        stronger = PasswordHasher(max_workers=1, rounds=5)
+        stored = {"migo": weak}
+
+        def on_rehash(username, old_hash, new_hash):
+            if stored[username] != old_hash:
+                return False
+            stored[username] = new_hash
+            return True
+
+        async def login(password, hashed_password):
+            ok = await stronger.authenticate("migo", password, hashed_password, on_rehash)
+            await asyncio.gather(*stronger._rehashing) #let the background rehash finish
+            return ok
+
+        self.assertTrue(asyncio.run(login("admin1234", weak)))
+        self.assertTrue(stored["migo"].startswith("$2b$05$"))
+        self.assertFalse(stronger.needs_update(stored["migo"]))
+
+        self.assertTrue(asyncio.run(login("admin1234", stored["migo"])))
+        self.assertFalse(asyncio.run(login("wrong", stored["migo"])))
+        self.assertEqual(1, stronger.stats()["verified_cache_hits"])
+        self.assertEqual(1, stronger.stats()["rehashed"])
+        self.assertNotIn(b"admin1234", repr(stronger.verified._entries).encode())
+
+    def test_rehash_keeps_a_newer_password(self):
+        from main import store_rehashed_password
+        original = users["johndoe"]
+        users["johndoe"] = {**original, "hashed_password": "changed meanwhile"}
+        try:
+            self.assertFalse(store_rehashed_password("johndoe", original["hashed_password"], "rehashed"))
+            self.assertEqual("changed meanwhile", users["johndoe"]["hashed_password"])
+        finally:
+            users["johndoe"] = original
+
+    def test_rehash_failures_are_logged(self):
+        weak = PasswordHasher(max_workers=1, rounds=4).hash_sync("admin1234")
+        stronger = PasswordHasher(max_workers=1, rounds=5)
+
+        def on_rehash(username, old_hash, new_hash):
+            raise OSError("disk full")
+
+        async def login():
+            await stronger.authenticate("migo", "admin1234", weak, on_rehash)
+            await asyncio.gather(*stronger._rehashing)
+
+        with self.assertLogs("shared.hashing") as logs:
+            asyncio.run(login())
+        self.assertIn("disk full", "\n".join(logs.output))
+        self.assertEqual(0, stronger.stats()["rehashed"])
+
+
+class TestNotificationFeed(unittest.TestCase):
+    def test_fan_out_and_cursor(self):
+        notifications = Feed(capacity=3)
+        first = notifications.publish(["amy", "bob"], "carl", "posted a photo.")
+        notifications.publish(["bob"], "amy", "liked your post.")
+        self.assertEqual([first], notifications.since("amy").items)
+
+        page = notifications.since("bob", limit=1)
+        self.assertEqual(["carl"], [item["author"] for item in page.items])
+        page = notifications.since("bob", since=page.next)
+        self.assertEqual(["amy"], [item["author"] for item in page.items])
+        self.assertEqual([], notifications.since("bob", since=page.next).items)
+
+    def test_capacity(self):
+        notifications = Feed(capacity=3)
+        for n in range(5):
+            notifications.publish(["amy"], "bob", str(n))
+        self.assertEqual(["4", "3"], [item["description"] for item in notifications.latest("amy", 2)])
+        self.assertTrue(notifications.since("amy").missed)
+        self.assertFalse(notifications.since("amy", since=2).missed)
+
+
+class TestFriendGraph(unittest.TestCase):
+    def setUp(self) -> None:
+        self.graph = FriendGraph.from_users({
+            "amy": {"friends": ["bob", "carl", "ghost"]}, #ghost isn't a user
+            "bob": {"friends": ["dan"]},
+            "carl": {"friends": ["dan", "eve"]},
+            "dan": {}, "eve": {},
+        })
+
+    def test_edges_are_symmetric(self):
+        self.assertTrue(self.graph.are_friends("bob", "amy"))
+        self.assertNotIn("ghost", self.graph.friends("amy"))
+        self.assertEqual(["bob", "carl"], self.graph.mutual_friends("amy", "dan"))
+
+    def test_suggestions_follow_edges(self):
+        self.assertEqual([("dan", 2), ("eve", 1)], self.graph.suggestions("amy"))
+        self.graph.add_friendship("amy", "dan")
+        self.assertEqual([("eve", 1)], self.graph.suggestions("amy"))
+        self.assertEqual([("amy", 1), ("dan", 1)], self.graph.suggestions("eve"))
+        self.graph.set_friends("carl", ["amy"])
+        self.assertEqual([], self.graph.suggestions("eve"))
+
+
+class TestPushHub(unittest.TestCase):
+    def test_slow_consumer_drops_oldest(self):
+        async def scenario():
+            hub = LocalHub(queue_size=2)
+            subscription = hub.subscribe("amy")
+            for seq in range(1, 5):
+                hub.publish(["amy", "bob"], {"seq": seq})
+            self.assertEqual(2, subscription.dropped)
+            self.assertEqual({"seq": 3}, await subscription.get())
+            subscription.close()
+            self.assertEqual(0, hub.connections())
+
+        asyncio.run(scenario())
+
+    def test_slow_consumer_disconnected(self):
+        async def scenario():
+            hub = LocalHub(queue_size=1, policy="disconnect")
+            subscription = hub.subscribe("amy")
+            hub.publish(["amy"], {"seq": 1})
+            hub.publish(["amy"], {"seq": 2})
+            self.assertTrue(subscription.closed)
+            self.assertEqual({"seq": 1}, await subscription.get())
+            self.assertIsNone(await subscription.get())
+
+        asyncio.run(scenario())
+
+    def test_sse_backlog_then_live(self):
+        async def scenario():
+            hub = LocalHub()
+            subscription = hub.subscribe("amy")
+            hub.publish(["amy"], {"seq": 2}) #already part of the backlog
+            hub.publish(["amy"], {"seq": 3})
+            events = sse_events(subscription, [{"seq": 1}, {"seq": 2}], keepalive=0.01)
+            received = [await events.__anext__() for _ in range(4)]
+            await events.aclose()
+            return received
+
+        received = asyncio.run(scenario())
+        self.assertEqual(["id: 1", "id: 2", "id: 3"], [event.split("\n")[0] for event in received[:3]])
+        self.assertEqual(": keepalive\n\n", received[3])
+
+
+class TestFeed(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.app = TestClient(app)
+        cls.app.post('/register', data={"username": "tester", "name": "Tester", "password": "admin1234", "email": "tester@email.com"})
+
+    def tearDown(self) -> None:
+        self.app.cookies.clear()
+
+    def test_index(self):
+        response = self.app.get('/')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(304, self.app.get('/', headers={"If-None-Match": response.headers["etag"]}).status_code)
+
+    def test_register_duplicate(self):
+        hashed = hasher.stats()["completed"]
+        response = self.app.post('/register', data={"username": "tester", "name": "T", "password": "x", "email": "other@email.com"})
+        self.assertEqual(400, response.status_code)
+        response = self.app.post('/register', data={"username": "tester2", "name": "T", "password": "x", "email": " Tester@Email.com"})
+        self.assertEqual(400, response.status_code)
+        self.assertEqual(hashed, hasher.stats()["completed"]) #refused before hashing
+
+    def test_login_and_home(self):
+        response = self.app.post('/login', data={"username": "tester", "password": "wrong"})
+        self.assertEqual(401, response.status_code)
+        response = self.app.post('/login', data={"username": "tester", "password": "admin1234"}, allow_redirects=False)
+        self.assertEqual(302, response.status_code)
+        response = self.app.get('/home')
+        self.assertEqual(200, response.status_code)
+        self.assertIn("@tester", response.text)
+
+    def test_notifications(self):
+        self.app.post('/login', data={"username": "tester", "password": "admin1234"})
+        self.assertEqual(0, self.app.post('/events', json={"description": "joined FriendConnect"}).json()["recipients"])
+
+        since = self.app.get('/notifications').json()["next"]
+        feed.publish(["tester"], "jadkhalili", "liked a post you made.")
+        page = self.app.get('/notifications', params={"since": since}).json()
+        self.assertEqual(["liked a post you made."], [item["description"] for item in page["items"]])
+        self.assertEqual([], self.app.get('/notifications', params={"since": page["next"]}).json()["items"])
+        self.assertIn("liked a post you made.", self.app.get('/home').text)
+
+    def test_friends(self):
+        self.app.post('/login', data={"username": "tester", "password": "admin1234"})
+        self.assertEqual(404, self.app.put('/friends/lip.sum').status_code)
+        try:
+            self.assertEqual(["jadkhalili"], self.app.put('/friends/jadkhalili').json()["friends"])
+            self.assertIn("tester", users["jadkhalili"]["friends"]) #stored on both ends
+            self.assertEqual([{"username": "johndoe", "mutual": 1}], self.app.get('/friends/suggestions').json())
+            self.assertEqual(["jadkhalili"], self.app.get('/friends/johndoe').json()["mutual"])
+            self.assertIn("People you may know", self.app.get('/home').text)
+        finally:
+            self.assertEqual([], self.app.delete('/friends/jadkhalili').json()["friends"])
+        self.assertNotIn("tester", users["jadkhalili"]["friends"])
+
+    def test_unknown_friends_are_dropped(self):
+        self.assertEqual(["johndoe"], list(users["jadkhalili"]["friends"]))
+        self.app.post('/register', data={"username": "doe.jim95", "name": "Jim", "password": "admin1234", "email": "jim@email.com"})
+        users["jadkhalili"] = dict(users["jadkhalili"]) #rewritten as-is, e.g. by a rehash
+        self.app.post('/login', data={"username": "doe.jim95", "password": "admin1234"})
+        self.assertEqual([], self.app.get('/friends').json()["friends"])
+        self.assertNotIn("doe.jim95", users["jadkhalili"]["friends"])
+
+    def test_websocket_push(self):
+        with self.assertRaises(Exception):
+            with self.app.websocket_connect('/ws/notifications'):
+                pass #no cookie
+
+        self.app.post('/login', data={"username": "tester", "password": "admin1234"})
+        since = feed.last_seq("tester")
+        with self.app.websocket_connect(f'/ws/notifications?since={since}') as websocket:
+            feed.publish(["tester"], "johndoe", "messaged you.")
+            self.assertEqual("messaged you.", websocket.receive_json()["description"])
+
+
+if __name__ == "__main__":
+    unittest.main()
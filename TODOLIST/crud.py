@@ -0,0 +1,81 @@
+from sqlalchemy import bindparam,delete,insert,select,update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from typing import List
+from uuid import uuid4
+import models
+import schemas
+
+#Bulk statements work on the tables directly, so that a list of parameters runs as a single executemany
+tasks_table = models.Task.__table__
+users_table = models.User.__table__
+
+#Statements are built once with bound parameters, so every call hits SQLAlchemy's compiled cache
+USERS_PAGE = (select(users_table.c.id,users_table.c.username,users_table.c.email) #the columns of schemas.UserRead
+    .order_by(users_table.c.id).limit(bindparam("limit")).offset(bindparam("skip")))
+TASKS_OF_USERS_PAGE = (select(tasks_table.c.id,tasks_table.c.text,tasks_table.c.user_id)
+    .where(tasks_table.c.user_id.in_(USERS_PAGE.with_only_columns(users_table.c.id).scalar_subquery()))
+    .order_by(tasks_table.c.user_id,tasks_table.c.id))
+USER_WITH_TASKS = (select(models.User).where(models.User.id == bindparam("user_id"))
+    .options(selectinload(models.User.tasks)))
+TASKS_OF_USER = select(models.Task).where(models.Task.user_id == bindparam("user_id"))
+
+
+def new_id() -> str:
+    return uuid4().hex
+
+
+async def create_user(db:AsyncSession,user:schemas.UserCreate) -> models.User:
+    db_user = models.User(id=new_id(),tasks=[],**user.dict())
+    db.add(db_user)
+    await db.commit()
+    return db_user
+
+async def get_user(db:AsyncSession,user_id:str) -> models.User:
+    result = await db.execute(USER_WITH_TASKS,{"user_id":user_id}) #the tasks come in one extra query, not one per user
+    return result.scalar_one_or_none()
+
+async def get_users(db:AsyncSession,skip:int = 0,limit:int = 100) -> List[dict]:
+    """
+    Users with their tasks as plain dicts, ready to be encoded: two queries whatever the page size,
+    and no ORM objects built in between.
+    """
+    params = {"skip":skip,"limit":limit}
+    users = [dict(row) for row in (await db.execute(USERS_PAGE,params)).mappings()]
+    tasks_by_user = {user["id"]:user.setdefault("tasks",[]) for user in users}
+    for task in (await db.execute(TASKS_OF_USERS_PAGE,params)).mappings():
+        tasks_by_user[task["user_id"]].append(dict(task))
+    return users
+
+async def create_task(db:AsyncSession,user_id:str,task:schemas.TaskCreate) -> models.Task:
+    db_task = models.Task(id=new_id(),user_id=user_id,**task.dict())
+    db.add(db_task)
+    await db.commit()
+    return db_task
+
+async def get_tasks(db:AsyncSession,user_id:str) -> List[models.Task]:
+    result = await db.execute(TASKS_OF_USER,{"user_id":user_id})
+    return result.scalars().all()
+
+
+async def bulk_create_tasks(db:AsyncSession,user_id:str,tasks:List[schemas.TaskCreate]) -> List[dict]:
+    rows = [{"id":new_id(),"user_id":user_id,"text":task.text} for task in tasks]
+    if rows:
+        await db.execute(insert(tasks_table),rows)
+        await db.commit()
+    return rows
+
+async def bulk_update_tasks(db:AsyncSession,tasks:List[schemas.TaskUpdate]) -> int:
+    if not tasks:
+        return 0
+    stmt = update(tasks_table).where(tasks_table.c.id == bindparam("task_id")).values(text=bindparam("new_text"))
+    result = await db.execute(stmt,[{"task_id":task.id,"new_text":task.text} for task in tasks])
+    await db.commit()
+    return result.rowcount
+
+async def bulk_delete_tasks(db:AsyncSession,task_ids:List[str]) -> int:
+    if not task_ids:
+        return 0
+    result = await db.execute(delete(tasks_table).where(tasks_table.c.id.in_(task_ids)))
+    await db.commit()
+    return result.rowcount
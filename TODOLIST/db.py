@@ -1,33 +1,59 @@
-from sqlalchemy import create_engine #1
-from sqlalchemy.ext.declarative import declarative_base #2
-from sqlalchemy.orm import session,sessionmaker #3
+from contextvars import ContextVar
+from sqlalchemy import event
+from sqlalchemy.engine.default import CACHE_HIT
+from sqlalchemy.ext.asyncio import AsyncSession,create_async_engine #1
+from sqlalchemy.orm import declarative_base,sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 import os
 
 BASEDIR = os.path.abspath(os.path.dirname(__file__))
 
-#Constant variable that references to the database. 
-SQLALCHEMY_DATABASE_URI=f"sqlite://{BASEDIR}/todo_app.db"  
+#Constant variable that references to the database. sqlite:/// + an absolute path (that's four slashes in total)
+SQLALCHEMY_DATABASE_URI=os.getenv("TODO_DATABASE_URI",f"sqlite+aiosqlite:///{BASEDIR}/todo_app.db")
 
-engine = create_engine(
+engine = create_async_engine(
     SQLALCHEMY_DATABASE_URI,
-    connect_args={"check_same_thread":False} #4
+    poolclass=AsyncAdaptedQueuePool, #2
+    pool_size=5,
+    max_overflow=10,
+    pool_timeout=30,
 )
 
-SessionLocal= sessionmaker( #5
-        autocommit=False,
+@event.listens_for(engine.sync_engine,"connect") #3
+def set_sqlite_pragmas(dbapi_connection,connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+SessionLocal= sessionmaker( #4
+        engine,
+        class_=AsyncSession,
         autoflush=False,
-        bind=engine #6
+        expire_on_commit=False
     )
 
 Base = declarative_base()
 
-#7
-class DBContext:
-    def __init__(self):
-        self.db = SessionLocal()
 
-    def __enter__(self): #Equivalent to opening the file and getting all of the file contents and storing it under a variable
-        return self.db
+#Counts the SQL statements sent to the database while handling a request, and how many of them were
+#compiled before and taken from SQLAlchemy's compiled cache (see the middleware in main.py)
+statement_counter: ContextVar = ContextVar("statement_counter",default=None)
 
-    def __exit__(self,execution_type,execution_value,traceback): #8 even though we don't use them, we need to pass in extra parameters
-        self.db.close()
\ No newline at end of file
+@event.listens_for(engine.sync_engine,"before_cursor_execute")
+def count_statement(conn,cursor,statement,parameters,context,executemany):
+    counter = statement_counter.get()
+    if counter is not None:
+        counter[0] += 1
+        if getattr(context,"cache_hit",None) is CACHE_HIT:
+            counter[1] += 1
+
+
+async def get_db(): #5
+    async with SessionLocal() as db:
+        yield db
+
+async def init_db():
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
@@ -1,14 +1,92 @@
-from fastapi import FastAPI,Request
-from fastapi.templating import Jinja2Templates
+from fastapi import FastAPI,Request,Depends,HTTPException,Body,Query,status
+from fastapi.responses import JSONResponse
 from fastapi.staticfiles import StaticFiles
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List
+import os
+import sys
 
+BASEDIR = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(os.path.dirname(BASEDIR)) #repository root, for the shared package
+from shared.metrics import install as install_metrics
+from shared.rendering import CachedTemplates
+from db import get_db,init_db,statement_counter
+import crud
+import schemas
 
 
 app = FastAPI()
-templates = Jinja2Templates(directory="templates")
-app.mount('/static',StaticFiles(directory='static'),name='static')
+templates = CachedTemplates(directory=BASEDIR+"/templates")
+app.mount('/static',StaticFiles(directory=BASEDIR+'/static'),name='static')
+
+
+@app.middleware("http")
+async def count_sql_statements(request:Request,call_next):
+    counter = [0,0]
+    statement_counter.set(counter)
+    response = await call_next(request)
+    response.headers["X-SQL-Statements"] = str(counter[0]) #Lets tests (and you) spot N+1 queries
+    response.headers["X-SQL-Cached"] = str(counter[1]) #...and statements compiled anew on every call
+    return response
+
+install_metrics(app) #after the middleware above, so it is outermost. Served at /metrics
+
+
+@app.on_event("startup")
+async def startup():
+    await init_db()
 
 
 @app.get('/')
 def root(request:Request):
-    return templates.TemplateResponse("index.html",{"request":request,"title":"Home"})
\ No newline at end of file
+    return templates.StaticResponse("index.html",{"request":request,"title":"Home"})
+
+
+@app.post('/users',response_model=schemas.UserRead,status_code=status.HTTP_201_CREATED)
+async def create_user(user:schemas.UserCreate,db:AsyncSession = Depends(get_db)):
+    try:
+        return await crud.create_user(db,user)
+    except IntegrityError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,detail="Username or email already taken")
+
+@app.get('/users',response_model=List[schemas.UserRead])
+async def read_users(skip:int = Query(0,ge=0),limit:int = Query(100,ge=1,le=1000),db:AsyncSession = Depends(get_db)):
+    #The rows are already plain dicts shaped like schemas.UserRead (no password hash), so they are encoded as they are
+    return JSONResponse(await crud.get_users(db,skip,limit))
+
+@app.get('/users/{user_id}',response_model=schemas.UserRead)
+async def read_user(user_id:str,db:AsyncSession = Depends(get_db)):
+    user = await crud.get_user(db,user_id)
+    if user is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,detail="User not found")
+    return user
+
+
+@app.post('/users/{user_id}/tasks',response_model=schemas.Task,status_code=status.HTTP_201_CREATED)
+async def create_task(user_id:str,task:schemas.TaskCreate,db:AsyncSession = Depends(get_db)):
+    try:
+        return await crud.create_task(db,user_id,task)
+    except IntegrityError:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,detail="User not found")
+
+@app.get('/users/{user_id}/tasks',response_model=List[schemas.Task])
+async def read_tasks(user_id:str,db:AsyncSession = Depends(get_db)):
+    return await crud.get_tasks(db,user_id)
+
+
+#Bulk operations: one executemany (or one IN statement) for the whole list
+@app.post('/users/{user_id}/tasks/bulk',response_model=List[schemas.Task],status_code=status.HTTP_201_CREATED)
+async def create_tasks(user_id:str,tasks:List[schemas.TaskCreate],db:AsyncSession = Depends(get_db)):
+    try:
+        return await crud.bulk_create_tasks(db,user_id,tasks)
+    except IntegrityError:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,detail="User not found")
+
+@app.put('/tasks/bulk')
+async def update_tasks(tasks:List[schemas.TaskUpdate],db:AsyncSession = Depends(get_db)):
+    return {"updated":await crud.bulk_update_tasks(db,tasks)}
+
+@app.delete('/tasks/bulk')
+async def delete_tasks(task_ids:List[str] = Body(...),db:AsyncSession = Depends(get_db)):
+    return {"deleted":await crud.bulk_delete_tasks(db,task_ids)}
@@ -0,0 +1,24 @@
+from sqlalchemy import Column,ForeignKey,String
+from sqlalchemy.orm import relationship
+from db import Base
+
+
+class User(Base):
+    __tablename__ = "users"
+
+    id = Column(String,primary_key=True,index=True)
+    username = Column(String,unique=True,index=True,nullable=False)
+    email = Column(String,unique=True,index=True,nullable=False)
+    hashed_password = Column(String,nullable=False)
+
+    tasks = relationship("Task",back_populates="owner",cascade="all, delete-orphan")
+
+
+class Task(Base):
+    __tablename__ = "tasks"
+
+    id = Column(String,primary_key=True,index=True)
+    text = Column(String,nullable=False)
+    user_id = Column(String,ForeignKey("users.id",ondelete="CASCADE"),index=True,nullable=False)
+
+    owner = relationship("User",back_populates="tasks")
@@ -14,6 +14,9 @@ class Task(TaskBase):
 class TaskCreate(TaskBase):
     pass
 
+class TaskUpdate(TaskBase):
+    id: str
+
 class UserBase(BaseModel):
     #2
     username: str
@@ -28,4 +31,13 @@ class User(UserBase): #read
         orm_mode = True
 
 class UserCreate(UserBase):
-    pass
\ No newline at end of file
+    pass
+
+class UserRead(BaseModel): #what the user endpoints send back: never the password hash
+    id : str
+    username: str
+    email : str
+    tasks : List[Task] = []
+
+    class Config:
+        orm_mode = True
@@ -0,0 +1,88 @@
+import os
+import tempfile
+import unittest
+
+DB_DIR = tempfile.mkdtemp()
+os.environ["TODO_DATABASE_URI"] = f"sqlite+aiosqlite:///{DB_DIR}/test.db" #Keep the real todo_app.db untouched
+
+from fastapi.testclient import TestClient
+from main import app
+from db import SessionLocal
+import crud
+
+
+class TestTodo(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.client = TestClient(app)
+        cls.client.__enter__() #runs the startup event, which creates the tables
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.client.__exit__(None, None, None)
+
+    def create_user(self, username):
+        response = self.client.post('/users', json={"username": username, "email": f"{username}@email.com", "hashed_password": "x"})
+        self.assertEqual(201, response.status_code)
+        return response.json()
+
+    def test_index(self):
+        self.assertEqual(200, self.client.get('/').status_code)
+
+    def test_user_and_tasks(self):
+        user = self.create_user("migo")
+        self.assertEqual([], user["tasks"])
+        self.assertEqual(400, self.client.post('/users', json={"username": "migo", "email": "other@email.com", "hashed_password": "x"}).status_code)
+
+        task = self.client.post(f'/users/{user["id"]}/tasks', json={"text": "buy milk"}).json()
+        response = self.client.get(f'/users/{user["id"]}')
+        self.assertEqual([task], response.json()["tasks"])
+        self.assertNotIn("hashed_password", user)
+        self.assertNotIn("hashed_password", response.json())
+        self.assertNotIn("hashed_password", self.client.get('/users').json()[0])
+
+    def test_user_listing_query_count(self):
+        async def seed(): #1000 users with 3 tasks each, straight into the tables
+            async with SessionLocal() as db:
+                await db.execute(crud.users_table.insert(), [
+                    {"id": f"seed{i:04}", "username": f"seed{i:04}", "email": f"seed{i:04}@email.com", "hashed_password": "x"}
+                    for i in range(1000)])
+                await db.execute(crud.tasks_table.insert(), [
+                    {"id": f"seed{i:04}-{j}", "user_id": f"seed{i:04}", "text": f"task {j}"} for i in range(1000) for j in range(3)])
+                await db.commit()
+        self.client.portal.call(seed)
+
+        response = self.client.get('/users', params={"limit": 1000})
+        self.assertEqual(200, response.status_code)
+        users = response.json()
+        self.assertEqual(1000, len(users))
+        self.assertTrue(all(len(user["tasks"]) == 3 for user in users if user["id"].startswith("seed")))
+        self.assertEqual("2", response.headers["X-SQL-Statements"]) #not 1 + 1000
+        response = self.client.get('/users', params={"limit": 10})
+        self.assertEqual("2", response.headers["X-SQL-Cached"]) #compiled once, whatever the parameters
+
+        response = self.client.get('/users/seed0001')
+        self.assertEqual(3, len(response.json()["tasks"]))
+        self.assertEqual("2", response.headers["X-SQL-Statements"])
+        response = self.client.get('/users/seed0002')
+        self.assertEqual("2", response.headers["X-SQL-Cached"])
+
+    def test_bulk(self):
+        user = self.create_user("bulky")
+        response = self.client.post(f'/users/{user["id"]}/tasks/bulk', json=[{"text": f"task {i}"} for i in range(100)])
+        self.assertEqual(201, response.status_code)
+        tasks = response.json()
+        self.assertEqual(100, len(tasks))
+
+        response = self.client.put('/tasks/bulk', json=[{"id": task["id"], "text": "done"} for task in tasks[:10]])
+        self.assertEqual({"updated": 10}, response.json())
+
+        response = self.client.delete('/tasks/bulk', json=[task["id"] for task in tasks[10:]])
+        self.assertEqual({"deleted": 90}, response.json())
+        self.assertEqual(["done"] * 10, [task["text"] for task in self.client.get(f'/users/{user["id"]}/tasks').json()])
+
+        self.assertEqual(404, self.client.post('/users/nobody/tasks/bulk', json=[{"text": "x"}]).status_code)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,7 +1,17 @@
 from fastapi import FastAPI,Header,HTTPException
 from pydantic import BaseModel
 from typing import Optional
-app = FastAPI()
+import os
+import sys
+
+BASEDIR = os.path.abspath(os.path.dirname(__file__))
+sys.path.append(os.path.dirname(BASEDIR)) #repository root, for the shared package
+from shared.metrics import install as install_metrics
+from shared.responses import EncodedCache,FastJSONResponse
+from shared.storage import MemoryRepository
+
+app = FastAPI(default_response_class=FastJSONResponse) #orjson instead of json.dumps
+install_metrics(app) #per-route latency and in-flight requests, served at /metrics
 
 @app.get('/')
 async def read_main():
@@ -11,10 +21,11 @@ async def read_main():
 
 fake_secret_token = "coneofsilence"
 
-fake_db = {
+fake_db = MemoryRepository({
     "foo": {"id": "foo", "title": "Foo", "description": "There goes my hero"},
     "bar": {"id": "bar", "title": "Bar", "description": "The bartenders"},
-}
+})
+items_json = EncodedCache(fake_db) #each item's JSON, encoded once and dropped when the item is replaced
 
 class Item(BaseModel):
     id: str
@@ -27,7 +38,7 @@ async def read_main(item_id: str, x_token: str = Header(...)):
         raise HTTPException(status_code=400, detail="Invalid X-Token header")
     if item_id not in fake_db:
         raise HTTPException(status_code=404, detail="Item not found")
-    return fake_db[item_id]
+    return FastJSONResponse(items_json[item_id]) #stored items are valid Items: response_model is only for the docs
 
 
 @app.post("/items/", response_model=Item)
@@ -37,5 +48,5 @@ async def create_item(item: Item, x_token: str = Header(...)):
     if item.id in fake_db:
         raise HTTPException(status_code=400, detail="Item already exists")
     fake_db[item.id] = item
-    return item
+    return FastJSONResponse(item) #already validated, no jsonable_encoder pass
 
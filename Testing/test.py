@@ -31,5 +31,17 @@ class TestFastAPI(unittest.TestCase):
             "title": "Foo Bar",
             "description": "The Foo Barters"},response.json())
 
+    def test_item_get_after_post(self):
+        self.app.post("/items/",headers={"X-Token": "coneofsilence"},json={"id": "baz", "title": "Baz"})
+        response = self.app.get('/items/baz',headers={"X-Token":"coneofsilence"})
+        self.assertEqual(200,response.status_code)
+        self.assertEqual({"id":"baz","title":"Baz","description":None},response.json())
+
+    def test_metrics(self):
+        self.app.get('/items/foo',headers={"X-Token":"coneofsilence"})
+        response = self.app.get('/metrics')
+        self.assertEqual(200,response.status_code)
+        self.assertIn('http_request_duration_seconds_count{method="GET",route="/items/{item_id}"}',response.text)
+
 if __name__ =="__main__":
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,7 @@
+"""
+Benchmarks for the example apps.
+
+Run them from the repository root, e.g.:
+
+    python -m benchmarks.car_pagination
+"""
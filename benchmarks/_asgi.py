@@ -0,0 +1,75 @@
+"""
+Minimal in-process ASGI client used by the benchmarks.
+
+Unlike TestClient it records when the first body chunk leaves the app, which is what we
+need to compare buffered and streamed responses.
+"""
+
+import asyncio
+import importlib
+import os
+import sys
+import time
+from typing import Iterable, List, Optional, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_app(project: str, module: str = "main"):
+    """Imports `module` from one of the example projects, the same way uvicorn would when run from its folder."""
+    project_dir = os.path.join(ROOT, project)
+    sys.path.insert(0, project_dir)
+    os.chdir(project_dir)
+    return importlib.import_module(module)
+
+
+class Result:
+    def __init__(self, status: int, headers: List[Tuple[bytes, bytes]], body: bytes, ttfb: float, total: float):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.ttfb = ttfb  # seconds until the first non-empty body chunk
+        self.total = total  # seconds until the response is complete
+
+
+async def request(app, method: str, path: str, query: str = "",
+                  headers: Iterable[Tuple[str, str]] = (), body: bytes = b"") -> Result:
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": method, "scheme": "http", "path": path, "raw_path": path.encode(),
+        "root_path": "", "query_string": query.encode(),
+        "headers": [(b"host", b"bench")] + [(k.lower().encode(), v.encode()) for k, v in headers],
+        "client": ("127.0.0.1", 0), "server": ("bench", 80),
+    }
+    sent = False
+    status = 0
+    response_headers: List[Tuple[bytes, bytes]] = []
+    chunks: List[bytes] = []
+    first: Optional[float] = None
+
+    async def receive():
+        nonlocal sent
+        if sent:
+            await asyncio.sleep(3600)  # nothing else to send: behave like an idle client
+        sent = True
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        nonlocal status, response_headers, first
+        if message["type"] == "http.response.start":
+            status = message["status"]
+            response_headers = message.get("headers", [])
+        elif message["type"] == "http.response.body" and message.get("body"):
+            if first is None:
+                first = time.perf_counter()
+            chunks.append(message["body"])
+
+    start = time.perf_counter()
+    await app(scope, receive, send)
+    end = time.perf_counter()
+    return Result(status, response_headers, b"".join(chunks), (first or end) - start, end - start)
+
+
+def median(values: List[float]) -> float:
+    values = sorted(values)
+    return values[len(values) // 2]
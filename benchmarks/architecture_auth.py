@@ -0,0 +1,59 @@
+"""
+Admin token check: router dependency vs TokenAuthMiddleware.
+
+    python -m benchmarks.architecture_auth [--requests 5000]
+
+Two bare FastAPI apps with only the admin router: "dependency" includes it the old way,
+`dependencies=[Depends(get_token_header)]`, "middleware" checks X-Token with TokenAuthMiddleware
+before routing. Each is timed with the right token, a wrong one and none. The last table is what
+the middleware itself recorded.
+"""
+
+import argparse
+import asyncio
+import json
+
+from fastapi import Depends, FastAPI
+
+from benchmarks._asgi import load_app, median, request
+
+TOKEN = "fake-user-secret-token"
+CASES = [("valid", [("x-token", TOKEN)], 200), ("wrong", [("x-token", "nope")], 400), ("missing", [], 422)]
+
+
+async def timings(app, headers, status: int, count: int):
+    times = []
+    for _ in range(count):
+        result = await request(app, "POST", "/admin/", headers=headers)
+        assert result.status == status, result.status
+        times.append(result.total)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=5000)
+    args = parser.parse_args()
+
+    dependencies = load_app("Architecture", "dependedncies")
+    admin = load_app("Architecture", "internal.admin")
+    token_auth = load_app("Architecture", "token_auth")
+    old = FastAPI()
+    old.include_router(admin.router, prefix="/admin", dependencies=[Depends(dependencies.get_token_header)])
+    new = FastAPI()
+    new.include_router(admin.router, prefix="/admin")
+    new.add_middleware(token_auth.TokenAuthMiddleware, auth=dependencies.admin_tokens)
+
+    async def run():
+        print(f"{'':>8} {'dependency us':>14} {'middleware us':>14}")
+        for label, headers, status in CASES:
+            before = median(await timings(old, headers, status, args.requests))
+            after = median(await timings(new, headers, status, args.requests))
+            print(f"{label:>8} {before * 1e6:>14.1f} {after * 1e6:>14.1f}")
+        print(json.dumps(dependencies.admin_tokens.stats(), indent=2))
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
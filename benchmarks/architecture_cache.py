@@ -0,0 +1,53 @@
+"""
+Architecture's response cache: cached GETs vs running the endpoint.
+
+    python -m benchmarks.architecture_cache [--requests 5000]
+
+Times GET /items/plumbus and GET /users in process:
+- "endpoint": max_entries=0, so every request is a miss and runs routing, the endpoint and
+  JSON serialization (plus the cache's own route match)
+- "cached": served from the stored bytes
+/users/me isn't cached; it shows what the middleware adds to other routes.
+"""
+
+import argparse
+import asyncio
+
+from benchmarks._asgi import load_app, median, request
+
+
+async def timings(app, path: str, count: int):
+    times = []
+    for _ in range(count):
+        result = await request(app, "GET", path)
+        assert result.status == 200, result.status
+        times.append(result.total)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=5000)
+    args = parser.parse_args()
+
+    architecture = load_app("Architecture")
+    cache = load_app("Architecture", "cache").response_cache
+    app = architecture.app
+
+    async def run():
+        print(f"{'':>16} {'endpoint us':>12} {'cached us':>10} {'speedup':>8}")
+        for path in ("/items/plumbus", "/users"):
+            cache.clear()
+            cache.max_entries = 0
+            slow = median(await timings(app, path, args.requests))
+            cache.max_entries = 1024
+            fast = median(await timings(app, path, args.requests))
+            print(f"{path:>16} {slow * 1e6:>12.1f} {fast * 1e6:>10.1f} {slow / fast:>7.1f}x")
+        print(f"{'/users/me':>16} {median(await timings(app, '/users/me', args.requests)) * 1e6:>12.1f} {'(not cached)':>10}")
+        print(f"hits {cache.hits}, misses {cache.misses}")
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
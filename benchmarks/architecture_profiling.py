@@ -0,0 +1,60 @@
+"""
+What profiling a running Architecture worker costs per request.
+
+    python -m benchmarks.architecture_profiling [--requests 5000]
+
+Times GET /users/{username} in process, request by request, with:
+- nothing switched on (ProfilingMiddleware only checks a deadline)
+- the stack sampler at 200 and 1000 samples a second
+- allocation tracing (tracemalloc), without and with a snapshot diff on every request
+"""
+
+import argparse
+import asyncio
+
+from benchmarks._asgi import load_app, median, request
+
+
+async def timings(app, count: int):
+    times = []
+    for i in range(count):
+        result = await request(app, "GET", f"/users/u{i}")
+        assert result.status == 200, result.status
+        times.append(result.total)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=5000)
+    args = parser.parse_args()
+
+    app = load_app("Architecture").app
+    profiling = load_app("Architecture", "internal.profiling")
+    sampler, allocations = profiling.sampler, profiling.allocations
+
+    async def run():
+        await timings(app, 200)  # warm up
+        base = median(await timings(app, args.requests))
+        print(f"{'':>28} {'median us':>10} {'added':>7}")
+
+        def report(label: str, value: float):
+            print(f"{label:>28} {value * 1e6:>10.1f} {(value - base) / base:>7.0%}")
+
+        report("off", base)
+        for rate in (200, 1000):
+            sampler.start(600, 1 / rate)
+            report(f"sampler, {rate}/s", median(await timings(app, args.requests)))
+            sampler.stop()
+        allocations.start(600, snapshots=0)
+        report("tracemalloc", median(await timings(app, args.requests)))
+        allocations.stop()
+        allocations.start(600, snapshots=args.requests)
+        report("tracemalloc + snapshots", median(await timings(app, min(args.requests, 500))))
+        allocations.stop()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
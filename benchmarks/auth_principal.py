@@ -0,0 +1,58 @@
+"""
+Authenticated request throughput with and without the principal cache.
+
+    python -m benchmarks.auth_principal [--requests 5000]
+
+Logs into AUTH_ once, then hits `/protected` with the cookie. The uncached run decodes the
+JWT and rebuilds the user on every request, like a plain LoginManager.
+"""
+
+import argparse
+import asyncio
+import time
+import warnings
+
+from benchmarks._asgi import load_app, request
+
+
+async def throughput(app, cookie: str, count: int) -> float:
+    start = time.perf_counter()
+    for _ in range(count):
+        result = await request(app, "GET", "/protected", headers=[("cookie", cookie)])
+        assert result.status == 200, result.status
+    return count / (time.perf_counter() - start)
+
+
+async def dependency_rate(manager, token: str, count: int) -> float:
+    start = time.perf_counter()
+    for _ in range(count):
+        await manager.get_current_user(token)
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=5000)
+    args = parser.parse_args()
+    warnings.filterwarnings("ignore", module="jwt")  # the example app uses a short demo secret
+
+    auth_app = load_app("AUTH_")
+    manager = auth_app.manager
+    token = manager.create_access_token(data={"sub": "migo"})
+    cookie = f"{manager.cookie_name}={token}"
+
+    async def run():
+        print(f"{'':>10} {'req/s':>10} {'auth/s':>12}")
+        for label, max_principals in (("uncached", 0), ("cached", 10_000)):
+            manager.max_principals = max_principals
+            manager.forget("migo")
+            await throughput(auth_app.app, cookie, 100)  # warm up
+            rps = await throughput(auth_app.app, cookie, args.requests)
+            auth = await dependency_rate(manager, token, args.requests * 4)
+            print(f"{label:>10} {rps:>10.0f} {auth:>12.0f}")
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
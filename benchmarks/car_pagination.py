@@ -0,0 +1,51 @@
+"""
+Buffered vs streamed rendering of /cars.
+
+    python -m benchmarks.car_pagination [--repeat 30]
+
+Fills the catalog with synthetic cars, then requests pages of 10, 100 and 1000 rows in both
+modes and reports the median time-to-first-byte and total time.
+"""
+
+import argparse
+import asyncio
+
+from benchmarks._asgi import load_app, median, request
+
+PAGE_SIZES = (10, 100, 1000)
+
+
+def seed(cars, count: int) -> None:
+    missing = count - len(cars)
+    cars.add_many({
+        "make": f"Make{i % 50}", "model": f"Model {i}", "year": 1970 + i % 52,
+        "price": 10000.0 + i, "engine": ("V4", "V6", "V8")[i % 3],
+        "autonomous": i % 2 == 0, "sold": ["EU", "NA"],
+    } for i in range(max(0, missing)))
+
+
+async def run(app, repeat: int):
+    print(f"{'rows':>6} {'mode':>9} {'ttfb ms':>9} {'total ms':>9}")
+    for rows in PAGE_SIZES:
+        for mode, query in (("buffered", f"number={rows}"), ("streamed", f"number={rows}&stream=true")):
+            ttfb, total = [], []
+            for _ in range(repeat):
+                result = await request(app, "GET", "/cars", query)
+                assert result.status == 200, result.status
+                ttfb.append(result.ttfb)
+                total.append(result.total)
+            print(f"{rows:>6} {mode:>9} {median(ttfb) * 1000:>9.2f} {median(total) * 1000:>9.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=30)
+    args = parser.parse_args()
+
+    car_app = load_app("Car_Information_Viewer")
+    seed(car_app.cars, max(PAGE_SIZES))
+    asyncio.run(run(car_app.app, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Type-ahead and search latency at 100k cars.
+
+    python -m benchmarks.car_search [--cars 100000] [--queries 2000]
+
+Fills Car_Information_Viewer's store with synthetic cars (300 camelCase makes, 5000 models),
+then times:
+- suggest / search: the SearchIndex calls alone, for prefixes of 1 to 4 letters of real tokens.
+  "first" is the first lookup of a prefix after a write touched it (the trie cache is rebuilt),
+  "repeat" the same lookups again.
+- GET /search/suggest: the endpoint end to end, in process.
+- edit: one car renamed, index maintenance included.
+"""
+
+import argparse
+import asyncio
+import random
+import time
+
+from benchmarks._asgi import load_app, median, request
+
+SYLLABLES = [consonant + vowel for consonant in "bcdfgklmnprstvz" for vowel in "aeiou"]
+
+
+def word(rng: random.Random) -> str:
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randrange(2, 4))).capitalize()
+
+
+def name(rng: random.Random, parts: int) -> str:
+    return "".join(word(rng) for _ in range(parts))  # camelCase: "BekaTori"
+
+
+def synthetic_cars(count: int, seed: int = 1):
+    rng = random.Random(seed)
+    makes = [name(rng, rng.randrange(1, 3)) for _ in range(300)]
+    models = [f"{name(rng, rng.randrange(1, 3))} {word(rng)}" for _ in range(5000)]
+    return [{"make": rng.choice(makes), "model": rng.choice(models),
+             "year": rng.randrange(1970, 2022), "price": round(rng.uniform(5_000, 250_000), 2),
+             "engine": "V8", "autonomous": False, "sold": ["EU"]} for _ in range(count)]
+
+
+def percentile(values, fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def timed(fn, arguments):
+    times = []
+    for argument in arguments:
+        start = time.perf_counter()
+        fn(argument)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def report(label: str, times) -> None:
+    print(f"{label:>26} {median(times) * 1e6:>10.1f} {percentile(times, 0.99) * 1e6:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--cars", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=2000)
+    args = parser.parse_args()
+
+    car_app = load_app("Car_Information_Viewer")
+    start = time.perf_counter()
+    car_app.cars.add_many(synthetic_cars(args.cars))
+    index = car_app.search_index
+    print(f"{len(index)} cars indexed in {time.perf_counter() - start:.1f}s (store, columns and search index)")
+
+    rng = random.Random(2)
+    tokens = sorted(index._postings)
+    prefixes = [token[:rng.randrange(1, 5)] for token in rng.choices(tokens, k=args.queries)]
+
+    print(f"{'':>26} {'median us':>10} {'p99 us':>10}")
+    ids = car_app.cars.ids()
+    for id in rng.sample(ids, 200):  # writes drop the cached completions along their tokens' paths
+        car = car_app.cars[id]
+        car_app.cars[id] = {**car, "model": car["model"] + " Edition"}
+    report("suggest, first", timed(index.suggest, prefixes))
+    report("suggest, repeat", timed(index.suggest, prefixes))
+    report("search", timed(index.search, prefixes))
+    report("search, two words", timed(index.search, [f"{a} {b}" for a, b in zip(prefixes, reversed(prefixes))]))
+
+    async def endpoint():
+        times = []
+        for prefix in prefixes:
+            result = await request(car_app.app, "GET", "/search/suggest", query=f"q={prefix}")
+            assert result.status == 200, result.status
+            times.append(result.total)
+        return times
+
+    report("GET /search/suggest", asyncio.run(endpoint()))
+
+    def rename(id):
+        car = car_app.cars[id]
+        car_app.cars[id] = {**car, "model": name(rng, 2)}
+
+    report("edit (all indexes)", timed(rename, rng.sample(ids, min(len(ids), 1000))))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Catalog aggregates: columnar NumPy mirror vs a loop over the dict of dicts.
+
+    python -m benchmarks.car_stats [--cars 1000000] [--repeat 5]
+
+Times three group-bys at --cars synthetic cars: average price by make, count by engine among
+the cars sold in EU, and a 10-bin price histogram per year. The columns are built with
+CarColumns.from_rows; a CarStore of a million cars takes a while to fill (its sorted indexes).
+"""
+
+import argparse
+import random
+import time
+
+from benchmarks._asgi import load_app, median
+
+MAKES = [f"Make{n}" for n in range(40)]
+ENGINES = ["V4", "V6", "V8", "V12", "Electric"]
+REGIONS = ["AF", "AN", "AS", "EU", "NA", "OC", "SA"]
+
+
+def synthetic_cars(count: int, seed: int = 1) -> dict:
+    rng = random.Random(seed)
+    return {id: {
+        "make": rng.choice(MAKES), "model": "M", "year": rng.randrange(1970, 2022),
+        "price": round(rng.uniform(5_000, 250_000), 2), "engine": rng.choice(ENGINES),
+        "autonomous": rng.random() < 0.1, "sold": rng.sample(REGIONS, rng.randrange(0, 4)),
+    } for id in range(1, count + 1)}
+
+
+def loop_avg_price_by_make(rows):
+    sums, counts = {}, {}
+    for car in rows.values():
+        if car.get("price") is not None:
+            sums[car["make"]] = sums.get(car["make"], 0.0) + car["price"]
+            counts[car["make"]] = counts.get(car["make"], 0) + 1
+    return {make: sums[make] / counts[make] for make in sums}
+
+
+def loop_count_by_engine_eu(rows):
+    counts = {}
+    for car in rows.values():
+        if "EU" in (car.get("sold") or ()):
+            counts[car["engine"]] = counts.get(car["engine"], 0) + 1
+    return counts
+
+
+def loop_histogram_by_year(rows, bins=10):
+    prices = [car["price"] for car in rows.values() if car.get("price") is not None]
+    low, high = min(prices), max(prices)
+    width = (high - low) / bins
+    histogram = {}
+    for car in rows.values():
+        if car.get("price") is None:
+            continue
+        bin = min(int((car["price"] - low) / width), bins - 1)
+        histogram.setdefault(car["year"], [0] * bins)[bin] += 1
+    return histogram
+
+
+def timed(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--cars", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    columns_module = load_app("Car_Information_Viewer", "columns")
+    rows = synthetic_cars(args.cars)
+    start = time.perf_counter()
+    columns = columns_module.CarColumns.from_rows(rows)
+    print(f"{args.cars} cars, columns built in {time.perf_counter() - start:.2f}s")
+
+    cases = [
+        ("avg price by make", lambda: loop_avg_price_by_make(rows), lambda: columns.group_stats("make")),
+        ("count by engine, EU", lambda: loop_count_by_engine_eu(rows), lambda: columns.group_stats("engine", sold=["EU"])),
+        ("price histogram by year", lambda: loop_histogram_by_year(rows), lambda: columns.price_histogram("year", 10)),
+    ]
+    print(f"{'':>24} {'dict loop ms':>13} {'columnar ms':>12} {'speedup':>8}")
+    for label, loop, vectorized in cases:
+        slow, fast = timed(loop, args.repeat), timed(vectorized, args.repeat)
+        print(f"{label:>24} {slow * 1000:>13.1f} {fast * 1000:>12.1f} {slow / fast:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,420 @@
+"""
+Load test of the example apps' hot endpoints, compared with a stored baseline.
+
+    python -m benchmarks.harness [--mode asgi|uvicorn] [--records 10000] [--concurrency 1,8,32]
+                                 [--duration 5] [--only car,social.home] [--out results.json]
+                                 [--baseline benchmarks/baseline.json] [--threshold 0.2]
+
+Each app runs in a process of its own (their modules share names: main, db), filled with
+--records synthetic records (benchmarks/synthetic.py, no network needed). Each scenario then
+runs at every concurrency level for --duration seconds: that many clients, each sending its
+next request as soon as the last one is answered.
+- asgi: the clients call the app in process, like the other benchmarks. Measures the app alone.
+- uvicorn: the app is served by uvicorn on 127.0.0.1 (one worker), and the clients are
+  keep-alive HTTP/1.1 connections from this process. Adds the server and the sockets.
+
+Requests/s, p50/p99 latency and errors (unexpected statuses) are written to --out as JSON. Every
+result is then compared with the stored one in --baseline: requests/s down or p99 up by more than
+--threshold is a regression, and the exit status is 1. Compare runs from the same machine, mode
+and --records only. By default the baseline is benchmarks/baseline.json, committed with the
+code, and it is skipped when it was taken in another mode or with other --records. Regenerate it
+with `--out benchmarks/baseline.json` when a change is meant to move the numbers; `--baseline ""`
+skips the comparison.
+"""
+
+import argparse
+import asyncio
+import importlib
+import itertools
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import urlencode
+
+from benchmarks import synthetic
+from benchmarks._asgi import ROOT, load_app, request
+
+Headers = List[Tuple[bytes, bytes]]
+FORM = ("content-type", "application/x-www-form-urlencoded")
+LOGINS = 50  # users logged in before a scenario that needs a cookie
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+
+# clients
+class AsgiClient:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, method: str, path: str, query: str = "", headers=(), body: bytes = b"") -> Tuple[int, Headers]:
+        result = await request(self.app, method, path, query, headers, body)
+        return result.status, result.headers
+
+    def close(self) -> None:
+        pass
+
+
+class HttpClient:
+    """One keep-alive HTTP/1.1 connection. Enough of the protocol for these apps' responses."""
+
+    def __init__(self, host: str, port: int):
+        self.host, self.port = host, port
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+
+    async def __call__(self, method: str, path: str, query: str = "", headers=(), body: bytes = b"") -> Tuple[int, Headers]:
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        try:
+            return await self._exchange(method, path, query, headers, body)
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            self.close()  # reconnect on the next request
+            raise
+
+    async def _exchange(self, method, path, query, headers, body) -> Tuple[int, Headers]:
+        head = [f"{method} {path}?{query} HTTP/1.1" if query else f"{method} {path} HTTP/1.1",
+                f"host: {self.host}:{self.port}", f"content-length: {len(body)}"]
+        head += [f"{name}: {value}" for name, value in headers]
+        self.writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+        reader = self.reader
+        status = int((await reader.readuntil(b"\r\n")).split()[1])
+        response_headers: Headers = []
+        length, chunked, close = 0, False, False
+        while True:
+            line = await reader.readuntil(b"\r\n")
+            if line == b"\r\n":
+                break
+            name, _, value = line.partition(b":")
+            name, value = name.strip().lower(), value.strip()
+            response_headers.append((name, value))
+            if name == b"content-length":
+                length = int(value)
+            elif name == b"transfer-encoding":
+                chunked = b"chunked" in value.lower()
+            elif name == b"connection":
+                close = value.lower() == b"close"
+        if chunked:
+            while True:
+                size = int((await reader.readuntil(b"\r\n")).split(b";")[0], 16)
+                await reader.readexactly(size + 2)
+                if size == 0:
+                    break
+        elif length:
+            await reader.readexactly(length)
+        if close:
+            self.close()
+        return status, response_headers
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+# scenarios
+def form(**fields) -> bytes:
+    return urlencode(fields).encode()
+
+
+class Scenario:
+    """
+    `build(rng, n, records, cookies)` returns the path, query string and form body of the n-th
+    request. With `login`, LOGINS synthetic users log in there first and `cookies` holds their
+    cookies.
+    """
+
+    def __init__(self, name: str, method: str, build: Callable, expect: int = 200, login: Optional[str] = None):
+        self.name = name
+        self.app = name.split(".")[0]
+        self.method = method
+        self.build = build
+        self.expect = expect
+        self.login = login
+
+    async def cookies(self, client, records: int) -> List[str]:
+        if self.login is None:
+            return []
+        cookies = []
+        for n in range(min(records, LOGINS)):
+            _, headers = await client("POST", self.login, headers=[FORM],
+                                      body=form(username=synthetic.username(n), password=synthetic.PASSWORD))
+            cookies += [value.decode("latin-1").split(";")[0] for name, value in headers if name == b"set-cookie"]
+        if not cookies:
+            raise RuntimeError(f"{self.name}: could not log in at {self.login}")
+        return cookies
+
+    def request(self, rng: random.Random, n: int, records: int, cookies: List[str]):
+        path, query, body = self.build(rng, n, records, cookies)
+        headers = [FORM] if body else []
+        if cookies:
+            headers.append(("cookie", rng.choice(cookies)))
+        return path, query, headers, body or b""
+
+
+def _login(rng, n, records, cookies):
+    return "/login", "", form(username=synthetic.username(rng.randrange(records)), password=synthetic.PASSWORD)
+
+
+SCENARIOS = [
+    Scenario("car.list", "GET", lambda rng, n, records, cookies: ("/cars", f"number=10&after={rng.randrange(records)}", None)),
+    Scenario("car.detail", "GET", lambda rng, n, records, cookies: (f"/cars/{rng.randrange(1, records + 1)}", "", None)),
+    Scenario("architecture.item", "GET", lambda rng, n, records, cookies: (f"/items/item{rng.randrange(records)}", "", None)),
+    Scenario("social.login", "POST", _login, expect=302),
+    Scenario("social.home", "GET", lambda rng, n, records, cookies: ("/home", "", None), login="/login"),
+    Scenario("social.register", "POST", lambda rng, n, records, cookies: (
+        "/register", "", form(username=f"new{n}", name="New User", password=synthetic.PASSWORD, email=f"new{n}@example.com")),
+        expect=302),
+    Scenario("auth.login", "POST", _login, expect=302),
+]
+
+
+# apps
+def seed_cars(main, records: int) -> None:
+    main.cars.add_many(synthetic.cars(records))
+
+
+def seed_items(main, records: int) -> None:
+    importlib.import_module("routers.items").fake_items_db.update(synthetic.items(records))
+
+
+def seed_social(main, records: int) -> None:
+    from shared.records import Record
+    hashed = main.hasher.hash_sync(synthetic.PASSWORD)  # one hash for everyone: BCRYPT_ROUNDS applies
+    for username, record in synthetic.social_users(records, hashed):
+        main.users[username] = Record(record)
+
+
+def seed_auth(main, records: int) -> None:
+    from shared.records import Record
+    hashed = importlib.import_module("utils").hasher.hash_sync(synthetic.PASSWORD)
+    for username, record in synthetic.auth_users(records, hashed):
+        main.users[username] = Record(record)
+
+
+def hashers(main) -> List:
+    """The app's bcrypt pools, to shut down when done."""
+    return [module.hasher for module in (main, sys.modules.get("utils")) if hasattr(module, "hasher")]
+
+
+APPS: Dict[str, Tuple[str, Callable]] = {  # scenario prefix -> (folder, seed)
+    "car": ("Car_Information_Viewer", seed_cars),
+    "architecture": ("Architecture", seed_items),
+    "social": ("SocialMediaFeed(AUTH)", seed_social),
+    "auth": ("AUTH_", seed_auth),
+}
+
+
+def start_app(name: str, records: int):
+    folder, seed = APPS[name]
+    warnings.filterwarnings("ignore", module="jwt")  # the example apps use short demo secrets
+    main = load_app(folder)
+    start = time.perf_counter()
+    seed(main, records)
+    print(f"{name}: {records} records in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+    return main
+
+
+# load
+_requests = itertools.count()  # numbers every request of the run: registrations stay unique
+
+
+def percentile(values: Sequence[float], fraction: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+async def drive(connect: Callable, scenario: Scenario, cookies: List[str], records: int,
+                concurrency: int, duration: float) -> dict:
+    latencies: List[float] = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async def client(seed: int) -> None:
+        nonlocal errors
+        rng = random.Random(seed)
+        send = connect()
+        try:
+            while time.perf_counter() < deadline:
+                path, query, headers, body = scenario.request(rng, next(_requests), records, cookies)
+                start = time.perf_counter()
+                await asyncio.sleep(0)  # queue behind the other clients: in process, a handler that never awaits would let one client run alone
+                try:
+                    status, _ = await send(scenario.method, path, query, headers, body)
+                except (OSError, asyncio.IncompleteReadError, ValueError):
+                    status = 0
+                latencies.append(time.perf_counter() - start)
+                if status != scenario.expect:
+                    errors += 1
+        finally:
+            send.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(seed) for seed in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {"requests": len(latencies), "errors": errors, "rps": round(len(latencies) / elapsed, 1),
+            "p50_ms": round(percentile(latencies, 0.5) * 1000, 3), "p99_ms": round(percentile(latencies, 0.99) * 1000, 3)}
+
+
+async def run_scenarios(connect: Callable, scenarios: List[Scenario], args) -> Dict[str, dict]:
+    results = {}
+    for scenario in scenarios:
+        setup = connect()
+        cookies = await scenario.cookies(setup, args.records)
+        setup.close()
+        await drive(connect, scenario, cookies, args.records, 1, args.warmup)
+        results[scenario.name] = {}
+        for concurrency in args.levels:
+            stats = await drive(connect, scenario, cookies, args.records, concurrency, args.duration)
+            results[scenario.name][str(concurrency)] = stats
+            print(f"{scenario.name:>20} x{concurrency:<4} {stats['rps']:>9.1f} req/s  p50 {stats['p50_ms']:>8.3f} ms"
+                  f"  p99 {stats['p99_ms']:>8.3f} ms  errors {stats['errors']}", file=sys.stderr)
+    return results
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port: int, server: subprocess.Popen, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"server exited with {server.returncode}")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise TimeoutError(f"nothing listening on {port} after {timeout}s")
+
+
+def run_app(name: str, scenarios: List[Scenario], args) -> Dict[str, dict]:
+    """Runs one app's scenarios in a separate process (asgi) or against a separate server (uvicorn)."""
+    command = [sys.executable, "-m", "benchmarks.harness", "--records", str(args.records)]
+    if args.mode == "asgi":
+        with tempfile.TemporaryDirectory() as directory:
+            out = os.path.join(directory, "results.json")
+            subprocess.run(command + ["--child", name, "--child-out", out, "--only", ",".join(s.name for s in scenarios),
+                                      "--concurrency", args.concurrency, "--duration", str(args.duration),
+                                      "--warmup", str(args.warmup)], cwd=ROOT, check=True)
+            with open(out) as file:
+                return json.load(file)
+
+    port = free_port()
+    server = subprocess.Popen(command + ["--serve", name, "--port", str(port)], cwd=ROOT)
+    try:
+        wait_for_port(port, server, args.startup_timeout)
+        return asyncio.run(run_scenarios(lambda: HttpClient("127.0.0.1", port), scenarios, args))
+    finally:
+        server.terminate()
+        try:
+            server.wait(10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+
+# baseline
+def compare(results: Dict[str, dict], baseline: dict, threshold: float) -> List[str]:
+    regressions = []
+    print(f"\n{'':>20} {'':>5} {'req/s':>9} {'vs base':>8} {'p99 ms':>9} {'vs base':>8}")
+    for name, levels in results.items():
+        for level, now in levels.items():
+            before = baseline.get("results", {}).get(name, {}).get(level)
+            if before is None:
+                print(f"{name:>20} x{level:<4} {now['rps']:>9.1f} {'new':>8} {now['p99_ms']:>9.3f}")
+                continue
+            rps = now["rps"] / before["rps"] - 1 if before["rps"] else 0.0
+            p99 = now["p99_ms"] / before["p99_ms"] - 1 if before["p99_ms"] else 0.0
+            flags = []
+            if rps < -threshold:
+                flags.append(f"req/s {rps:+.0%}")
+            if p99 > threshold:
+                flags.append(f"p99 {p99:+.0%}")
+            if now["errors"] and not before["errors"]:
+                flags.append(f"{now['errors']} errors")
+            regressions += [f"{name} x{level}: {flag}" for flag in flags]
+            print(f"{name:>20} x{level:<4} {now['rps']:>9.1f} {rps:>+8.0%} {now['p99_ms']:>9.3f} {p99:>+8.0%}"
+                  f"{'  REGRESSION' if flags else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--mode", choices=("asgi", "uvicorn"), default="asgi")
+    parser.add_argument("--records", type=int, default=10_000)
+    parser.add_argument("--concurrency", default="1,8,32")
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per scenario and concurrency level")
+    parser.add_argument("--warmup", type=float, default=1.0)
+    parser.add_argument("--only", default="", help="scenarios or apps, comma separated")
+    parser.add_argument("--out", default="benchmark-results.json")
+    parser.add_argument("--baseline", help=f"default: {os.path.relpath(BASELINE)}, if taken with this --mode and --records")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    parser.add_argument("--startup-timeout", type=float, default=600)
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--child-out", help=argparse.SUPPRESS)
+    parser.add_argument("--serve", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.levels = [int(level) for level in args.concurrency.split(",")]
+    os.environ.setdefault("BCRYPT_ROUNDS", "4")  # so bcrypt doesn't drown the rest; set it to compare hashing
+
+    only = [name for name in args.only.split(",") if name]
+    scenarios = [s for s in SCENARIOS if not only or s.name in only or s.app in only]
+
+    if args.serve:  # uvicorn mode, server side
+        import uvicorn
+        main_module = start_app(args.serve, args.records)
+        for hasher in hashers(main_module):
+            main_module.app.add_event_handler("shutdown", hasher.shutdown)  # uvicorn re-raises SIGTERM once stopped
+        uvicorn.run(main_module.app, host="127.0.0.1", port=args.port, log_level="warning", access_log=False)
+        return
+    if args.child:  # asgi mode, one app
+        main_module = start_app(args.child, args.records)
+        client = AsgiClient(main_module.app)
+        results = asyncio.run(run_scenarios(lambda: client, [s for s in scenarios if s.app == args.child], args))
+        with open(args.child_out, "w") as file:
+            json.dump(results, file)
+        for hasher in hashers(main_module):
+            hasher.shutdown()
+        return
+
+    results: Dict[str, dict] = {}
+    for name in dict.fromkeys(s.app for s in scenarios):
+        results.update(run_app(name, [s for s in scenarios if s.app == name], args))
+    report = {"meta": {"mode": args.mode, "records": args.records, "duration": args.duration,
+                       "concurrency": args.levels, "bcrypt_rounds": os.environ["BCRYPT_ROUNDS"],
+                       "python": platform.python_version(), "machine": platform.node(),
+                       "date": time.strftime("%Y-%m-%dT%H:%M:%S")},
+              "results": results}
+    with open(args.out, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"results written to {args.out}")
+
+    path = BASELINE if args.baseline is None else args.baseline
+    if path and (args.baseline or os.path.exists(path)) and os.path.abspath(path) != os.path.abspath(args.out):
+        with open(path) as file:
+            baseline = json.load(file)
+        differs = [key for key in ("mode", "records") if baseline.get("meta", {}).get(key) != report["meta"][key]]
+        for key in differs:
+            print(f"warning: baseline {key} is {baseline.get('meta', {}).get(key)}, this run's is {report['meta'][key]}")
+        if differs and args.baseline is None:
+            print(f"not compared with {os.path.relpath(path)}")
+            return
+        print(f"compared with {os.path.relpath(path)} ({baseline.get('meta', {}).get('date')})")
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print("\nregressions:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+What FastJSONResponse and EncodedCache (shared/responses.py) save per response.
+
+    python -m benchmarks.json_serialization [--requests 5000] [--records 1000]
+
+- Encoding one item, and a listing of `--records` items, in us per call: jsonable_encoder
+  followed by json.dumps (what FastAPI does with a returned dict or model), json.dumps alone
+  (the fallback without orjson), `dumps` (orjson when installed) and an EncodedCache hit.
+- The Testing app's GET /items/{item_id} and POST /items/, in process, against the same routes
+  as they were before: response_model, a plain dict store and JSONResponse.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import time
+from typing import Optional
+
+from fastapi import FastAPI, Header, HTTPException
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
+
+from benchmarks import synthetic
+from benchmarks._asgi import load_app, median, request
+from shared.metrics import Registry, install
+from shared.responses import EncodedCache, _json_dumps, dumps, orjson
+from shared.storage import MemoryRepository
+
+TOKEN = [("x-token", "coneofsilence")]
+NEW_IDS = itertools.count()  # the Testing app refuses an id it already has
+
+
+class Item(BaseModel):
+    id: str
+    title: str
+    description: Optional[str] = None
+
+
+def per_call_us(fn, count: int) -> float:
+    start = time.perf_counter_ns()
+    for _ in range(count):
+        fn()
+    return (time.perf_counter_ns() - start) / count / 1000
+
+
+def fastapi_json(content) -> bytes:
+    return json.dumps(jsonable_encoder(content), ensure_ascii=False, allow_nan=False,
+                      separators=(",", ":")).encode("utf-8")
+
+
+def before_app() -> FastAPI:
+    """Testing/main.py's item routes as they were, metrics included."""
+    app = FastAPI()
+    install(app, registry=Registry())
+    fake_db = {"foo": {"id": "foo", "title": "Foo", "description": "There goes my hero"}}
+
+    @app.get("/items/{item_id}", response_model=Item)
+    async def read_main(item_id: str, x_token: str = Header(...)):
+        if item_id not in fake_db:
+            raise HTTPException(status_code=404, detail="Item not found")
+        return fake_db[item_id]
+
+    @app.post("/items/", response_model=Item)
+    async def create_item(item: Item, x_token: str = Header(...)):
+        fake_db[item.id] = item
+        return item
+
+    return app
+
+
+async def timings(apps, method: str, count: int):
+    """Alternates between the apps request by request, so drift affects them alike."""
+    times = [[] for _ in apps]
+    for _ in range(count):
+        body = json.dumps({"id": f"new{next(NEW_IDS)}", "title": "New", "description": "An item"}).encode()
+        for app, app_times in zip(apps, times):
+            if method == "GET":
+                result = await request(app, "GET", "/items/foo", headers=TOKEN)
+            else:
+                result = await request(app, "POST", "/items/", headers=TOKEN + [("content-type", "application/json")],
+                                       body=body)
+            assert result.status == 200, result.status
+            app_times.append(result.total)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--records", type=int, default=1000)
+    args = parser.parse_args()
+
+    print(f"dumps uses {'orjson ' + orjson.__version__ if orjson else 'json (orjson is not installed)'}")
+    item = Item(id="foo", title="Foo", description="There goes my hero")
+    listing = MemoryRepository(dict(synthetic.items(args.records)))
+    encoded = EncodedCache(listing)
+    payloads = (("one item (model)", item, lambda: encoded["item0"], 50_000),
+                (f"{args.records} items (dict)", dict(listing.items()), encoded.all, 200))
+    print(f"{'':>22} {'encoder+json':>13} {'json':>9} {'dumps':>9} {'cached':>9}   us per call")
+    for label, content, cached, count in payloads:
+        cached()
+        row = [per_call_us(lambda: fn(content), count) for fn in (fastapi_json, _json_dumps, dumps)]
+        row.append(per_call_us(cached, count))
+        print(f"{label:>22} " + " ".join(f"{value:>{width}.2f}" for value, width in zip(row, (13, 9, 9, 9))))
+
+    apps = (before_app(), load_app("Testing").app)
+
+    async def run():
+        print(f"{'':>22} {'before us':>10} {'after us':>9} {'saved':>6}")
+        for method in ("GET", "POST"):
+            await timings(apps, method, 200)  # warm up
+            before, after = map(median, await timings(apps, method, args.requests))
+            print(f"{method + ' /items':>22} {before * 1e6:>10.1f} {after * 1e6:>9.1f} {(before - after) / before:>6.0%}")
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+What shared/metrics.py costs per request.
+
+    python -m benchmarks.metrics_overhead [--requests 20000]
+
+- Histogram.record and `with timer(...)`: one call, in ns.
+- A bare FastAPI app with one JSON route, in process, with and without MetricsMiddleware,
+  for a path seen before (route label cached) and for a new path each time.
+"""
+
+import argparse
+import asyncio
+import time
+
+from fastapi import FastAPI
+
+from benchmarks._asgi import median, request
+from shared.metrics import Histogram, Registry, install, timer
+
+
+def per_call_ns(fn, count: int) -> float:
+    start = time.perf_counter_ns()
+    for _ in range(count):
+        fn()
+    return (time.perf_counter_ns() - start) / count
+
+
+def bare_app(registry=None) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/items/{item_id}")
+    async def read_item(item_id: int):
+        return {"id": item_id}
+
+    if registry is not None:
+        install(app, registry=registry)
+    return app
+
+
+async def timings(apps, count: int, fresh: bool):
+    """Alternates between the apps request by request, so drift affects them alike."""
+    times = [[] for _ in apps]
+    for i in range(count):
+        for app, app_times in zip(apps, times):
+            result = await request(app, "GET", f"/items/{i if fresh else 1}")
+            assert result.status == 200, result.status
+            app_times.append(result.total)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=20_000)
+    args = parser.parse_args()
+
+    histogram = Histogram()
+    print(f"Histogram.record   {per_call_ns(lambda: histogram.record(0.0012), 200_000):>8.0f} ns")
+    block = Registry()
+
+    def timed_block():
+        with timer("block", block):
+            pass
+
+    print(f"with timer(...)    {per_call_ns(timed_block, 200_000):>8.0f} ns")
+
+    plain, measured = bare_app(), bare_app(Registry())
+
+    async def run():
+        print(f"{'':>18} {'plain us':>9} {'metrics us':>11} {'added us':>9}")
+        for label, fresh in (("same path", False), ("new path each", True)):
+            without, with_metrics = map(median, await timings((plain, measured), args.requests, fresh))
+            print(f"{label:>18} {without * 1e6:>9.1f} {with_metrics * 1e6:>11.1f} {(with_metrics - without) * 1e6:>9.1f}")
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Sign-up latency as the user table grows.
+
+    python -m benchmarks.registration [--sizes 1000,10000,100000,1000000] [--requests 200]
+
+Fills SocialMediaFeed(AUTH)'s users with synthetic accounts, then times POST /register:
+- "refused": the email is taken, answered by the directory without hashing
+- "accepted": a new user, hashing included (BCRYPT_ROUNDS=4 here so bcrypt doesn't drown the rest)
+- "old scan": the duplicate check /register used to do, a loop over every user
+"""
+
+import argparse
+import asyncio
+import os
+import time
+from urllib.parse import urlencode
+
+from benchmarks._asgi import load_app, median, request
+
+FORM = [("content-type", "application/x-www-form-urlencoded")]
+
+
+def synthetic_user(n: int) -> dict:
+    username = f"user{n}"
+    return {"name": f"User {n}", "username": username, "email": f"{username}@example.com",
+            "friends": [], "hashed_password": "x"}
+
+
+def old_scan(users, username: str, email: str) -> bool:
+    invalid = False
+    for db_username in users.keys():
+        if username == db_username:
+            invalid = True
+        elif users[db_username]["email"] == email:
+            invalid = True
+    return invalid
+
+
+async def register(app, username: str, email: str) -> float:
+    body = urlencode({"username": username, "name": "Bench", "password": "bench1234", "email": email}).encode()
+    result = await request(app, "POST", "/register", headers=FORM, body=body)
+    assert result.status in (302, 400), result.status
+    return result.total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", default="1000,10000,100000,1000000")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--scans", type=int, default=5)
+    args = parser.parse_args()
+    os.environ.setdefault("BCRYPT_ROUNDS", "4")
+
+    social = load_app("SocialMediaFeed(AUTH)")
+    users = social.users
+    filled = 0
+
+    async def run():
+        nonlocal filled
+        await register(social.app, "warmup", "warmup@example.com")  # starts the hashing pool
+        print(f"{'users':>10} {'refused ms':>11} {'accepted ms':>12} {'old scan ms':>12}")
+        for size in (int(size) for size in args.sizes.split(",")):
+            for n in range(filled, size):
+                users[f"user{n}"] = synthetic_user(n)
+            filled = max(filled, size)
+
+            refused = [await register(social.app, f"new{size}_{i}", "user0@example.com") for i in range(args.requests)]
+            accepted = [await register(social.app, f"new{size}_{i}", f"new{size}_{i}@example.com") for i in range(args.requests)]
+            scans = []
+            for _ in range(args.scans):
+                start = time.perf_counter()
+                old_scan(users, "nobody", "nobody@example.com")
+                scans.append(time.perf_counter() - start)
+            print(f"{len(users):>10} {median(refused) * 1000:>11.3f} {median(accepted) * 1000:>12.3f} {median(scans) * 1000:>12.3f}")
+
+    asyncio.run(run())
+    social.hasher.shutdown()
+
+
+if __name__ == "__main__":
+    main()
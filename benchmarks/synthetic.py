@@ -0,0 +1,57 @@
+"""
+Synthetic data for the benchmarks: the example apps' seed dicts, scaled to any size.
+
+The same `count` and `seed` always give the same records, so a run and its stored baseline see
+the same data. Every generated user has the password PASSWORD.
+"""
+
+import random
+from typing import Iterator, Tuple
+
+PASSWORD = "bench1234"
+MAKES = ["CarBrand", "AutoCar", "Motoria", "Velocita", "Kraftwerk", "Nordwind", "Sakura", "Tigre"]
+MODELS = ["Fast", "Slow", "Cruiser", "Roadster", "Touring", "Compact", "Pickup", "Coupe", "Wagon", "Sport"]
+REGIONS = ["NA", "EU", "AS", "AF", "SA", "OC"]
+ENGINES = ["V4", "V6", "V8", "V12", "Electric"]
+
+
+def username(n: int) -> str:
+    return f"bench{n}"
+
+
+def cars(count: int, seed: int = 1) -> Iterator[dict]:
+    """Like the cars in Car_Information_Viewer/database.py."""
+    rng = random.Random(seed)
+    for _ in range(count):
+        yield {"make": rng.choice(MAKES), "model": f"{rng.choice(MODELS)} {rng.randrange(1, 100)}",
+               "year": rng.randrange(1970, 2022), "price": round(rng.uniform(5_000, 250_000), 2),
+               "engine": rng.choice(ENGINES), "autonomous": rng.random() < 0.2,
+               "sold": rng.sample(REGIONS, rng.randrange(1, 4))}
+
+
+def social_users(count: int, hashed_password: str, friends: int = 5, seed: int = 1) -> Iterator[Tuple[str, dict]]:
+    """
+    Like the users in SocialMediaFeed(AUTH)/db.py. Each one lists up to `friends` friends among
+    the users generated before it, so they can be stored in order.
+    """
+    rng = random.Random(seed)
+    for n in range(count):
+        name = username(n)
+        yield name, {"name": f"Bench User {n}", "username": name, "email": f"{name}@example.com",
+                     "birthday": None, "friends": [username(f) for f in rng.sample(range(n), min(n, friends))],
+                     "hashed_password": hashed_password}
+
+
+def auth_users(count: int, hashed_password: str, seed: int = 1) -> Iterator[Tuple[str, dict]]:
+    """Like the users in AUTH_/db.py."""
+    rng = random.Random(seed)
+    for n in range(count):
+        name = username(n)
+        yield name, {"name": name, "age": rng.randrange(18, 90), "address": f"Street {n}",
+                     "hashed_password": hashed_password}
+
+
+def items(count: int) -> Iterator[Tuple[str, dict]]:
+    """Like Architecture's fake_items_db."""
+    for n in range(count):
+        yield f"item{n}", {"name": f"Item {n}"}
@@ -0,0 +1,6 @@
+"""
+Pieces shared by the example apps.
+
+Every app is run from its own folder (`uvicorn main:app`), so each main.py puts the
+repository root on sys.path before importing from here.
+"""
@@ -0,0 +1,87 @@
+"""
+LoginManager with an authenticated-principal cache.
+
+A plain LoginManager decodes the JWT cookie and calls the user_loader on every request.
+CachedLoginManager remembers, per token signature, the decoded claims and the user the loader
+returned, until the token's `exp`. A repeat request with the same cookie costs one dict lookup.
+
+The cached user is shared between requests, so user_loader should return an immutable object
+(e.g. a pydantic model with `frozen = True`), and `forget(username)` must be called whenever
+the stored user changes. `follow(users)` does that from a repository's change feed, so under
+DATA_DIR the other workers' writes count too.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, NamedTuple, Set
+
+from fastapi_login import LoginManager
+
+from shared.metrics import timer
+from shared.storage import Repository
+
+
+class Principal(NamedTuple):
+    token: str
+    claims: Dict[str, Any]
+    user: Any
+    expires: float
+
+
+class CachedLoginManager(LoginManager):
+    def __init__(self, *args, max_principals: int = 10_000, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_principals = max_principals  # 0 disables the cache
+        self._principals: "OrderedDict[str, Principal]" = OrderedDict()
+        self._by_subject: Dict[str, Set[str]] = {}
+        self._lock = threading.Lock()
+        self._generation = 0  # bumped by every forget(), so a user loaded meanwhile isn't remembered
+
+    async def get_current_user(self, token: str):
+        signature = token.rpartition(".")[2]
+        principal = self._principals.get(signature)
+        if principal is not None and principal.token == token and principal.expires > time.time():
+            return principal.user
+
+        claims = self._get_payload(token)  # raises not_authenticated_exception for invalid or expired tokens
+        subject = claims.get("sub")
+        if subject is None:
+            raise self.not_authenticated_exception
+        generation = self._generation
+        with timer("user_loader"):  # only on a cache miss
+            user = await self._load_user(subject)
+        if user is None:
+            raise self.not_authenticated_exception
+        if self.max_principals:
+            self._remember(signature, Principal(token, claims, user, claims.get("exp", 0)), generation)
+        return user
+
+    def _remember(self, signature: str, principal: Principal, generation: int) -> None:
+        subject = principal.claims["sub"]
+        with self._lock:
+            if self._generation != generation:
+                return  # a user was forgotten while this one loaded: it may be the stale one
+            self._principals[signature] = principal
+            self._by_subject.setdefault(subject, set()).add(signature)
+            while len(self._principals) > self.max_principals:
+                evicted, old = self._principals.popitem(last=False)
+                self._discard(old.claims["sub"], evicted)
+
+    def _discard(self, subject: str, signature: str) -> None:
+        signatures = self._by_subject.get(subject)
+        if signatures is not None:
+            signatures.discard(signature)
+            if not signatures:
+                del self._by_subject[subject]
+
+    def follow(self, users: Repository) -> None:
+        """Forgets a user whenever its record in `users` (keyed by subject) changes."""
+        users.subscribe(lambda subject, _: self.forget(subject))
+
+    def forget(self, subject: str) -> None:
+        """Drops every cached principal of `subject`, so the next request reloads the user."""
+        with self._lock:
+            self._generation += 1
+            for signature in self._by_subject.pop(subject, ()):
+                self._principals.pop(signature, None)
@@ -0,0 +1,127 @@
+"""
+Unique usernames and emails for sign-up.
+
+UserDirectory sits next to a users mapping (usually a shared.storage repository keyed by
+username) and adds a unique index on the normalized email. A registration first *reserves*
+its username and email. That is a couple of dict lookups under a lock, done before any
+password is hashed, so a taken name is refused at once and two concurrent sign-ups can't
+both get the same one. Once the password is hashed the reservation is *committed*, which
+stores the record, or *released*.
+
+    try:
+        with directory.reserve(username, email) as reservation:
+            record = ...hash the password...
+            reservation.commit(record)
+    except Taken as exc:
+        ...exc.field is "username" or "email"
+
+Reservations are per process. Between workers sharing a repository, the commit goes through
+`Repository.insert`, which refuses a username another worker stored in the meantime. It also
+checks the email against the index at commit time, under the repository's cross-process lock,
+once the index has followed every other worker's write: two workers can't store one email.
+"""
+
+import threading
+from typing import Dict, MutableMapping, Optional, Set
+
+from shared.storage import MISSING
+
+
+class Taken(Exception):
+    def __init__(self, field: str):
+        super().__init__(f"{field} is already taken")
+        self.field = field
+
+
+def normalize_email(email: str) -> str:
+    return email.strip().lower()
+
+
+class Reservation:
+    def __init__(self, directory: "UserDirectory", username: str, email: Optional[str]):
+        self.directory = directory
+        self.username = username
+        self.email = email
+        self.committed = False
+
+    def commit(self, record: dict) -> None:
+        self.directory._commit(self, record)
+        self.committed = True
+
+    def release(self) -> None:
+        self.directory._release(self)
+
+    def __enter__(self) -> "Reservation":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+
+class UserDirectory:
+    def __init__(self, users: MutableMapping[str, dict], email_field: Optional[str] = "email"):
+        self.users = users
+        self.email_field = email_field
+        self._lock = threading.RLock()  # reading the repository may deliver changes to _on_change
+        self._emails: Dict[str, str] = {}  # normalized email -> username
+        self._email_of: Dict[str, str] = {}  # username -> normalized email
+        self._pending_usernames: Set[str] = set()
+        self._pending_emails: Set[str] = set()
+        for username, record in users.items():
+            self._index(username, record)
+        if hasattr(users, "subscribe"):
+            users.subscribe(self._on_change)  # follows updates, deletes and other workers' sign-ups
+
+    def _index(self, username: str, record) -> None:
+        old = self._email_of.pop(username, None)
+        if old is not None and self._emails.get(old) == username:
+            del self._emails[old]
+        email = record.get(self.email_field) if self.email_field and record is not MISSING else None
+        if email:
+            email = normalize_email(email)
+            self._emails[email] = username
+            self._email_of[username] = email
+
+    def _on_change(self, username: str, record) -> None:
+        with self._lock:
+            self._index(username, record)
+
+    def is_taken(self, username: str, email: Optional[str] = None) -> Optional[str]:
+        """Name of the first field that is taken, or None."""
+        if username in self._pending_usernames or username in self.users:
+            return "username"
+        if email is not None:
+            email = normalize_email(email)
+            if email in self._pending_emails or email in self._emails:
+                return "email"
+        return None
+
+    def reserve(self, username: str, email: Optional[str] = None) -> Reservation:
+        with self._lock:
+            field = self.is_taken(username, email)
+            if field is not None:
+                raise Taken(field)
+            email = normalize_email(email) if email is not None else None
+            self._pending_usernames.add(username)
+            if email is not None:
+                self._pending_emails.add(email)
+            return Reservation(self, username, email)
+
+    def _commit(self, reservation: Reservation, record: dict) -> None:
+        def email_taken(record) -> bool:
+            owner = self._emails.get(reservation.email) if reservation.email is not None else None
+            return owner is not None and owner != reservation.username
+
+        if hasattr(self.users, "insert"):
+            if not self.users.insert(reservation.username, record, unless=email_taken):
+                raise Taken("email" if email_taken(record) else "username")  # another worker stored it first
+        else:
+            self.users[reservation.username] = record
+        with self._lock:
+            self._index(reservation.username, record)
+
+    def _release(self, reservation: Reservation) -> None:
+        with self._lock:
+            self._pending_usernames.discard(reservation.username)
+            if reservation.email is not None:
+                self._pending_emails.discard(reservation.email)
@@ -0,0 +1,254 @@
+"""
+Password hashing off the request path.
+
+bcrypt is deliberately slow (~250ms of CPU per call at cost 12), so PasswordHasher runs it in a
+bounded ProcessPoolExecutor instead of on the event loop or the threadpool serving requests.
+When more than `max_queue` hashes are already waiting, new ones are refused with HasherBusy;
+register `hasher_busy_handler` on the app to turn that into a 503 with Retry-After.
+
+`authenticate()` also remembers successful logins for a short while (VerifiedCache), and
+rehashes passwords stored with fewer rounds than configured (BCRYPT_ROUNDS, default 12).
+"""
+
+import asyncio
+import hashlib
+import hmac
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Optional, Set
+
+from passlib.context import CryptContext
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+
+from shared.metrics import timer
+
+logger = logging.getLogger(__name__)
+
+_contexts = {}  # one CryptContext per configuration, built lazily in each process that needs it
+
+
+def _context(config: tuple) -> CryptContext:
+    ctx = _contexts.get(config)
+    if ctx is None:
+        ctx = _contexts[config] = CryptContext(**dict(config))
+    return ctx
+
+
+def _hash(config: tuple, plain_password: str):
+    start = time.perf_counter()
+    return _context(config).hash(plain_password), time.perf_counter() - start
+
+
+def _verify(config: tuple, plain_password: str, hashed_password: str):
+    start = time.perf_counter()
+    return _context(config).verify(plain_password, hashed_password), time.perf_counter() - start
+
+
+class HasherBusy(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__("Password hasher is saturated")
+        self.retry_after = retry_after
+
+
+def hasher_busy_handler(request: Request, exc: HasherBusy):
+    return JSONResponse({"detail": "Too many concurrent logins, try again shortly"},
+                        status_code=503, headers={"Retry-After": str(exc.retry_after)})
+
+
+class VerifiedCache:
+    """
+    Remembers recent successful verifications so repeated logins skip bcrypt.
+
+    Entries hold an HMAC (keyed with a random per-process secret) of the password together with
+    the stored hash, never the password itself. Changing the stored hash therefore invalidates
+    the entry on its own; `invalidate()` drops it explicitly.
+    """
+
+    def __init__(self, ttl: float = 300, max_entries: int = 10_000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._secret = os.urandom(32)
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _digest(self, plain_password: str, hashed_password: str) -> bytes:
+        message = plain_password.encode() + b"\0" + hashed_password.encode()
+        return hmac.new(self._secret, message, hashlib.sha256).digest()
+
+    def check(self, username: str, plain_password: str, hashed_password: str) -> bool:
+        digest = self._digest(plain_password, hashed_password)
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is not None and entry[1] < time.monotonic():
+                del self._entries[username]
+                entry = None
+            if entry is None or not hmac.compare_digest(entry[0], digest):
+                self.misses += 1
+                return False
+            self.hits += 1
+            return True
+
+    def remember(self, username: str, plain_password: str, hashed_password: str) -> None:
+        digest = self._digest(plain_password, hashed_password)
+        with self._lock:
+            self._entries[username] = (digest, time.monotonic() + self.ttl)
+            self._entries.move_to_end(username)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, username: str) -> None:
+        with self._lock:
+            self._entries.pop(username, None)
+
+
+class PasswordHasher:
+    def __init__(self, max_workers: Optional[int] = None, max_queue: int = 32, retry_after: int = 1,
+                 rounds: Optional[int] = None, verified_ttl: float = 300, verified_max_entries: int = 10_000,
+                 **context_options):
+        self.max_workers = max_workers or max(1, (os.cpu_count() or 2) // 2)
+        self.max_queue = max_queue
+        self.retry_after = retry_after
+        rounds = rounds or int(os.getenv("BCRYPT_ROUNDS", "12"))
+        context_options.setdefault("schemes", ["bcrypt"])
+        context_options.setdefault("bcrypt__default_rounds", rounds)
+        context_options.setdefault("bcrypt__min_rounds", rounds)  # hashes below this are rehashed on login
+        self._config = tuple(sorted((k, tuple(v) if isinstance(v, list) else v) for k, v in context_options.items()))
+        self.verified = VerifiedCache(verified_ttl, verified_max_entries)
+        self._rehashed = 0
+        self._rehashing: Set[asyncio.Task] = set()  # keeps the background rehashes referenced until they finish
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._completed = 0
+        self._rejected = 0
+        self._hash_seconds = 0.0  # time spent hashing in the workers
+        self._wait_seconds = 0.0  # time from submission to result, queueing included
+        self._max_wait = 0.0
+
+    def _submit(self, fn, *args) -> Future:
+        with self._lock:
+            if self._pending >= self.max_workers + self.max_queue:
+                self._rejected += 1
+                raise HasherBusy(self.retry_after)
+            if self._executor is None:
+                # spawn: forking a process that already runs threads (the server's threadpool) isn't safe
+                self._executor = ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context("spawn"))
+            self._pending += 1
+            executor = self._executor
+        submitted = time.perf_counter()
+        try:
+            future = executor.submit(fn, self._config, *args)
+        except BaseException as exc:
+            with self._lock:
+                self._pending -= 1
+                if isinstance(exc, BrokenProcessPool) and self._executor is executor:
+                    self._executor = None  # a worker died (OOM-killed...): the next call starts a new pool
+            if isinstance(exc, BrokenProcessPool):
+                executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        future.add_done_callback(lambda f: self._done(f, submitted))
+        return future
+
+    def _done(self, future: Future, submitted: float) -> None:
+        waited = time.perf_counter() - submitted
+        with self._lock:
+            self._pending -= 1
+            if future.cancelled() or future.exception() is not None:
+                if isinstance(future.exception() if not future.cancelled() else None, BrokenProcessPool):
+                    self._executor = None  # don't hand the next hash to the broken pool
+                return
+            self._completed += 1
+            self._hash_seconds += future.result()[1]
+            self._wait_seconds += waited
+            self._max_wait = max(self._max_wait, waited)
+
+    # async API, for `async def` handlers
+    @timer("hash_password")  # queueing included
+    async def hash(self, plain_password: str) -> str:
+        return (await asyncio.wrap_future(self._submit(_hash, plain_password)))[0]
+
+    @timer("verify_password")
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return (await asyncio.wrap_future(self._submit(_verify, plain_password, hashed_password)))[0]
+
+    # blocking API, for code that isn't async
+    @timer("hash_password")
+    def hash_sync(self, plain_password: str) -> str:
+        return self._submit(_hash, plain_password).result()[0]
+
+    @timer("verify_password")
+    def verify_sync(self, plain_password: str, hashed_password: str) -> bool:
+        return self._submit(_verify, plain_password, hashed_password).result()[0]
+
+    def needs_update(self, hashed_password: str) -> bool:
+        return _context(self._config).needs_update(hashed_password)
+
+    async def authenticate(self, username: str, plain_password: str, hashed_password: str,
+                           on_rehash: Optional[Callable[[str, str, str], bool]] = None) -> bool:
+        """
+        Verifies a login, answering from the verified-credential cache when possible.
+        If the stored hash is weaker than the current policy, a new hash is computed in the
+        background and handed to `on_rehash(username, old_hash, new_hash)`, in the threadpool.
+        It should store the new hash only if the stored one is still `old_hash` (the password
+        may have changed meanwhile), and return whether it did.
+        """
+        if self.verified.check(username, plain_password, hashed_password):
+            return True
+        if not await self.verify(plain_password, hashed_password):
+            return False
+        self.verified.remember(username, plain_password, hashed_password)
+        if on_rehash is not None and self.needs_update(hashed_password):
+            task = asyncio.ensure_future(self._rehash(username, plain_password, hashed_password, on_rehash))
+            self._rehashing.add(task)
+            task.add_done_callback(self._rehashing.discard)
+        return True
+
+    async def _rehash(self, username: str, plain_password: str, old_hash: str,
+                      on_rehash: Callable[[str, str, str], bool]) -> None:
+        try:
+            future = self._submit(_hash, plain_password)
+        except HasherBusy:
+            return  # not urgent, the next login will try again
+        try:
+            new_hash = (await asyncio.wrap_future(future))[0]
+            stored = await run_in_threadpool(on_rehash, username, old_hash, new_hash)  # may wait for an fsync
+        except Exception:
+            logger.exception("Storing the rehashed password of %r failed", username)
+            return
+        if stored:
+            self.verified.remember(username, plain_password, new_hash)
+            with self._lock:
+                self._rehashed += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            done = self._completed or 1
+            return {
+                "workers": self.max_workers,
+                "in_flight": self._pending,
+                "queue_depth": max(0, self._pending - self.max_workers),
+                "completed": self._completed,
+                "rejected": self._rejected,
+                "hash_ms_avg": self._hash_seconds / done * 1000,
+                "latency_ms_avg": self._wait_seconds / done * 1000,
+                "latency_ms_max": self._max_wait * 1000,
+                "verified_cache_hits": self.verified.hits,
+                "verified_cache_misses": self.verified.misses,
+                "rehashed": self._rehashed,
+            }
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
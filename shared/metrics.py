@@ -0,0 +1,326 @@
+"""
+Request metrics, kept in memory and served in the Prometheus text format.
+
+    from shared.metrics import install, timer
+    install(app)                          # per-route latency + in-flight, and GET /metrics
+
+    with timer("verify_password"):        # or @timer("...") on a function, sync or async
+        ...
+
+- Histogram is HDR-style: log-linear buckets over whole microseconds, 16 per power of two, so
+  any recorded value is known to within ~6% from 1us to hours, in a fixed list of 544 counters.
+  Recording is an index computation and three additions under a lock.
+- MetricsMiddleware labels each request with its route's path template ("/cars/{id}", not
+  "/cars/7"), found like the router finds it and remembered per path. Requests that match no
+  route are labelled "unmatched". It keeps a latency histogram and an in-flight gauge per
+  method and route, and counts responses by status. Install it last, so it is outermost and
+  also times what other middleware answers by itself (cache hits, rejected tokens).
+- `install()` also times FastAPI's own jsonable_encoder, by wrapping the name fastapi.routing
+  calls it through.
+
+/metrics exposes each histogram with the usual `le` buckets (approximated from the HDR buckets),
+plus `<name>_quantile` gauges (p50, p90, p99, max) for reading it without Prometheus.
+"""
+
+import asyncio
+import functools
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+SUB_BITS = 4
+SUB_BUCKETS = 1 << SUB_BITS
+MAX_MICROSECONDS = (1 << 36) - 1  # ~19 hours; longer values are clamped
+BUCKETS = (MAX_MICROSECONDS.bit_length() - SUB_BITS) * SUB_BUCKETS
+LE_BOUNDS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUANTILES = (0.5, 0.9, 0.99)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+METHODS = frozenset(("GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS", "CONNECT", "TRACE"))
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _index(us: int) -> int:
+    if us < SUB_BUCKETS:
+        return us
+    shift = us.bit_length() - SUB_BITS - 1
+    return (shift + 1) * SUB_BUCKETS + (us >> shift) - SUB_BUCKETS
+
+
+def _upper(index: int) -> int:
+    """Highest value (us) that lands in a bucket."""
+    if index < SUB_BUCKETS:
+        return index
+    shift = index // SUB_BUCKETS - 1
+    return ((index % SUB_BUCKETS + SUB_BUCKETS + 1) << shift) - 1
+
+
+class Histogram:
+    __slots__ = ("counts", "count", "sum", "max", "_lock")
+
+    def __init__(self):
+        self.counts = [0] * BUCKETS
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        us = int(seconds * 1_000_000)
+        if us < SUB_BUCKETS:
+            index = us
+        else:  # _index(), inlined
+            if us > MAX_MICROSECONDS:
+                us = MAX_MICROSECONDS
+            shift = us.bit_length() - SUB_BITS - 1
+            index = (shift + 1) * SUB_BUCKETS + (us >> shift) - SUB_BUCKETS
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def quantile(self, q: float) -> float:
+        """Upper bound (seconds) of the bucket holding the q-th value; 0 when empty."""
+        with self._lock:
+            counts, count = list(self.counts), self.count
+        if not count:
+            return 0.0
+        rank = max(1, int(q * count + 0.5))
+        seen = 0
+        for index, n in enumerate(counts):
+            seen += n
+            if seen >= rank:
+                return _upper(index) / 1_000_000
+        return self.max
+
+    def snapshot(self) -> Tuple[List[int], int, float, float]:
+        with self._lock:
+            return list(self.counts), self.count, self.sum, self.max
+
+
+class Gauge:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: int = 1) -> None:
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: int = 1) -> None:
+        with self._lock:
+            self.value -= amount
+
+
+Counter = Gauge  # only ever incremented
+
+
+class Registry:
+    def __init__(self):
+        self._families: Dict[str, Tuple[str, str, Dict[Labels, object]]] = {}  # name -> (type, help, series)
+        self._lock = threading.Lock()
+
+    def _get(self, kind: str, factory, name: str, help: str, labels: Dict[str, str]):
+        key = tuple(sorted(labels.items()))
+        family = self._families.get(name)
+        series = family[2].get(key) if family else None
+        if series is None:
+            with self._lock:
+                family = self._families.setdefault(name, (kind, help, {}))
+                series = family[2].setdefault(key, factory())
+        return series
+
+    def histogram(self, name: str, help: str = "", **labels: str) -> Histogram:
+        return self._get("histogram", Histogram, name, help, labels)
+
+    def gauge(self, name: str, help: str = "", **labels: str) -> Gauge:
+        return self._get("gauge", Gauge, name, help, labels)
+
+    def counter(self, name: str, help: str = "", **labels: str) -> Counter:
+        return self._get("counter", Counter, name, help, labels)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._families.clear()
+
+    def exposition(self) -> str:
+        """Everything, in the Prometheus text format."""
+        with self._lock:
+            families = [(name, kind, help, list(series.items())) for name, (kind, help, series) in sorted(self._families.items())]
+        lines: List[str] = []
+        for name, kind, help, series in families:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind != "histogram":
+                lines.extend(f"{name}{_labels(labels)} {metric.value}" for labels, metric in series)
+                continue
+            for labels, histogram in series:
+                counts, count, total, _ = histogram.snapshot()
+                cumulative, index = 0, 0
+                for bound in LE_BOUNDS:
+                    last = _index(int(bound * 1_000_000))
+                    while index <= last:
+                        cumulative += counts[index]
+                        index += 1
+                    lines.append(f"{name}_bucket{_labels(labels, le=repr(bound))} {cumulative}")
+                lines.append(f"{name}_bucket{_labels(labels, le='+Inf')} {count}")
+                lines.append(f"{name}_sum{_labels(labels)} {total}")
+                lines.append(f"{name}_count{_labels(labels)} {count}")
+            lines.append(f"# TYPE {name}_quantile gauge")
+            for labels, histogram in series:
+                for q in QUANTILES:
+                    lines.append(f"{name}_quantile{_labels(labels, quantile=repr(q))} {histogram.quantile(q)}")
+                lines.append(f"{name}_quantile{_labels(labels, quantile='1.0')} {histogram.max}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels: Labels, **extra: str) -> str:
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(str(value))}"' for key, value in pairs) + "}"
+
+
+REGISTRY = Registry()
+
+
+# timers
+class timer:
+    """
+    Records how long a block or a function call takes, in `function_duration_seconds{function=name}`.
+    As a decorator the histogram is looked up once; `with timer(...)` looks it up on each use.
+    """
+
+    def __init__(self, name: str, registry: Optional[Registry] = None, **labels: str):
+        self.histogram = (registry or REGISTRY).histogram(
+            "function_duration_seconds", "Time spent in instrumented functions.", function=name, **labels)
+        self._start = 0.0
+
+    def __enter__(self) -> "timer":
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.histogram.record(time.perf_counter() - self._start)
+
+    def __call__(self, fn: Callable) -> Callable:
+        histogram = self.histogram
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def timed_async(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    histogram.record(time.perf_counter() - start)
+            return timed_async
+
+        @functools.wraps(fn)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                histogram.record(time.perf_counter() - start)
+        return timed
+
+
+# requests
+class _Series:
+    __slots__ = ("duration", "in_flight", "statuses", "labels")
+
+    def __init__(self, registry: Registry, method: str, route: str):
+        self.labels = {"method": method, "route": route}
+        self.duration = registry.histogram("http_request_duration_seconds", "Request latency, by route.", **self.labels)
+        self.in_flight = registry.gauge("http_requests_in_flight", "Requests being handled, by route.", **self.labels)
+        self.statuses: Dict[int, Counter] = {}
+
+
+class MetricsMiddleware:
+    def __init__(self, app: ASGIApp, registry: Optional[Registry] = None, max_paths: int = 10_000):
+        self.app = app
+        self.registry = registry or REGISTRY
+        self.max_paths = max_paths
+        self._routes: Dict[str, str] = {}  # path -> route label
+        self._series: Dict[Tuple[str, str], _Series] = {}
+
+    def route(self, scope: Scope) -> str:
+        path = scope["path"]
+        label = self._routes.get(path)
+        if label is None:
+            label = "unmatched"
+            for route in scope["app"].router.routes:  # in order, like the router
+                if route.path_regex.match(path):
+                    label = getattr(route, "path", "") or "/"
+                    break
+            if len(self._routes) >= self.max_paths:
+                self._routes.clear()  # ids in paths: don't grow forever
+            self._routes[path] = label
+        return label
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        method = scope["method"]
+        if method not in METHODS:
+            method = "OTHER"  # the client picks the method: made-up ones would each add series
+        key = (method, self.route(scope))
+        series = self._series.get(key)
+        if series is None:
+            series = self._series.setdefault(key, _Series(self.registry, *key))
+        status = 500
+
+        async def watch(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        series.in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, watch)
+        finally:
+            series.duration.record(time.perf_counter() - start)
+            series.in_flight.dec()
+            counter = series.statuses.get(status)
+            if counter is None:
+                counter = series.statuses[status] = self.registry.counter(
+                    "http_responses_total", "Responses sent, by route and status.", status=str(status), **series.labels)
+            counter.inc()
+
+
+def metrics_endpoint(registry: Optional[Registry] = None) -> Callable:
+    registry = registry or REGISTRY
+
+    def metrics(request: Request) -> Response:
+        return Response(registry.exposition(), media_type=CONTENT_TYPE)
+    return metrics
+
+
+def time_json_encoding(registry: Optional[Registry] = None) -> None:
+    """Times the jsonable_encoder calls FastAPI makes to serialize responses."""
+    import fastapi.routing
+
+    encoder = fastapi.routing.jsonable_encoder
+    if getattr(encoder, "__wrapped__", None) is None:
+        fastapi.routing.jsonable_encoder = timer("jsonable_encoder", registry)(encoder)
+
+
+def install(app, path: str = "/metrics", registry: Optional[Registry] = None) -> None:
+    """Adds MetricsMiddleware (call it after any other add_middleware) and the metrics route."""
+    app.add_middleware(MetricsMiddleware, registry=registry)
+    app.add_route(path, metrics_endpoint(registry), include_in_schema=False)
+    time_json_encoding(registry)
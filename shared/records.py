@@ -0,0 +1,142 @@
+"""
+Validated, immutable records.
+
+A pydantic model is handy to check a form, but keeping the model instance around costs extra
+passes: the stored dict is validated again on every edit, then `.dict()`, `.copy(update=...)`
+and `jsonable_encoder` each walk it once more. RecordType does the same job with one pass:
+
+    cars = record_type(Car)
+    car = cars.validate(form)               # full validation -> Record
+    car = cars.merge(car, {"price": "9.5"})  # only "price" is validated
+
+A Record is a read-only dict of JSON-ready values, so it can go straight into a repository,
+a template or a JSON response. Lists are kept as tuples and nested dicts as Records, all the
+way down, so nothing nested can be changed either. It is built by RecordType, so whatever it holds has already been validated: merge()
+trusts the base record and validates just the changed fields. `freeze()` turns data that is
+valid already (seeds, values read back from a repository's files) into a Record. Stored
+records are shared between requests (and indexed by the stores), which is why they can't be
+modified in place.
+
+Models with root validators can't be checked one field at a time; merge() validates the whole
+merged record for them.
+"""
+
+from enum import Enum
+from functools import lru_cache
+from typing import Callable, Dict, Mapping, Optional, Tuple, Type
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel, ValidationError
+from pydantic.fields import SHAPE_LIST, SHAPE_SINGLETON, ModelField
+from pydantic.main import validate_model
+
+JSON_TYPES = (str, int, float, bool)
+
+
+class Record(dict):
+    __slots__ = ()
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("Record is read-only, build a new one with RecordType.merge()")
+
+    __setitem__ = __delitem__ = __ior__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+    def __reduce__(self):
+        return Record, (dict(self),)
+
+    def __copy__(self) -> "Record":
+        return self
+
+    def __deepcopy__(self, memo) -> "Record":
+        return self
+
+
+def _frozen(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(_frozen(item) for item in value)
+    if isinstance(value, dict) and not isinstance(value, Record):
+        return Record({name: _frozen(item) for name, item in value.items()})
+    return value
+
+
+def freeze(values: Mapping) -> Record:
+    """`values` as a Record, lists turned into tuples and dicts into Records at every depth. Doesn't validate anything."""
+    if isinstance(values, Record):
+        return values
+    return Record({name: _frozen(value) for name, value in values.items()})
+
+
+def _encoder(field: ModelField) -> Optional[Callable]:
+    """How to turn a validated value of this field into JSON; None when it already is JSON."""
+    type_ = field.type_
+    if field.shape not in (SHAPE_SINGLETON, SHAPE_LIST) or not isinstance(type_, type):
+        return jsonable_encoder
+    if field.shape == SHAPE_SINGLETON and field.sub_fields:  # a Union
+        return jsonable_encoder
+    if issubclass(type_, JSON_TYPES) and not issubclass(type_, Enum):
+        return None
+    return jsonable_encoder
+
+
+class RecordType:
+    def __init__(self, model: Type[BaseModel]):
+        self.model = model
+        self.fields: Dict[str, ModelField] = model.__fields__
+        # the serializer, worked out once per model: str/int/float/bool (and lists of them) are
+        # kept as they are, anything else goes through jsonable_encoder
+        self.encoders: Dict[str, Callable] = {}
+        for name, field in self.fields.items():
+            encoder = _encoder(field)
+            if encoder is not None:
+                self.encoders[name] = encoder
+        self.per_field = not (model.__pre_root_validators__ or model.__post_root_validators__)
+
+    def encode(self, values: Mapping) -> Record:
+        """Validated field values -> Record."""
+        encoders = self.encoders
+        return Record({
+            name: _frozen(encoders[name](value) if name in encoders else value)
+            for name, value in values.items()
+        })
+
+    def parse(self, data: Mapping) -> Tuple[Optional[Record], Optional[ValidationError]]:
+        """(record, None), or (None, error) when `data` is not valid."""
+        values, _, error = validate_model(self.model, data)  # the field values, without building a model instance
+        if error is not None:
+            return None, error
+        return self.encode(values), None
+
+    def validate(self, data: Mapping) -> Record:
+        record, error = self.parse(data)
+        if error is not None:
+            raise error
+        return record
+
+    def merge(self, record: Mapping, changes: Mapping) -> Record:
+        """`record` with `changes` applied. Only the changed fields are validated."""
+        if not self.per_field:
+            return self.validate({**record, **changes})
+        values = dict(record)
+        errors = []
+        for name, value in changes.items():
+            field = self.fields.get(name)
+            if field is None:
+                continue  # unknown fields are ignored, like the model does
+            if name in values and values[name] == value:
+                continue  # unchanged
+            value, error = field.validate(value, values, loc=field.alias, cls=self.model)
+            if error:
+                errors.append(error)
+                continue
+            encoder = self.encoders.get(name)
+            values[name] = _frozen(encoder(value) if encoder else value)
+        if errors:
+            raise ValidationError(errors, self.model)
+        return Record(values)
+
+
+@lru_cache(maxsize=None)
+def record_type(model: Type[BaseModel]) -> RecordType:
+    """The RecordType of a model, built once."""
+    return RecordType(model)
@@ -0,0 +1,226 @@
+"""
+Cached Jinja2 rendering.
+
+CachedTemplates is a drop-in replacement for Jinja2Templates that
+- compiles every template once at startup and keeps the bytecode on disk, so later
+  processes skip parsing and compiling entirely
+- caches rendered fragments per entity (`{{ fragment('car.html', id, car=car, id=id) }}`),
+  invalidated by bumping the entity's version. Read `fragments.generation` (or the entity's
+  `fragments.version(key)`) before reading the data and pass it as `fragments_as_of` in the
+  context: a fragment rendered from data that a write replaced meanwhile is then not cached
+- caches pages whose content only depends on their context (`StaticResponse`)
+- answers `If-None-Match` with `304 Not Modified`
+
+With `enable_async=True`, templates render through Jinja's async API, on the event loop: call
+`await render()` and `await render_static()` from `async def` endpoints instead of
+TemplateResponse and StaticResponse, and `fragment()` renders with `render_async`.
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable, Mapping, Optional
+
+import jinja2
+from markupsafe import Markup
+from fastapi.templating import Jinja2Templates
+from starlette.requests import Request
+from starlette.responses import HTMLResponse, Response
+
+from shared.metrics import timer
+
+
+def make_etag(*parts: Any) -> str:
+    digest = hashlib.blake2b(digest_size=12)
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else str(part).encode())
+        digest.update(b"\0")
+    return f'"{digest.hexdigest()}"'
+
+
+def is_not_modified(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return "*" in tags or etag in tags
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"etag": etag})
+
+
+class FragmentCache:
+    """LRU cache of rendered fragments, keyed by (template, entity key) and checked against the entity's version."""
+
+    def __init__(self, max_entries: int = 10_000):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._versions: dict = {}  # key -> the generation of its last invalidation
+        self._lock = threading.Lock()
+        self.generation = 0  # bumped by every invalidation
+
+    def version(self, key: Hashable) -> int:
+        return self._versions.get(key, 0)
+
+    def invalidate(self, key: Hashable) -> None:
+        with self._lock:
+            self.generation += 1
+            self._versions[key] = self.generation
+
+    def get(self, name: str, key: Hashable) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get((name, key))
+            if entry is None or entry[0] != self._versions.get(key, 0):
+                return None
+            self._entries.move_to_end((name, key))
+            return entry[1]
+
+    def put(self, name: str, key: Hashable, version: int, html: str) -> None:
+        """
+        Stores `html` unless `key` was invalidated after `version`: its `version()`, or the
+        `generation`, read before the data `html` was rendered from.
+        """
+        with self._lock:
+            current = self._versions.get(key, 0)
+            if current > version:
+                return  # rendered from data a write has replaced since
+            self._entries[(name, key)] = (current, html)
+            self._entries.move_to_end((name, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class CachedTemplates(Jinja2Templates):
+    def __init__(self, directory: str, cache_dir: Optional[str] = None, max_fragments: int = 10_000,
+                 max_pages: int = 256, **env_options: Any):
+        cache_dir = cache_dir or os.path.join(os.path.dirname(os.path.abspath(directory)), "__pycache__", "jinja2")
+        os.makedirs(cache_dir, exist_ok=True)
+        pattern = "__jinja2_async_%s.cache" if env_options.get("enable_async") else "__jinja2_%s.cache"  # compiled differently
+        env_options.setdefault("bytecode_cache", jinja2.FileSystemBytecodeCache(cache_dir, pattern))
+        env_options.setdefault("auto_reload", False)  # templates don't change while the app runs
+        super().__init__(directory, **env_options)
+        self.directory = directory
+        self.fragments = FragmentCache(max_fragments)
+        self.max_pages = max_pages
+        self._pages: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._pages_lock = threading.Lock()
+        self.env.globals["fragment"] = self._render_fragment_async if self.env.is_async else self._render_fragment
+        self.revision = self.precompile()
+
+    def precompile(self) -> str:
+        """Loads every template (filling the bytecode cache) and returns a fingerprint of the template set."""
+        digest = hashlib.blake2b(digest_size=8)
+        for name in sorted(self.env.list_templates()):
+            self.env.get_template(name)
+            digest.update(name.encode())
+            digest.update(str(os.stat(os.path.join(self.directory, name)).st_mtime_ns).encode())
+        return digest.hexdigest()
+
+    def _as_of(self, page: jinja2.runtime.Context, key: Hashable) -> int:
+        as_of = page.get("fragments_as_of")
+        return self.fragments.version(key) if as_of is None else as_of
+
+    @jinja2.pass_context
+    def _render_fragment(self, page: jinja2.runtime.Context, name: str, key: Hashable, **context: Any) -> Markup:
+        html = self.fragments.get(name, key)
+        if html is None:
+            version = self._as_of(page, key)
+            html = self.get_template(name).render(context)
+            self.fragments.put(name, key, version, html)
+        return Markup(html)
+
+    @jinja2.pass_context
+    async def _render_fragment_async(self, page: jinja2.runtime.Context, name: str, key: Hashable, **context: Any) -> Markup:
+        html = self.fragments.get(name, key)
+        if html is None:
+            version = self._as_of(page, key)
+            html = await self.get_template(name).render_async(context)
+            self.fragments.put(name, key, version, html)
+        return Markup(html)
+
+    def etag(self, *parts: Any) -> str:
+        """ETag for a page whose content is fully determined by `parts` and the template set."""
+        return make_etag(self.revision, *parts)
+
+    def TemplateResponse(self, name: str, context: dict, status_code: int = 200,
+                         headers: Optional[Mapping[str, str]] = None, etag: Optional[str] = None,
+                         **kwargs: Any) -> Response:
+        """
+        Renders like Jinja2Templates.TemplateResponse and tags the response with an ETag.
+        When the caller already knows the ETag (see `etag()`), a matching `If-None-Match`
+        is answered before anything is rendered.
+        """
+        if status_code != 200:
+            with timer("template_render", template=name):
+                return super().TemplateResponse(name, context, status_code=status_code, headers=headers, **kwargs)
+        if etag is not None and is_not_modified(context["request"], etag):
+            return not_modified(etag)
+        with timer("template_render", template=name):
+            response = super().TemplateResponse(name, context, status_code=status_code, headers=headers, **kwargs)
+        return self._tagged(context["request"], response, etag)
+
+    async def render(self, name: str, context: dict, status_code: int = 200,
+                     headers: Optional[Mapping[str, str]] = None, etag: Optional[str] = None) -> Response:
+        """TemplateResponse for async environments."""
+        request: Request = context["request"]
+        if status_code == 200 and etag is not None and is_not_modified(request, etag):
+            return not_modified(etag)
+        with timer("template_render", template=name):
+            response = HTMLResponse(await self.get_template(name).render_async(context), status_code=status_code, headers=headers)
+        if status_code != 200:
+            return response
+        return self._tagged(request, response, etag)
+
+    @staticmethod
+    def _tagged(request: Request, response: Response, etag: Optional[str]) -> Response:
+        etag = etag or make_etag(response.body)
+        if is_not_modified(request, etag):
+            return not_modified(etag)
+        response.headers["etag"] = etag
+        return response
+
+    def StaticResponse(self, name: str, context: dict, status_code: int = 200) -> Response:
+        """
+        Like TemplateResponse, for pages that only depend on their (hashable) context values.
+        The body is rendered once per distinct context and base URL, then served from memory.
+        """
+        key, page = self._page(name, context, status_code)
+        if page is None:
+            with timer("template_render", template=name):
+                page = self._store_page(key, self.get_template(name).render(context))
+        return self._page_response(context["request"], page, status_code)
+
+    async def render_static(self, name: str, context: dict, status_code: int = 200) -> Response:
+        """StaticResponse for async environments."""
+        key, page = self._page(name, context, status_code)
+        if page is None:
+            with timer("template_render", template=name):
+                page = self._store_page(key, await self.get_template(name).render_async(context))
+        return self._page_response(context["request"], page, status_code)
+
+    def _page(self, name: str, context: dict, status_code: int):
+        key = (name, str(context["request"].base_url), status_code,
+               tuple(sorted((k, v) for k, v in context.items() if k != "request")))
+        with self._pages_lock:
+            page = self._pages.get(key)
+            if page is not None:
+                self._pages.move_to_end(key)
+        return key, page
+
+    def _store_page(self, key: tuple, html: str) -> tuple:
+        body = html.encode()
+        page = (body, make_etag(body))
+        with self._pages_lock:
+            self._pages[key] = page
+            while len(self._pages) > self.max_pages:
+                self._pages.popitem(last=False)
+        return page
+
+    @staticmethod
+    def _page_response(request: Request, page: tuple, status_code: int) -> Response:
+        body, etag = page
+        if status_code == 200 and is_not_modified(request, etag):
+            return not_modified(etag)
+        return HTMLResponse(body, status_code=status_code, headers={"etag": etag})
@@ -0,0 +1,118 @@
+"""
+A faster JSON response, and JSON bytes kept ready for stored records.
+
+FastAPI turns what an endpoint returns into JSON in two passes: `jsonable_encoder` copies it
+into plain dicts and lists (validating it against `response_model` first, if there is one),
+then JSONResponse runs `json.dumps` on the copy. FastJSONResponse encodes with orjson when it
+is installed, with the standard library otherwise, and takes pydantic models as they are:
+
+    router = APIRouter(default_response_class=FastJSONResponse)  # or FastAPI(default_response_class=...)
+
+Returning the response yourself skips `jsonable_encoder` (and `response_model`, which is then
+only used for the docs), so only do it with data that is already valid:
+
+    return FastJSONResponse(item)  # item: a model FastAPI just validated, or a Record
+
+EncodedCache keeps the encoded bytes of each record of a repository (shared/storage.py), and
+of the whole mapping, until the record changes. It learns about changes through
+`Repository.subscribe`, so replace a record to change it: mutating one in place is not seen.
+
+    items_json = EncodedCache(fake_items_db)
+    return FastJSONResponse(items_json[item_id])  # bytes are sent as they are
+"""
+
+import json
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
+from starlette.responses import JSONResponse
+
+from shared.storage import MISSING, Repository
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - the standard library does the same job, more slowly
+    orjson = None
+
+View = Callable[[Hashable, Any], Any]  # (key, record) -> what is sent for that record
+
+
+def _default(obj: Any) -> Any:
+    if isinstance(obj, BaseModel):
+        return obj.dict()
+    return jsonable_encoder(obj)  # anything else neither encoder knows (sets, Decimal, ...)
+
+
+def _json_dumps(content: Any) -> bytes:
+    # the same output as starlette's JSONResponse
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None,
+                      separators=(",", ":"), default=_default).encode("utf-8")
+
+
+if orjson is not None:
+    def dumps(content: Any) -> bytes:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+else:  # pragma: no cover
+    dumps = _json_dumps
+
+
+class FastJSONResponse(JSONResponse):
+    """A JSONResponse encoded with `dumps`. Bytes are taken as already encoded JSON."""
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, bytes):
+            return content
+        return dumps(content)
+
+
+class EncodedCache:
+    def __init__(self, repository: Repository, view: Optional[View] = None):
+        self.repository = repository
+        self.view = view
+        self._encoded: Dict[Hashable, bytes] = {}
+        self._all: Optional[bytes] = None
+        self._generation = 0  # bumped by every change, so a result encoded meanwhile isn't kept
+        self._lock = threading.Lock()  # sync endpoints write from the threadpool
+        repository.subscribe(self._changed)
+
+    def _changed(self, key, value) -> None:
+        with self._lock:
+            self._generation += 1
+            self._encoded.pop(key, None)
+            self._all = None
+
+    # The repository is read, and the result encoded, outside the lock: a read may apply other
+    # workers' writes inline, and their notifications take the lock.
+    def __getitem__(self, key) -> bytes:
+        """The record under `key`, encoded. KeyError if there is none."""
+        if self.repository.shared:
+            self.repository.refresh()  # other workers' writes notify us too
+        encoded = self._encoded.get(key)
+        if encoded is None:
+            generation = self._generation
+            record = self.repository[key]
+            encoded = dumps(self.view(key, record) if self.view else record)
+            with self._lock:
+                if self._generation == generation:  # nothing changed while we were encoding
+                    self._encoded[key] = encoded
+        return encoded
+
+    def all(self) -> bytes:
+        """The whole repository as one JSON object, encoded."""
+        if self.repository.shared:
+            self.repository.refresh()
+        encoded = self._all
+        if encoded is None:
+            generation = self._generation
+            records = {}
+            for key in list(self.repository):  # a copy: writes may land while we read
+                record = self.repository.get(key, MISSING)
+                if record is not MISSING:
+                    records[key] = record
+            encoded = dumps(records)
+            with self._lock:
+                if self._generation == generation:
+                    self._all = encoded
+        return encoded
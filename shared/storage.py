@@ -0,0 +1,430 @@
+"""
+Pluggable storage for the apps' in-memory "databases".
+
+A Repository is a dict-like object (MutableMapping). `open_repository()` picks the backend:
+- MemoryRepository, a plain dict, when DATA_DIR isn't set. Nothing survives a restart,
+  which is what the tests and the tutorials expect.
+- LogRepository when DATA_DIR is set. Every write is appended to a log on local disk and a
+  snapshot is written every `snapshot_every` entries; startup loads the latest snapshot and
+  replays the log written since.
+
+LogRepository can be shared by several worker processes on one host. Appends happen under an
+exclusive flock, after the writer has caught up with whatever the other processes appended,
+so every process applies the log in the same order. A background thread picks up the other
+processes' writes by tailing the log every `refresh_interval` seconds (and reloads the
+snapshot after another process compacted), so reads stay plain dict lookups and never parse
+JSON or run listeners on the caller's thread. `sync()` catches up at once. With
+`refresh_interval=0` there is no thread: every read catches up first, which tests rely on.
+Listeners registered with `subscribe()` see every change, local or not, in log order, so
+derived structures (indexes...) can follow. They run on the committer or the follower thread. Nested values must be replaced, not mutated in
+place: only assignments reach the log.
+
+Writes use group commit: a background thread gathers the writes issued during
+`commit_interval`, appends them in one write() and makes them durable with a single fsync.
+A write returns once its batch is on disk.
+"""
+
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from collections.abc import MutableMapping
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - no flock (Windows): a LogRepository can only be used by one process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+MISSING = object()  # passed to listeners when a key was deleted
+
+Listener = Callable[[Any, Any], None]
+
+
+class Repository(MutableMapping):
+    shared = False  # True when other processes may write to the same data
+
+    def __init__(self):
+        self._listeners: List[Listener] = []
+
+    def subscribe(self, listener: Listener) -> None:
+        """`listener(key, value)` is called after every change (value is MISSING on delete)."""
+        self._listeners.append(listener)
+
+    def _notify(self, key, value) -> None:
+        for listener in self._listeners:
+            listener(key, value)
+
+    def refresh(self) -> None:
+        """Applies the changes other processes made, if they aren't followed in the background."""
+
+    def sync(self) -> None:
+        """Applies the changes other processes made, now."""
+
+    def insert(self, key, value, unless: Optional[Callable[[Any], bool]] = None) -> bool:
+        """
+        Stores `value` only if `key` is absent and `unless(value)` (if given) is false. Returns
+        False if it was refused. A shared repository calls `unless` at commit time, under its
+        cross-process lock, once its listeners have seen every other process's writes.
+        """
+        if key in self or (unless is not None and unless(value)):
+            return False
+        self[key] = value
+        return True
+
+    def add_many(self, values: Iterable[Any]) -> List[int]:
+        """Stores values under new integer keys (above the current highest) and returns the keys."""
+        last = max((k for k in self if isinstance(k, int)), default=0)
+        keys = []
+        for value in values:
+            last += 1
+            self[last] = value
+            keys.append(last)
+        return keys
+
+    def close(self) -> None:
+        pass
+
+
+class MemoryRepository(Repository):
+    def __init__(self, data: Optional[Dict] = None):
+        super().__init__()
+        self._data = dict(data or {})
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __setitem__(self, key, value):
+        self._data[key] = value
+        self._notify(key, value)
+
+    def __delitem__(self, key):
+        del self._data[key]
+        self._notify(key, MISSING)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __iter__(self):
+        return iter(list(self._data))
+
+    def __len__(self):
+        return len(self._data)
+
+
+class _Write:
+    __slots__ = ("op", "key", "value", "unless", "done", "error")
+
+    def __init__(self, op: str, key, value, unless: Optional[Callable[[Any], bool]] = None):
+        # "set", "del", "add" (the key is picked when the batch is committed) or "insert" (a set that
+        # only happens if the key is still absent, and `unless(value)` false, at commit time; it is
+        # turned into None otherwise)
+        self.op = op
+        self.key = key
+        self.value = value
+        self.unless = unless
+        self.done = threading.Event()
+        self.error: Optional[BaseException] = None
+
+
+class LogRepository(Repository):
+    shared = True
+
+    def __init__(self, directory: str, name: str, key_type: Callable = str, seed: Optional[Dict] = None,
+                 snapshot_every: int = 10_000, commit_interval: float = 0.002, refresh_interval: float = 0.05):
+        super().__init__()
+        os.makedirs(directory, exist_ok=True)
+        self._base = os.path.join(directory, name)
+        self.key_type = key_type
+        self.snapshot_every = snapshot_every
+        self.commit_interval = commit_interval
+        self.refresh_interval = refresh_interval
+
+        self._lock = threading.RLock()  # guards the data and the log position
+        self._data: Dict = {}
+        self._max_key = 0
+        self._generation = 0
+        self._log_fd: Optional[int] = None
+        self._offset = 0  # how far into the current log this process has applied
+        self._log_entries = 0
+        self._snapshot_id = None
+
+        self._pending: List[_Write] = []
+        self._wakeup = threading.Condition(threading.Lock())
+        self._closed = False
+
+        self._lock_fd = os.open(self._base + ".lock", os.O_RDWR | os.O_CREAT, 0o644)
+        with self._lock, self._file_lock():
+            self._load_snapshot(notify=False)
+            self._catch_up(notify=False)
+            self._cut_torn_tail()
+            if seed and not self._data and self._generation == 0 and self._offset == 0:
+                self._append([_Write("set", key, value) for key, value in seed.items()])
+
+        self._committer = threading.Thread(target=self._commit_loop, name=f"repository-{name}", daemon=True)
+        self._committer.start()
+        self._stopping = threading.Event()
+        self._follower: Optional[threading.Thread] = None
+        if refresh_interval > 0:
+            self._follower = threading.Thread(target=self._follow_loop, name=f"repository-{name}-follow", daemon=True)
+            self._follower.start()
+
+    # dict interface
+    def __getitem__(self, key):
+        self.refresh()
+        return self._data[key]
+
+    def __contains__(self, key):
+        self.refresh()
+        return key in self._data
+
+    def __iter__(self):
+        self.refresh()
+        return iter(list(self._data))
+
+    def __len__(self):
+        self.refresh()
+        return len(self._data)
+
+    def __setitem__(self, key, value):
+        self._write([_Write("set", key, value)])
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self._write([_Write("del", key, None)])
+
+    def insert(self, key, value, unless: Optional[Callable[[Any], bool]] = None) -> bool:
+        write = _Write("insert", key, value, unless)
+        self._write([write])
+        return write.op is not None
+
+    def add_many(self, values: Iterable[Any]) -> List[int]:
+        writes = [_Write("add", None, value) for value in values]
+        self._write(writes)
+        return [write.key for write in writes]
+
+    # group commit
+    def _write(self, writes: List[_Write]) -> None:
+        if not writes:
+            return
+        with self._wakeup:
+            if self._closed:
+                raise RuntimeError("Repository is closed")
+            self._pending.extend(writes)
+            self._wakeup.notify()
+        for write in writes:
+            write.done.wait()
+            if write.error is not None:
+                raise write.error
+
+    def _commit_loop(self) -> None:
+        while True:
+            with self._wakeup:
+                while not self._pending and not self._closed:
+                    self._wakeup.wait()
+                if self._closed and not self._pending:
+                    return
+            time.sleep(self.commit_interval)  # let the writers arriving meanwhile join this batch
+            with self._wakeup:
+                batch, self._pending = self._pending, []
+            try:
+                with self._lock, self._file_lock():
+                    self._refresh_locked()
+                    self._append(batch)
+                    if self._log_entries >= self.snapshot_every:
+                        self._compact()
+            except BaseException as exc:
+                for write in batch:
+                    write.error = exc
+            finally:
+                for write in batch:
+                    write.done.set()
+
+    def _append(self, batch: List[_Write]) -> None:
+        """Appends a batch to the log and applies it. Needs both locks and an up-to-date view."""
+        lines = []
+        applied = []
+        present: Dict[Any, bool] = {}  # keys written earlier in this batch
+        for write in batch:
+            if write.op == "add":
+                self._max_key += 1
+                write.key = self._max_key
+                write.op = "set"
+            elif write.op == "insert":
+                if present.get(write.key, write.key in self._data) or (write.unless is not None and write.unless(write.value)):
+                    write.op = None
+                    continue
+                write.op = "set"
+            present[write.key] = write.op == "set"
+            lines.append(json.dumps([write.op, write.key, write.value], separators=(",", ":")).encode() + b"\n")
+            applied.append(write)
+        data = b"".join(lines)
+        self._cut_torn_tail()
+        os.write(self._log_fd, data)
+        os.fsync(self._log_fd)
+        self._offset += len(data)
+        self._log_entries += len(applied)
+        for write in applied:
+            self._apply(write.op, write.key, write.value, notify=True)
+
+    # reading the files
+    def _apply(self, op: str, key, value, notify: bool) -> None:
+        if op == "set":
+            self._data[key] = value
+            if isinstance(key, int) and key > self._max_key:
+                self._max_key = key
+        else:
+            self._data.pop(key, None)
+            value = MISSING
+        if notify:
+            self._notify(key, value)
+
+    def _log_path(self, generation: int) -> str:
+        return f"{self._base}.{generation}.log"
+
+    def _snapshot_path(self) -> str:
+        return self._base + ".snapshot"
+
+    def _current_snapshot_id(self):
+        try:
+            stat = os.stat(self._snapshot_path())
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    def _load_snapshot(self, notify: bool) -> None:
+        snapshot_id = self._current_snapshot_id()
+        data, generation = {}, 0
+        if snapshot_id is not None:
+            with open(self._snapshot_path(), "rb") as f:
+                snapshot = json.load(f)
+            generation = snapshot["generation"]
+            data = {self.key_type(key): value for key, value in snapshot["data"]}
+        if notify:
+            for key in self._data.keys() - data.keys():
+                self._notify(key, MISSING)
+            for key, value in data.items():
+                if self._data.get(key, MISSING) != value:
+                    self._notify(key, value)
+        self._data = data
+        self._max_key = max((k for k in data if isinstance(k, int)), default=0)
+        self._snapshot_id = snapshot_id
+        self._open_log(generation)
+
+    def _open_log(self, generation: int) -> None:
+        if self._log_fd is not None:
+            os.close(self._log_fd)
+        self._generation = generation
+        self._log_fd = os.open(self._log_path(generation), os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+        self._offset = 0
+        self._log_entries = 0
+
+    def _catch_up(self, notify: bool) -> None:
+        size = os.fstat(self._log_fd).st_size
+        if size <= self._offset:
+            return
+        chunk = os.pread(self._log_fd, size - self._offset, self._offset)
+        complete = chunk.rfind(b"\n") + 1  # another process may be halfway through an append
+        for line in chunk[:complete].splitlines():
+            op, key, value = json.loads(line)
+            self._apply(op, self.key_type(key), value, notify)
+            self._log_entries += 1
+        self._offset += complete
+
+    def _cut_torn_tail(self) -> None:
+        """
+        Drops a partial last line, left by a writer that died halfway through an append. Needs the
+        file lock and an up-to-date view: then anything past our offset can't be a live append.
+        Appending after it instead would glue the next entry onto it and make the log unreadable.
+        """
+        if os.fstat(self._log_fd).st_size > self._offset:
+            os.ftruncate(self._log_fd, self._offset)
+
+    def _refresh_locked(self) -> None:
+        if self._current_snapshot_id() != self._snapshot_id:  # another process compacted the log
+            self._load_snapshot(notify=True)
+        self._catch_up(notify=True)
+
+    def refresh(self) -> None:
+        if self._follower is not None:
+            return  # the follower thread keeps up
+        if self._lock.acquire(blocking=False):  # if the committer holds it, it is catching up anyway
+            try:
+                self._refresh_locked()
+            finally:
+                self._lock.release()
+
+    def _follow_loop(self) -> None:
+        while not self._stopping.wait(self.refresh_interval):
+            try:
+                self.sync()
+            except Exception:  # a bad read shouldn't stop following: log it and try again next tick
+                logger.exception("Catching up with %s failed", self._base)
+
+    def sync(self) -> None:
+        with self._lock:
+            self._refresh_locked()
+
+    # snapshots
+    def _compact(self) -> None:
+        """Writes the whole data set as a new snapshot and starts a new, empty log."""
+        generation = self._generation + 1
+        tmp = self._snapshot_path() + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"generation": generation, "data": list(self._data.items())}, f, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._snapshot_path())
+        self._snapshot_id = self._current_snapshot_id()
+        self._open_log(generation)
+        for path in glob.glob(glob.escape(self._base) + ".*.log"):
+            if int(path.rsplit(".", 2)[1]) < generation:
+                os.remove(path)
+
+    def snapshot(self) -> None:
+        with self._lock, self._file_lock():
+            self._refresh_locked()
+            self._compact()
+
+    def _file_lock(self):
+        return _FileLock(self._lock_fd)
+
+    def close(self) -> None:
+        self._stopping.set()
+        if self._follower is not None:
+            self._follower.join()
+        with self._wakeup:
+            self._closed = True
+            self._wakeup.notify()
+        self._committer.join()
+        with self._lock:
+            if self._log_fd is not None:
+                os.close(self._log_fd)
+                self._log_fd = None
+        os.close(self._lock_fd)
+
+
+class _FileLock:
+    def __init__(self, fd: int):
+        self.fd = fd
+
+    def __enter__(self):
+        if fcntl is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+
+    def __exit__(self, *exc):
+        if fcntl is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+
+def open_repository(name: str, seed: Optional[Dict] = None, key_type: Callable = str, **options) -> Repository:
+    """A LogRepository under $DATA_DIR when it is set, otherwise a MemoryRepository holding `seed`."""
+    directory = os.getenv("DATA_DIR")
+    if not directory:
+        return MemoryRepository(seed)
+    return LogRepository(directory, name, key_type=key_type, seed=seed, **options)
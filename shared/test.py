@@ -0,0 +1,363 @@
+import asyncio
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from typing import List, Optional
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from pydantic import BaseModel, Field, ValidationError
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+
+from shared.directory import Taken, UserDirectory
+from shared.metrics import Histogram, Registry, install, timer
+from shared.records import Record, freeze, record_type
+from shared.rendering import CachedTemplates
+from shared.responses import EncodedCache, FastJSONResponse, _json_dumps, dumps
+from shared.storage import MISSING, LogRepository, MemoryRepository, open_repository
+
+
+class TestLogRepository(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = self.tmp.name
+        self.opened = []
+
+    def tearDown(self) -> None:
+        for repo in self.opened:
+            repo.close()
+        self.tmp.cleanup()
+
+    def open(self, **options) -> LogRepository:
+        options.setdefault("refresh_interval", 0)
+        repo = LogRepository(self.dir, "cars", key_type=int, **options)
+        self.opened.append(repo)
+        return repo
+
+    def test_survives_restart(self):
+        repo = self.open(seed={1: {"make": "A"}})
+        repo[2] = {"make": "B"}
+        del repo[1]
+        repo.close()
+        self.opened.remove(repo)
+
+        repo = self.open(seed={1: {"make": "A"}}) #the seed only fills an empty repository
+        self.assertEqual({2: {"make": "B"}}, dict(repo.items()))
+
+    def test_snapshot_replaces_log(self):
+        repo = self.open(snapshot_every=3)
+        for id in range(1, 6):
+            repo[id] = {"n": id}
+        self.assertEqual(1, len([f for f in os.listdir(self.dir) if f.endswith(".log")]))
+        repo.close()
+        self.opened.remove(repo)
+        self.assertEqual([1, 2, 3, 4, 5], sorted(self.open()))
+
+    def test_torn_append_is_ignored(self):
+        repo = self.open()
+        repo[1] = {"make": "A"}
+        with open(os.path.join(self.dir, "cars.0.log"), "ab") as log:
+            log.write(b'["set",2,{"ma') #a writer crashed halfway through
+        repo.close()
+        self.opened.remove(repo)
+        self.assertEqual([1], list(self.open()))
+
+    def test_torn_append_is_cut_before_the_next_one(self):
+        repo = self.open()
+        repo[1] = {"make": "A"}
+        with open(os.path.join(self.dir, "cars.0.log"), "ab") as log:
+            log.write(b'["set",2,{"ma') #a writer crashed halfway through, while this one was running
+        repo[3] = {"make": "C"}
+        repo.close()
+        self.opened.remove(repo)
+        self.assertEqual({1: {"make": "A"}, 3: {"make": "C"}}, dict(self.open().items()))
+
+    def test_writers_share_the_log(self):
+        first, second = self.open(), self.open() #separate file descriptions, so they lock each other out like processes
+        changes = []
+        second.subscribe(lambda key, value: changes.append((key, value)))
+
+        ids = first.add_many([{"make": "A"}, {"make": "B"}]) + second.add_many([{"make": "C"}])
+        self.assertEqual([1, 2, 3], ids)
+        del first[1]
+        second.sync()
+        self.assertEqual([2, 3], sorted(second))
+        self.assertEqual((1, MISSING), changes[-1])
+
+        second.snapshot()
+        first[4] = {"make": "D"}
+        second.sync()
+        self.assertEqual({"make": "D"}, second[4])
+
+    def test_follows_other_writers_in_the_background(self):
+        first, second = self.open(), self.open(refresh_interval=0.01)
+        changes = []
+        second.subscribe(lambda key, value: changes.append(threading.current_thread().name))
+        first[1] = {"make": "A"}
+        deadline = time.monotonic() + 5
+        while 1 not in second._data and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual({"make": "A"}, second[1])
+        self.assertEqual(["repository-cars-follow"], changes) #not on the reading thread
+
+    def test_insert_only_if_absent(self):
+        first, second = self.open(), self.open()
+        self.assertTrue(first.insert(7, {"make": "A"}))
+        self.assertFalse(second.insert(7, {"make": "B"})) #second hasn't synced yet, the commit still sees it
+        self.assertEqual({"make": "A"}, second[7])
+
+
+class TestUserDirectory(unittest.TestCase):
+    def setUp(self) -> None:
+        self.users = MemoryRepository({"amy": {"email": "Amy@Example.com"}})
+        self.directory = UserDirectory(self.users)
+
+    def test_taken_before_commit(self):
+        with self.assertRaises(Taken) as taken:
+            self.directory.reserve("bob", " amy@example.COM")
+        self.assertEqual("email", taken.exception.field)
+
+        with self.directory.reserve("bob", "bob@example.com") as reservation:
+            with self.assertRaises(Taken): #held while the first sign-up hashes its password
+                self.directory.reserve("bob", "other@example.com")
+            reservation.commit({"email": "bob@example.com"})
+        self.assertEqual("username", self.directory.is_taken("bob"))
+        self.assertEqual("email", self.directory.is_taken("robert", "BOB@example.com"))
+
+    def test_released_on_failure(self):
+        with self.assertRaises(RuntimeError):
+            with self.directory.reserve("bob", "bob@example.com"):
+                raise RuntimeError("hasher busy")
+        self.assertIsNone(self.directory.is_taken("bob", "bob@example.com"))
+
+    def test_follows_repository_changes(self):
+        self.users["amy"] = {"email": "amy@new.com"}
+        self.assertIsNone(self.directory.is_taken("zoe", "amy@example.com"))
+        del self.users["amy"]
+        self.assertIsNone(self.directory.is_taken("amy", "amy@new.com"))
+
+    def test_email_unique_across_workers(self):
+        with tempfile.TemporaryDirectory() as directory:
+            repos = [LogRepository(directory, "users", refresh_interval=0) for _ in range(2)]
+            try:
+                first, second = (UserDirectory(repo) for repo in repos)
+                bob = first.reserve("bob", "bob@example.com")
+                robert = second.reserve("robert", "Bob@Example.com") #neither worker has seen the other's sign-up yet
+                bob.commit({"email": "bob@example.com"})
+                with self.assertRaises(Taken) as taken:
+                    robert.commit({"email": "Bob@Example.com"})
+                self.assertEqual("email", taken.exception.field)
+                self.assertNotIn("robert", repos[0])
+            finally:
+                for repo in repos:
+                    repo.close()
+
+
+
+class Car(BaseModel):
+    make: str
+    year: Optional[int] = Field(..., ge=1970)
+    sold: Optional[List[str]]
+
+
+class TestRecords(unittest.TestCase):
+    def setUp(self):
+        self.records = record_type(Car)
+
+    def test_validate(self):
+        car = self.records.validate({"make": "A", "year": "2000"})
+        self.assertEqual({"make": "A", "year": 2000, "sold": None}, car)
+        self.assertIsInstance(car, Record)
+        with self.assertRaises(TypeError):
+            car["year"] = 2001
+        with self.assertRaises(ValidationError):
+            self.records.validate({"make": "A"})
+
+    def test_merge_validates_the_changed_fields(self):
+        car = self.records.validate({"make": "A", "year": 2000})
+        unvalidated = Record({**car, "make": None}) #not valid, but merge() trusts its base
+        merged = self.records.merge(unvalidated, {"year": "2010", "sold": ["EU"], "color": "red"})
+        self.assertEqual({"make": None, "year": 2010, "sold": ("EU",)}, merged) #lists are stored as tuples
+        self.assertEqual(2000, car["year"])
+        with self.assertRaises(ValidationError) as raised:
+            self.records.merge(car, {"year": 1900, "make": None})
+        self.assertEqual([("year",), ("make",)], [error["loc"] for error in raised.exception.errors()])
+
+    def test_freeze(self):
+        car = freeze({"make": "A", "sold": ["EU"]})
+        self.assertIsInstance(car, Record)
+        self.assertEqual(("EU",), car["sold"])
+        self.assertIs(car, freeze(car))
+        nested = freeze({"owners": [{"name": "A", "cars": [1, [2]]}], "specs": {"doors": [4]}})
+        self.assertEqual(((1, (2,)),), tuple(owner["cars"] for owner in nested["owners"]))
+        with self.assertRaises(TypeError):
+            nested["specs"]["doors"] = (5,)
+        with self.assertRaises(TypeError):
+            nested["owners"][0]["name"] = "B"
+
+    def test_one_record_type_per_model(self):
+        self.assertIs(self.records, record_type(Car))
+
+
+class TestMetrics(unittest.TestCase):
+    def test_histogram_quantiles_within_bucket_precision(self):
+        histogram = Histogram()
+        for us in range(1, 10_001):
+            histogram.record(us / 1_000_000)
+        for q in (0.5, 0.9, 0.99):
+            expected = q * 10_000 / 1_000_000
+            self.assertLessEqual(expected, histogram.quantile(q))
+            self.assertLess(histogram.quantile(q), expected * 1.07)
+        self.assertEqual(10_000, histogram.count)
+        self.assertEqual(0.0, Histogram().quantile(0.5))
+
+    def test_timer_as_block_and_decorator(self):
+        registry = Registry()
+        with timer("block", registry):
+            pass
+
+        @timer("call", registry, kind="sync")
+        def call(x):
+            return x * 2
+
+        self.assertEqual(4, call(2))
+        self.assertEqual(1, registry.histogram("function_duration_seconds", function="block").count)
+        self.assertEqual(1, registry.histogram("function_duration_seconds", function="call", kind="sync").count)
+
+    def test_middleware_labels_requests_by_route(self):
+        registry = Registry()
+        app = FastAPI()
+
+        @app.get("/items/{item_id}")
+        def read_item(item_id: int):
+            in_flight = registry.gauge("http_requests_in_flight", method="GET", route="/items/{item_id}")
+            return {"in_flight": in_flight.value}
+
+        install(app, registry=registry)
+        client = TestClient(app)
+        self.assertEqual({"in_flight": 1}, client.get("/items/1").json())
+        client.get("/items/2")
+        client.get("/items/x")
+        client.get("/nowhere")
+        text = client.get("/metrics").text
+        self.assertIn('http_request_duration_seconds_count{method="GET",route="/items/{item_id}"} 3', text)
+        self.assertIn('http_responses_total{method="GET",route="/items/{item_id}",status="200"} 2', text)
+        self.assertIn('http_responses_total{method="GET",route="/items/{item_id}",status="422"} 1', text)
+        self.assertIn('http_responses_total{method="GET",route="unmatched",status="404"} 1', text)
+        self.assertIn('http_requests_in_flight{method="GET",route="/items/{item_id}"} 0', text)
+        self.assertIn('http_request_duration_seconds_bucket{method="GET",route="/items/{item_id}",le="+Inf"} 3', text)
+        self.assertNotIn("/items/1", text)
+
+        for n in range(3):
+            client.request(f"MADEUP{n}", "/items/1")
+        text = client.get("/metrics").text
+        self.assertIn('http_request_duration_seconds_count{method="OTHER",route="/items/{item_id}"} 3', text)
+        self.assertNotIn("MADEUP", text)
+
+
+class TestAsyncTemplates(unittest.TestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        templates = os.path.join(self.dir.name, "templates")
+        os.makedirs(templates)
+        for name, source in {"card.html": "<b>{{ car }}</b>", "page.html": "{% for id, car in cars %}{{ fragment('card.html', id, car=car) }}{% endfor %}"}.items():
+            with open(os.path.join(templates, name), "w") as f:
+                f.write(source)
+        self.templates = CachedTemplates(directory=templates, enable_async=True)
+        self.request = Request({"type": "http", "method": "GET", "path": "/", "query_string": b"", "headers": [],
+                                "scheme": "http", "server": ("test", 80), "root_path": ""})
+
+    def tearDown(self) -> None:
+        self.dir.cleanup()
+
+    def render(self, cars, **context):
+        return asyncio.run(self.templates.render("page.html", {"request": self.request, "cars": cars, **context}))
+
+    def test_fragments_render_async_and_are_cached(self):
+        self.assertEqual(b"<b>A</b><b>B</b>", self.render([(1, "A"), (2, "B")]).body)
+        self.assertEqual(b"<b>A</b><b>B</b>", self.render([(1, "changed"), (2, "B")]).body) #cached per id
+        self.templates.fragments.invalidate(1)
+        response = self.render([(1, "changed"), (2, "B")])
+        self.assertEqual(b"<b>changed</b><b>B</b>", response.body)
+        self.assertIn("etag", response.headers)
+
+    def test_fragments_read_before_a_write_are_not_cached(self):
+        as_of = self.templates.fragments.generation
+        self.templates.fragments.invalidate(1) #lands after the handler read car 1
+        self.assertEqual(b"<b>old</b>", self.render([(1, "old")], fragments_as_of=as_of).body)
+        self.assertEqual(b"<b>new</b>", self.render([(1, "new")], fragments_as_of=self.templates.fragments.generation).body)
+        self.assertEqual(b"<b>new</b>", self.render([(1, "newer")]).body) #cached from then on
+
+    def test_static_pages(self):
+        first = asyncio.run(self.templates.render_static("card.html", {"request": self.request, "car": "A"}))
+        second = asyncio.run(self.templates.render_static("card.html", {"request": self.request, "car": "A"}))
+        self.assertEqual(b"<b>A</b>", second.body)
+        self.assertEqual(first.headers["etag"], second.headers["etag"])
+
+
+class TestResponses(unittest.TestCase):
+    def test_dumps_like_json_response(self):
+        content = {"name": "Plumbus", "price": 9.5, "tags": ["a", None], "ok": True, "é": "ü"}
+        self.assertEqual(JSONResponse(content).body, dumps(content))
+        self.assertEqual(JSONResponse(content).body, _json_dumps(content)) #the fallback without orjson
+        self.assertEqual(b'{"make":"A","year":2000,"sold":null}', dumps(Car(make="A", year=2000)))
+        self.assertEqual(b'{"make":"A","year":2000,"sold":null}', _json_dumps(Car(make="A", year=2000)))
+
+    def test_bytes_are_sent_as_they_are(self):
+        response = FastJSONResponse(b'{"a":1}')
+        self.assertEqual(b'{"a":1}', response.body)
+        self.assertEqual("application/json", response.media_type)
+
+    def test_encoded_until_replaced(self):
+        repo = MemoryRepository({"a": {"n": 1}, "b": {"n": 2}})
+        records = EncodedCache(repo)
+        views = EncodedCache(repo, view=lambda key, record: {"key": key, **record})
+        self.assertEqual(b'{"n":1}', records["a"])
+        self.assertIs(records["a"], records["a"])
+        self.assertEqual(b'{"key":"a","n":1}', views["a"])
+        self.assertEqual(b'{"a":{"n":1},"b":{"n":2}}', records.all())
+        repo["a"] = {"n": 3}
+        self.assertEqual(b'{"n":3}', records["a"])
+        self.assertEqual(b'{"key":"a","n":3}', views["a"])
+        self.assertEqual(b'{"a":{"n":3},"b":{"n":2}}', records.all())
+        del repo["b"]
+        self.assertEqual(b'{"a":{"n":3}}', records.all())
+        with self.assertRaises(KeyError):
+            records["b"]
+
+    def test_writes_that_land_while_encoding(self):
+        with tempfile.TemporaryDirectory() as directory:
+            repo = LogRepository(directory, "items", seed={"a": {"n": 1}}, refresh_interval=0)
+            other = LogRepository(directory, "items", refresh_interval=0) #another worker
+            try:
+                def write_meanwhile(key, record):
+                    other["b"] = {"n": len(other)}
+                    return record
+
+                records = EncodedCache(repo)
+                views = EncodedCache(repo, view=write_meanwhile)
+                results = []
+                reader = threading.Thread(target=lambda: results.extend([views["a"], records.all(), views["a"]]))
+                reader.start()
+                reader.join(5)
+                self.assertFalse(reader.is_alive()) #reads apply the other worker's write inline, which notifies the caches
+                self.assertEqual([b'{"n":1}', b'{"a":{"n":1},"b":{"n":1}}', b'{"n":1}'], results)
+            finally:
+                other.close()
+                repo.close()
+
+
+class TestOpenRepository(unittest.TestCase):
+    def test_memory_without_data_dir(self):
+        os.environ.pop("DATA_DIR", None)
+        repo = open_repository("users", seed={"migo": {}})
+        self.assertIsInstance(repo, MemoryRepository)
+        self.assertIn("migo", repo)
+
+
+if __name__ == "__main__":
+    unittest.main()